@@ -1,156 +1,404 @@
+"""
+Benchmarks for MiniGraph.
 
-import timeit
-
-print('Building a chain of 100 nodes 10000 times:')
-
-t = timeit.timeit(
-    stmt='mg.MiniGraph(edges=edges)',
-    setup='import minigraph as mg; edges = [(i, i+1, None, {}, True) for i in range(100)]',
-    number=10000)
-print('  MiniGraph (regular   ) : %f' % t)
-
-t = timeit.timeit(
-    stmt='mg.MiniGraph.fast_init(edges=edges)',
-    setup='import minigraph as mg; edges = [(i, i+1, None, {}, True) for i in range(100)]',
-    number=10000)
-print('  MiniGraph (fast_init ) : %f' % t)
-
-# t = timeit.timeit(
-#     stmt='mg.MiniGraph.fast_init2(nodes, edges=edges)',
-#     setup='import minigraph as mg; nodes=range(101); edges = [(i, i+1, None, {}, True) for i in range(100)]',
-#     number=10000)
-# print('  MiniGraph (fast_init2) : %f' % t)
-
-t = timeit.timeit(
-    stmt='nx.Graph(edges)',
-    setup='import networkx as nx; edges = [(i, i+1) for i in range(100)]',
-    number=10000
-)
-print('  NetworkX Graph         : %f' % t)
-
-t = timeit.timeit(
-    stmt='nx.DiGraph(edges)',
-    setup='import networkx as nx; edges = [(i, i+1) for i in range(100)]',
-    number=10000
-)
-print('  NetworkX DiGraph       : %f' % t)
-
-t = timeit.timeit(
-    stmt='nx.MultiGraph(edges)',
-    setup='import networkx as nx; edges = [(i, i+1) for i in range(100)]',
-    number=10000
-)
-print('  NetworkX MultiGraph  : %f' % t)
-
-t = timeit.timeit(
-    stmt='nx.MultiDiGraph(edges)',
-    setup='import networkx as nx; edges = [(i, i+1) for i in range(100)]',
-    number=10000
-)
-print('  NetworkX MultiDiGraph  : %f' % t)
-
-
-print('Building a fully-connected 10-node graph 10000 times:')
-
-t = timeit.timeit(
-    stmt='mg.MiniGraph(edges=edges)',
-    setup='import minigraph as mg; edges = [(i, j, None, {}, True) for i in range(10) for j in range(10)]',
-    number=10000)
-print('  MiniGraph (regular   ) : %f' % t)
-
-t = timeit.timeit(
-    stmt='mg.MiniGraph.fast_init(edges=edges)',
-    setup='import minigraph as mg; edges = [(i, j, None, {}, True) for i in range(10) for j in range(10)]',
-    number=10000)
-print('  MiniGraph (fast_init ) : %f' % t)
-
-# t = timeit.timeit(
-#     stmt='mg.MiniGraph.fast_init2(nodes, edges=edges)',
-#     setup='import minigraph as mg; nodes=range(10); edges = [(i, j, None, {}, True) for i in range(10) for j in range(10)]',
-#     number=10000)
-# print('  MiniGraph (fast_init2) : %f' % t)
-
-t = timeit.timeit(
-    stmt='nx.Graph(edges)',
-    setup='import networkx as nx; edges = [(i, j) for i in range(10) for j in range(10)]',
-    number=10000
-)
-print('  NetworkX Graph     : %f' % t)
-
-t = timeit.timeit(
-    stmt='nx.DiGraph(edges)',
-    setup='import networkx as nx; edges = [(i, j) for i in range(10) for j in range(10)]',
-    number=10000
-)
-print('  NetworkX DiGraph     : %f' % t)
-
-t = timeit.timeit(
-    stmt='nx.MultiGraph(edges)',
-    setup='import networkx as nx; edges = [(i, j) for i in range(10) for j in range(10)]',
-    number=10000
-)
-print('  NetworkX MultiGraph: %f' % t)
-
-t = timeit.timeit(
-    stmt='nx.MultiDiGraph(edges)',
-    setup='import networkx as nx; edges = [(i, j) for i in range(10) for j in range(10)]',
-    number=10000
-)
-print('  NetworkX MultiDiGraph: %f' % t)
-
-
-print('Building a 4x-connected 5x5-node graph 10000 times:')
-
-t = timeit.timeit(
-    stmt='mg.MiniGraph(edges=edges)',
-    setup='import minigraph as mg; edges = [(i, j, l, {}, True) for l in ("one", "two", "three", "four") for i in range(5) for j in range(5)]',
-    number=10000)
-print('  MiniGraph (regular   ) : %f' % t)
-
-t = timeit.timeit(
-    stmt='mg.MiniGraph.fast_init(edges=edges)',
-    setup='import minigraph as mg; edges = [(i, j, l, {}, True) for l in ("one", "two", "three", "four") for i in range(5) for j in range(5)]',
-    number=10000)
-print('  MiniGraph (fast_init ) : %f' % t)
-
-# t = timeit.timeit(
-#     stmt='mg.MiniGraph.fast_init2(nodes, edges=edges)',
-#     setup='import minigraph as mg; nodes=range(5); edges = [(i, j, l, {}, True) for l in ("one", "two", "three", "four") for i in range(5) for j in range(5)]',
-#     number=10000)
-# print('  MiniGraph (fast_init2) : %f' % t)
-
-t = timeit.timeit(
-    stmt='nx.MultiGraph(edges)',
-    setup='import networkx as nx; edges = [(i, j, {"label": l}) for l in ("one", "two", "three", "four") for i in range(5) for j in range(5)]',
-    number=10000
-)
-print('  NetworkX MultiGraph: %f' % t)
-
-t = timeit.timeit(
-    stmt='nx.MultiDiGraph(edges)',
-    setup='import networkx as nx; edges = [(i, j, {"label": l}) for l in ("one", "two", "three", "four") for i in range(5) for j in range(5)]',
-    number=10000
-)
-print('  NetworkX MultiDiGraph: %f' % t)
-
-# print('Retrieving nodes from the 10-node graph 10000 times:')
-
-# t = timeit.timeit(
-#     stmt='g.node(5)',
-#     setup='import minigraph as mg; '
-#           'edges = [(i, j, l, {}, True) for l in ("one", "two", "three", "four") '
-#           'for i in range(10) for j in range(5)]; '
-#           'g = mg.MiniGraph(edges=edges)',
-#     number=10000)
-# print('  MiniGraph (directed) : %f' % t)
-
-# print('Retrieving edges from the 10-node graph 10000 times:')
-
-# t = timeit.timeit(
-#     stmt='g.edge(1,4,"one")',
-#     setup='import minigraph as mg; '
-#           'edges = [(i, j, l, {}, True) for l in ("one", "two", "three", "four") '
-#           'for i in range(10) for j in range(5)]; '
-#           'g = mg.MiniGraph(edges=edges)',
-#     number=10000)
-# print('  MiniGraph (directed) : %f' % t)
+Each benchmark is run over synthetic graphs of several sizes and
+reports operations per second and the peak memory (via tracemalloc)
+of one run; the memory benchmarks report the bytes per edge retained
+by a built graph. Results can be written as JSON and compared against
+a stored baseline:
+
+    python benchmarks.py --json results.json
+    python benchmarks.py --sizes 10,1000 --baseline results.json
+
+With --baseline, the exit status is 1 if any benchmark is slower (or
+retains more memory) than the baseline by more than --threshold.
+Benchmarks of methods the measured version of MiniGraph lacks are
+skipped, and those raising an error are reported as failed. NetworkX
+comparisons are only run with --networkx (and if NetworkX is
+installed).
+"""
+
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+import minigraph as mg
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+LABELS = (None, 'a', 'b', 'c')
+
+
+def synthetic_edges(nedges, seed=1):
+    """
+    Return *nedges* random 5-tuple edges over `nedges // 4 + 2` nodes.
+
+    About a quarter of the edges are undirected, and (start, end, label)
+    triples are unique so every edge is kept by the graph. The edges
+    are normalized, with a dict for data, so they can also be given to
+    fast_init() and fast_init2().
+    """
+    rnd = random.Random(seed)
+    n = nedges // 4 + 2
+    seen = set()
+    edges = []
+    while len(edges) < nedges:
+        start = rnd.randrange(n)
+        end = rnd.randrange(n)
+        label = rnd.choice(LABELS)
+        if (start, end, label) in seen or (end, start, label) in seen:
+            continue
+        seen.add((start, end, label))
+        data = {'w': rnd.random()} if rnd.random() < 0.1 else {}
+        edges.append((start, end, label, data, rnd.random() >= 0.25))
+    return edges
+
+
+# Benchmarks take the edge list and return (setup, op, ops), where
+# setup() makes fresh state for one run of op(state), which performs
+# ops operations. Only op() is timed.
+
+def _build(edges):
+    return mg.MiniGraph(edges=edges)
+
+def bench_init(edges):
+    return (lambda: edges, lambda es: mg.MiniGraph(edges=es), len(edges))
+
+def bench_fast_init(edges):
+    return (lambda: edges, lambda es: mg.MiniGraph.fast_init(edges=es),
+            len(edges))
+
+def bench_fast_init2(edges):
+    nodes = sorted(set(e[0] for e in edges) | set(e[1] for e in edges))
+    return (lambda: edges,
+            lambda es: mg.MiniGraph.fast_init2(nodes, edges=es),
+            len(edges))
+
+def bench_add_edge(edges):
+    def op(g):
+        add_edge = g.add_edge
+        for start, end, label, data, directed in edges:
+            add_edge(start, end, label, data, directed)
+    return (mg.MiniGraph, op, len(edges))
+
+def bench_remove_node(edges):
+    g = _build(edges)
+    nodeids = [nid for nid, _ in g.nodes()][::10]
+    def op(g):
+        for nid in nodeids:
+            g.remove_node(nid)
+    return (lambda: _build(edges), op, len(nodeids))
+
+def bench_remove_nodes(edges):
+    g = _build(edges)
+    nodeids = [nid for nid, _ in g.nodes()][::2]
+    return (lambda: _build(edges), lambda g: g.remove_nodes(nodeids),
+            len(nodeids))
+
+def bench_remove_edge(edges):
+    triples = [(e[0], e[1], e[2]) for e in edges[::10]]
+    def op(g):
+        for start, end, label in triples:
+            g.remove_edge(start, end, label)
+    return (lambda: _build(edges), op, len(triples))
+
+def bench_subgraph(edges):
+    g = _build(edges)
+    nodeids = [nid for nid, _ in g.nodes()][::2]
+    return (lambda: g, lambda g: g.subgraph(nodeids), 1)
+
+def bench_edges(edges):
+    g = _build(edges)
+    return (lambda: g, lambda g: g.edges(), 1)
+
+def bench_nodes(edges):
+    g = _build(edges)
+    return (lambda: g, lambda g: g.nodes(), 1)
+
+def bench_degree(edges):
+    g = _build(edges)
+    nodeids = [nid for nid, _ in g.nodes()]
+    def op(g):
+        degree = g.degree
+        for nid in nodeids:
+            degree(nid)
+    return (lambda: g, op, len(nodeids))
+
+def bench_find_edges_label(edges):
+    g = _build(edges)
+    return (lambda: g, lambda g: list(g.find_edges(label='a')), 1)
+
+def bench_find_edges_start(edges):
+    g = _build(edges)
+    nodeids = [nid for nid, _ in g.nodes()][:100]
+    def op(g):
+        for nid in nodeids:
+            list(g.find_edges(start=nid))
+    return (lambda: g, op, len(nodeids))
+
+def bench_slice(edges):
+    g = _build(edges)
+    nodeids = [nid for nid, _ in g.nodes()][:100]
+    def op(g):
+        for nid in nodeids:
+            list(g[nid::'b'])
+    return (lambda: g, op, len(nodeids))
+
+
+# Memory benchmarks take the edge list and return a function building
+# the graph to measure.
+
+def _chain(edges):
+    # a chain as long as the edge list, as in the original benchmark of
+    # the memory per edge
+    return [(i, i + 1) for i in range(len(edges))]
+
+def mem_chain(edges):
+    chain = _chain(edges)
+    return lambda: mg.MiniGraph(edges=chain)
+
+def mem_chain_frozen(edges):
+    chain = _chain(edges)
+    return lambda: mg.MiniGraph(edges=chain).freeze()
+
+def mem_synthetic(edges):
+    return lambda: mg.MiniGraph(edges=edges)
+
+
+def _nx_edges(edges):
+    return [(s, t, {'label': l}) for s, t, l, _, _ in edges]
+
+def bench_nx_init(edges):
+    import networkx as nx
+    nxedges = _nx_edges(edges)
+    return (lambda: nxedges, nx.MultiDiGraph, len(edges))
+
+def bench_nx_edges(edges):
+    import networkx as nx
+    g = nx.MultiDiGraph(_nx_edges(edges))
+    return (lambda: g, lambda g: list(g.edges(data=True)), 1)
+
+def bench_nx_degree(edges):
+    import networkx as nx
+    g = nx.MultiDiGraph(_nx_edges(edges))
+    nodeids = list(g.nodes())
+    def op(g):
+        degree = g.degree
+        for nid in nodeids:
+            degree(nid)
+    return (lambda: g, op, len(nodeids))
+
+def bench_nx_subgraph(edges):
+    import networkx as nx
+    g = nx.MultiDiGraph(_nx_edges(edges))
+    nodeids = list(g.nodes())[::2]
+    return (lambda: g, lambda g: g.subgraph(nodeids).copy(), 1)
+
+
+BENCHMARKS = [
+    ('init', bench_init),
+    ('fast_init', bench_fast_init),
+    ('fast_init2', bench_fast_init2),
+    ('add_edge', bench_add_edge),
+    ('remove_node', bench_remove_node),
+    ('remove_nodes', bench_remove_nodes),
+    ('remove_edge', bench_remove_edge),
+    ('subgraph', bench_subgraph),
+    ('edges', bench_edges),
+    ('nodes', bench_nodes),
+    ('degree', bench_degree),
+    ('find_edges_label', bench_find_edges_label),
+    ('find_edges_start', bench_find_edges_start),
+    ('slice', bench_slice),
+]
+
+MEMORY_BENCHMARKS = [
+    ('memory_chain', mem_chain),
+    ('memory_chain_frozen', mem_chain_frozen),
+    ('memory_synthetic', mem_synthetic),
+]
+
+NX_BENCHMARKS = [
+    ('nx_init', bench_nx_init),
+    ('nx_edges', bench_nx_edges),
+    ('nx_degree', bench_nx_degree),
+    ('nx_subgraph', bench_nx_subgraph),
+]
+
+
+def measure(bench, edges, repeat=5, min_time=0.05):
+    """
+    Run *bench* on *edges* and return a result dict.
+
+    Each of *repeat* runs times enough calls of the operation to take
+    at least *min_time* seconds; the fastest run is reported.
+    """
+    setup, op, ops = bench(edges)
+    # calibrate the number of calls per run
+    number = 1
+    while True:
+        elapsed = _run(setup, op, number)
+        if elapsed >= min_time or number >= 10000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    best = min([elapsed] + [_run(setup, op, number)
+                            for _ in range(repeat - 1)])
+    state = setup()
+    tracemalloc.start()
+    op(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    seconds = best / number
+    return {
+        'seconds': seconds,
+        'ops_per_sec': ops / seconds if seconds else float('inf'),
+        'peak_memory': peak,
+    }
+
+def measure_memory(bench, edges):
+    """
+    Return a result dict with the bytes per edge retained by the graph
+    built by *bench* on *edges*.
+    """
+    build = bench(edges)
+    gc.collect()
+    tracemalloc.start()
+    g = build()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {'bytes_per_edge': retained / max(1, g.size())}
+
+def _run(setup, op, number):
+    # like timeit, keep the garbage collector out of the timings
+    states = [setup() for _ in range(number)]
+    gc.disable()
+    try:
+        t = time.perf_counter()
+        for state in states:
+            op(state)
+        return time.perf_counter() - t
+    finally:
+        gc.enable()
+
+
+def run(sizes, names=None, networkx=False, repeat=5, out=sys.stdout):
+    benchmarks = list(BENCHMARKS) + list(MEMORY_BENCHMARKS)
+    memory = set(name for name, _ in MEMORY_BENCHMARKS)
+    if networkx:
+        try:
+            import networkx
+        except ImportError:
+            print('NetworkX is not installed; skipping its benchmarks',
+                  file=out)
+        else:
+            benchmarks.extend(NX_BENCHMARKS)
+    if names:
+        benchmarks = [(name, b) for name, b in benchmarks if name in names]
+    results = []
+    for size in sizes:
+        edges = synthetic_edges(size)
+        print('{} edges:'.format(size), file=out)
+        for name, bench in benchmarks:
+            try:
+                if name in memory:
+                    result = measure_memory(bench, edges)
+                else:
+                    result = measure(bench, edges, repeat=repeat)
+            except AttributeError:
+                # e.g., a method missing from an older MiniGraph
+                print('  {:<18} {:>14}'.format(name, 'skipped'), file=out)
+                continue
+            except Exception as exc:
+                # older versions may fail on some queries; report them
+                # without giving up on the other benchmarks
+                print('  {:<18} {:>14} {}'.format(name, 'failed',
+                                                  type(exc).__name__),
+                      file=out)
+                continue
+            result.update(name=name, size=size)
+            results.append(result)
+            if name in memory:
+                print('  {:<18} {:>14.1f} B/edge'
+                      .format(name, result['bytes_per_edge']), file=out)
+            else:
+                print('  {:<18} {:>14.1f} ops/s {:>12d} B peak'
+                      .format(name, result['ops_per_sec'],
+                              result['peak_memory']),
+                      file=out)
+    return results
+
+
+def compare(results, baseline, threshold=0.2, out=sys.stdout):
+    """
+    Print the change of each result against *baseline* and return the
+    list of (name, size) pairs that slowed down, or whose memory per
+    edge grew, by more than *threshold*. Ratios above 1 are better.
+    """
+    base = dict(((r['name'], r['size']), r) for r in baseline['results'])
+    regressions = []
+    print('Compared to baseline:', file=out)
+    for r in results:
+        key = (r['name'], r['size'])
+        if key not in base:
+            continue
+        if 'bytes_per_edge' in r:
+            ratio = base[key]['bytes_per_edge'] / r['bytes_per_edge']
+        else:
+            ratio = r['ops_per_sec'] / base[key]['ops_per_sec']
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print('  {:<18} {:>8d} {:>7.2f}x{}'.format(r['name'], r['size'],
+                                                   ratio, flag),
+              file=out)
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark MiniGraph.')
+    parser.add_argument(
+        '--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+        help='comma-separated edge counts (default: %(default)s)')
+    parser.add_argument(
+        '--only', help='comma-separated benchmark names to run')
+    parser.add_argument(
+        '--repeat', type=int, default=5, help='runs per benchmark')
+    parser.add_argument(
+        '--json', metavar='PATH', help='write results as JSON to PATH')
+    parser.add_argument(
+        '--baseline', metavar='PATH', help='compare against a JSON result')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='slowdown ratio flagged as a regression (default: %(default)s)')
+    parser.add_argument(
+        '--networkx', action='store_true', help='include NetworkX')
+    args = parser.parse_args(args)
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    names = args.only.split(',') if args.only else None
+    results = run(sizes, names=names, networkx=args.networkx,
+                  repeat=args.repeat)
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, threshold=args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
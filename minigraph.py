@@ -1,6 +1,28 @@
 
+import os
+import math
+import copyreg
+import sys
+import csv
+import json
+import mmap
+import pickle
+import struct
+import hashlib
+import random
 import warnings
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heappush, heappop
+from itertools import count, repeat, islice, groupby
+from contextlib import contextmanager
+from array import array
+from types import MappingProxyType
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 #Node = namedtuple('Node', ('id', 'data', 'edges', 'in_edges'))
 #Edge = namedtuple('Edge', ('start', 'end', 'label', 'data', 'directed'))
@@ -8,23 +30,77 @@ from collections import namedtuple, defaultdict
 class MiniGraphError(Exception): pass
 class MiniGraphWarning(Warning): pass
 
-# todo: consider functools.lru_cache for the retrieval methods
+# shared, read-only data for nodes and edges without any
+_EMPTY = MappingProxyType({})
+
+def _empty_data():
+    return _EMPTY
+
+def _reduce_mappingproxy(proxy):
+    # let edges with the shared empty data be pickled, e.g., to send
+    # them to other processes, and unpickle as the same object; other
+    # mapping proxies still cannot be pickled
+    if proxy is _EMPTY:
+        return (_empty_data, ())
+    raise TypeError("cannot pickle 'mappingproxy' object")
+
+copyreg.pickle(MappingProxyType, _reduce_mappingproxy)
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'maxsize', 'currsize'))
+GraphDelta = namedtuple('GraphDelta', (
+    'added_nodes', 'removed_nodes', 'changed_nodes',
+    'added_edges', 'removed_edges', 'changed_edges'))
 
 class MiniGraph(object):
 
-    __slots__ = ('_graph',)
+    __slots__ = ('_graph', '_degrees', '_labels', '_nedges', '_nundirected',
+                 '_label_index', '_components', '_owned', '_owned_edges',
+                 '_version', '_cache', '_hash', '_reach', '_node_indexes',
+                 '_edge_indexes', '_journal', '_undo')
 
     def __init__(self, nodes=None, edges=None):
 
         self._graph = {}
-        # nodes
-        if nodes is None:
-            nodes = {}
-        self.add_nodes(nodes)
-        # edges
-        if edges is None:
-            edges = {}
-        self.add_edges(edges)
+        # counters; _degrees maps node ids to [out, in, undirected]
+        # edge counts (undirected simple loops count as in and out) and
+        # _labels maps labels to [directed, undirected] edge counts
+        self._nedges = 0
+        self._nundirected = 0
+        # _label_index maps labels to the set of nodes having outgoing
+        # (or undirected) edges with that label; it, _degrees, and
+        # _labels are built by _count() when first needed and then kept
+        # up to date, so building a graph only fills the adjacency dicts
+        self._degrees = None
+        self._labels = None
+        self._label_index = None
+        # weakly connected components; built by the first query and
+        # then kept up to date until a removal sets it back to None
+        self._components = None
+        # after copy(), the set of nodes not shared with another graph
+        # and the (start, end, label) keys of edges whose data is not
+        # shared; None if the graph was never copied and owns everything
+        self._owned = None
+        self._owned_edges = None
+        # bumped by every change, so cached query results can tell when
+        # they are stale; the cache is None unless enable_cache() is used
+        self._version = 0
+        self._cache = None
+        # (version, canonical_hash()) once computed
+        self._hash = None
+        # None unless enable_reachability_index() is used
+        self._reach = None
+        # data indexes map keys to {value: set of ids}, where edge ids
+        # are (start, end, label); None until an index is created
+        self._node_indexes = None
+        self._edge_indexes = None
+        # the list of changes while enable_journal() is in effect, and
+        # of the steps undoing them during a transaction()
+        self._journal = None
+        self._undo = None
+        if nodes is not None:
+            self.add_nodes(nodes)
+        if edges is not None:
+            self.add_edges(edges)
 
     @classmethod
     def fast_init(cls, nodes=None, edges=None):
@@ -52,6 +128,69 @@ class MiniGraph(object):
             mg._fast_add_edges2(edges)
         return mg
 
+    @classmethod
+    def from_arrays(cls, src, dst, labels=None, directed=None,
+                    node_ids=None, freeze=False):
+        """
+        Build a graph from parallel columns of edge starts (*src*),
+        ends (*dst*), *labels*, and *directed* flags. The columns may
+        be NumPy arrays, arrays, or other sequences. If *labels* is
+        `None`, every edge has the label `None`, and *directed* may be
+        a single value for all edges (`None` means `True`). If
+        *node_ids* is given, *src* and *dst* are integer positions in
+        it (others raise `MiniGraphError`) and every node in it is
+        added to the graph, otherwise they are node ids. If *freeze*
+        is `True`, a FrozenMiniGraph is built directly.
+
+        When NumPy is available, edges are deduplicated, checked, and
+        grouped by node and label with vectorized sorts, and the
+        adjacency dicts are built a group at a time. Node ids and
+        labels keep their Python types either way; only typed arrays
+        are interned by NumPy.
+        """
+        if numpy is None:
+            return _from_columns(cls, src, dst, labels, directed,
+                                 node_ids, freeze)
+        cols = _prepare_columns(src, dst, labels, directed, node_ids)
+        if freeze:
+            return _frozen_from_columns(*cols)
+        return _graph_from_columns(cls, *cols)
+
+    @classmethod
+    def from_edges(cls, edges, freeze=False):
+        """
+        Build a graph from an iterable of *edges*, e.g., from
+        read_edges(), as from_arrays() does from columns. The edges are
+        consumed one at a time: node ids and labels are interned and
+        each edge is kept as integer positions in arrays, so an edge
+        list too large to hold as tuples can still be turned into a
+        FrozenMiniGraph (with *freeze*) and written with write_mmap().
+        Memory use still grows with the number of edges; the graph is
+        not built out of core. Edge data is not kept in the columns,
+        so an edge with data raises `MiniGraphError`; use add_edges()
+        for those.
+        """
+        ids, lbls, src, dst, labels, directed = _edge_columns(edges)
+        if numpy is None:
+            return _from_columns(cls, src, dst, [lbls[i] for i in labels],
+                                 directed, ids, freeze)
+        cols = _prepare_columns(src, dst, labels, directed, ids, lbls)
+        if freeze:
+            return _frozen_from_columns(*cols)
+        return _graph_from_columns(cls, *cols)
+
+    @staticmethod
+    def open_mmap(path):
+        """
+        Return a FrozenMiniGraph for the file at *path* written by
+        FrozenMiniGraph.write_mmap(). The edge and link arrays are
+        read through memoryviews of the memory-mapped file, so they
+        are not loaded or copied and processes opening the same file
+        share the page cache; only the node id, label, and data tables
+        are unpickled.
+        """
+        return _open_mmap(path)
+
     def __getitem__(self, idx):
         """
         Fancy graph queries:
@@ -63,242 +202,694 @@ class MiniGraph(object):
             can be retrieved with g[::...].
         """
 
-        try:
-            start, end, label = idx.start, idx.stop, idx.step
-            if label is Ellipsis:
-                return self.find_edges(start, end)
-            else:
-                return self.find_edges(start, end, label=label)
-        except AttributeError:
-            return (idx, self.nodes[idx])
+        if isinstance(idx, slice):
+            return self.find_edges(idx.start, idx.stop, label=idx.step)
+        else:
+            return (idx, self._graph[idx][1])
 
     def add_node(self, nodeid, data=None):
+        """
+        Add node *nodeid*, or merge *data* into the data of an existing
+        node. Nodes without data share one empty, read-only mapping,
+        so writing to it, e.g., `g.node(x)[1]['k'] = v`, raises a
+        `TypeError`; use `g.add_node(x, {'k': v})` instead, which
+        gives the node a dict of its own.
+        """
         # if nodeid in self.nodes:
         #     raise MiniGraphError('Node already exists: {}'.format(nodeid))
         #self.nodes[nodeid] = dict(data or [])
-        if data is None:
-            data = {}
-        if nodeid in self._graph:
-            self._graph[nodeid][1].update(data)
+        self._version += 1
+        g = self._graph
+        indexes = self._node_indexes
+        if self._journal is not None:
+            self._journal.append(
+                ('add_node', nodeid, dict(data) if data else None))
+        if nodeid in g:
+            if data:
+                if self._owned is not None:
+                    self._own(nodeid)
+                n = g[nodeid]
+                if self._undo is not None:
+                    self._undo.append(('node_data', nodeid, _copy_data(n[1])))
+                # nodes without data share an empty, read-only mapping
+                if n[1] is _EMPTY:
+                    g[nodeid] = (nodeid, dict(data), n[2], n[3])
+                else:
+                    if indexes is not None:
+                        _unindex_data(indexes, n[1], nodeid)
+                    n[1].update(data)
+                if indexes is not None:
+                    _index_data(indexes, g[nodeid][1], nodeid)
         else:
-            self._graph[nodeid] = (nodeid, data, {}, {})
+            g[nodeid] = (nodeid, data or _EMPTY, {}, {})
+            if indexes is not None and data:
+                _index_data(indexes, data, nodeid)
+            if self._undo is not None:
+                self._undo.append(('remove_node', nodeid))
+            if self._degrees is not None:
+                self._degrees[nodeid] = [0, 0, 0]
+            if self._components is not None:
+                self._components.add(nodeid)
+            if self._owned is not None:
+                self._owned.add(nodeid)
+        reach = self._reach
+        if reach is not None and reach.version == self._version - 1:
+            if reach.order is not None:
+                reach.add_node(nodeid)
+            reach.version = self._version
 
     def add_nodes(self, nodes):
         for node in nodes:
             try:
                 node, data = node
             except TypeError:
-                data = {}
+                data = None
             self.add_node(node, data=data)
 
     def remove_node(self, nodeid):
+        if (self._owned is not None or self._components is not None or
+                self._node_indexes is not None or
+                self._edge_indexes is not None or
+                self._journal is not None or self._undo is not None):
+            self.remove_nodes((nodeid,))
+            return
+        # a single node without bookkeeping to keep up to date only
+        # needs its links removed from its neighbors
         g = self._graph
-        if nodeid not in g:
-            raise KeyError(nodeid)
-        _prune_edges(g, nodeid)
+        n = g[nodeid]
+        self._version += 1
+        index = self._label_index
+        uncount = self._uncount_edge
+        for label, ed in n[2].items():
+            for end, e in ed.items():
+                uncount(e)
+                if end == nodeid:
+                    continue
+                links = g[end][3]
+                inner = links[label]
+                del inner[nodeid]
+                if not inner:
+                    del links[label]
+                # undirected links are listed at both ends
+                if e[4] is False:
+                    links = g[end][2]
+                    inner = links[label]
+                    del inner[nodeid]
+                    if not inner:
+                        del links[label]
+                        if index is not None:
+                            _unindex(index, label, end)
+        for label, ed in n[3].items():
+            for start, e in ed.items():
+                if start == nodeid or e[4] is False:
+                    continue
+                uncount(e)
+                links = g[start][2]
+                inner = links[label]
+                del inner[nodeid]
+                if not inner:
+                    del links[label]
+                    if index is not None:
+                        _unindex(index, label, start)
+        if self._degrees is not None:
+            for label in n[2]:
+                _unindex(index, label, nodeid)
+            del self._degrees[nodeid]
         del g[nodeid]
 
+    def remove_nodes(self, nodeids):
+        """
+        Remove each node in *nodeids* and all of their edges.
+
+        All nodes are checked before any is removed, so a `KeyError`
+        for a missing node leaves the graph unchanged.
+        """
+        g = self._graph
+        nodeids = set(nodeids)
+        for nodeid in nodeids:
+            if nodeid not in g:
+                raise KeyError(nodeid)
+        self._version += 1
+        if self._owned is not None:
+            own = self._own
+            for nodeid in nodeids:
+                n = g[nodeid]
+                for links in (n[2], n[3]):
+                    for ed in links.values():
+                        for nid in ed:
+                            own(nid)
+        uf = self._components
+        if uf is not None:
+            # isolated nodes were never merged, so they can be dropped
+            # without recomputing the components
+            if all(not g[nid][2] and not g[nid][3] for nid in nodeids):
+                for nodeid in nodeids:
+                    uf.discard(nodeid)
+            else:
+                self._components = None
+        if self._journal is not None:
+            self._journal.extend(('remove_node', nid) for nid in nodeids)
+        if self._undo is not None:
+            # nodes are restored before their edges
+            edges = {}
+            for nodeid in nodeids:
+                n = g[nodeid]
+                for links in (n[2], n[3]):
+                    for ed in links.values():
+                        for e in ed.values():
+                            edges[(e[0], e[1], e[2])] = e
+            self._undo.extend(('add_edge', e) for e in edges.values())
+            self._undo.extend(('add_node', nid, g[nid][1]) for nid in nodeids)
+        if self._node_indexes is not None:
+            for nodeid in nodeids:
+                _unindex_data(self._node_indexes, g[nodeid][1], nodeid)
+        if self._edge_indexes is not None:
+            for nodeid in nodeids:
+                n = g[nodeid]
+                for links in (n[2], n[3]):
+                    for ed in links.values():
+                        for e in ed.values():
+                            if e[3]:
+                                _unindex_data(self._edge_indexes, e[3],
+                                              (e[0], e[1], e[2]))
+        self._prune_edges(nodeids)
+        if self._degrees is not None:
+            index = self._label_index
+            for nodeid in nodeids:
+                for label in g[nodeid][2]:
+                    _unindex(index, label, nodeid)
+                del self._degrees[nodeid]
+        for nodeid in nodeids:
+            del g[nodeid]
+
+    def _prune_edges(self, nodeids):
+        graph = self._graph
+        degrees = self._degrees
+        # edges counted by label as [directed, undirected]
+        counts = defaultdict(lambda: [0, 0])
+        # links on remaining neighbors, grouped by neighbor so that
+        # emptied label dicts are deleted once per neighbor
+        inlinks = defaultdict(list)
+        outlinks = defaultdict(list)
+        for nodeid in nodeids:
+            n = graph[nodeid]
+            # every incident edge is in the forward links of one of its
+            # ends; an undirected edge between two removed nodes is only
+            # counted from its start
+            for label, ed in n[2].items():
+                count = counts[label]
+                for end, e in ed.items():
+                    if end in nodeids:
+                        if e[4] is not False:
+                            count[0] += 1
+                        elif e[0] == nodeid:
+                            count[1] += 1
+                        continue
+                    if e[4] is False:
+                        count[1] += 1
+                        if degrees is not None:
+                            degrees[end][2] -= 1
+                    else:
+                        count[0] += 1
+                        if degrees is not None:
+                            degrees[end][1] -= 1
+                    inlinks[end].append((label, nodeid))
+            for label, ed in n[3].items():
+                count = counts[label]
+                for start, e in ed.items():
+                    if start in nodeids:
+                        continue
+                    if e[4] is not False:
+                        count[0] += 1
+                        if degrees is not None:
+                            degrees[start][0] -= 1
+                    outlinks[start].append((label, nodeid))
+        _unlink(graph, inlinks, 3, None)
+        _unlink(graph, outlinks, 2, self._label_index)
+        labels = self._labels
+        for label, (ndirected, nundirected) in counts.items():
+            if labels is not None:
+                c = labels[label]
+                c[0] -= ndirected
+                c[1] -= nundirected
+                if c[0] == c[1] == 0:
+                    del labels[label]
+            self._nedges -= ndirected + nundirected
+            self._nundirected -= nundirected
+
     def node(self, nodeid):
         return self._graph[nodeid]
 
     def nodes(self):
+        if self._cache is not None:
+            return list(self._cached(('nodes',), self._nodes))
+        return self._nodes()
+
+    def _nodes(self):
         return [(nid, n[1]) for nid, n in self._graph.items()]
 
+    def iter_nodes(self):
+        """
+        Iterate over (nodeid, data) pairs without building a list.
+        """
+        for nid, n in self._graph.items():
+            yield (nid, n[1])
+
+    def successors(self, nodeid):
+        """
+        Iterate over the ids of nodes linked from *nodeid* by directed
+        edges starting at *nodeid* or by undirected edges.
+        """
+        return _link_nodes(self._graph[nodeid][2])
+
+    def predecessors(self, nodeid):
+        """
+        Iterate over the ids of nodes linking to *nodeid* by directed
+        edges ending at *nodeid* or by undirected edges.
+        """
+        return _link_nodes(self._graph[nodeid][3])
+
+    def neighbors(self, nodeid):
+        """
+        Iterate over the ids of nodes adjacent to *nodeid* by any edge.
+        """
+        n = self._graph[nodeid]
+        return _link_nodes(n[2], n[3])
+
     def add_edge(self, start, end, label=None, data=None, directed=True):
-        self.add_edges([(start, end, label, data, directed)])
+        """
+        Add an edge, or merge *data* into the data of an existing edge
+        with the same *start*, *end*, and *label*. As with nodes, edges
+        without data share a read-only empty mapping; add the edge again
+        with *data* to change it.
+        """
+        self._insert_edges(((start, end, label, data, directed),), True,
+                           normalize=True)
 
-    #@profile
     def add_edges(self, edges):
-        g = self._graph
-        add_edge = _add_edge
+        self._insert_edges(edges, True, normalize=True)
 
-        for edge in edges:
-            edgelen = len(edge)
-            if edgelen == 5:
-                start, end, label, data, directed = edge
-            elif edgelen == 2:
-                start, end = edge; label = data = None; directed = True
-            elif edgelen == 4:
-                start, end, label, data = edge; directed = True
-            elif edgelen == 3:
-                start, end, label = edge; data = None; directed = True
-            else:
-                raise MiniGraphError('Invalid edge: {}'.format(edge))
+    def _fast_add_edges1(self, edges):
+        self._insert_edges(edges, True)
+
+    def _fast_add_edges2(self, edges):
+        self._insert_edges(edges, False)
 
-            if data is None: data = {}
-            if start not in g: g[start] = (start, {}, {}, {})
-            if end not in g: g[end] = (end, {}, {}, {})
+    #@profile
+    def _insert_edges(self, edges, create_nodes, normalize=False):
+        """
+        Insert 5-tuple *edges* into the adjacency dicts, updating the
+        edge and degree counters. If *create_nodes* is `False`, all
+        endpoints must already exist in the graph. If *normalize* is
+        `True`, the edges are checked and made into 5-tuples first.
+        """
+        self._version += 1
+        if (self._degrees is None and self._owned is None and
+                self._components is None and self._edge_indexes is None and
+                self._journal is None and self._undo is None and
+                self._reach is None):
+            self._insert_new_edges(edges, create_nodes, normalize)
+            return
+        self._count()
+        if normalize:
+            edges = _normalize_edges(edges)
+        if self._reach is not None:
+            edges = list(edges)
+        g = self._graph
+        degrees = self._degrees
+        labels = self._labels
+        index = self._label_index
+        owned = self._owned
+        owned_edges = self._owned_edges
+        eindexes = self._edge_indexes
+        journal = self._journal
+        undo = self._undo
+        logged = journal is not None or undo is not None
+        # the union-find structure is updated inline for speed
+        uf = self._components
+        if uf is not None:
+            parent = uf.parent
+            sizes = uf.size
+        added = undirected = ncomponents = 0
 
-            e = (start, end, label, data, directed)
+        try:
+            for e in edges:
+                start, end, label, _, directed = e
+                if create_nodes:
+                    if start not in g:
+                        g[start] = (start, _EMPTY, {}, {})
+                        degrees[start] = [0, 0, 0]
+                        if undo is not None:
+                            undo.append(('remove_node', start))
+                        if uf is not None:
+                            parent[start] = start
+                            sizes[start] = 1
+                            ncomponents += 1
+                        if owned is not None:
+                            owned.add(start)
+                    if end not in g:
+                        g[end] = (end, _EMPTY, {}, {})
+                        degrees[end] = [0, 0, 0]
+                        if undo is not None:
+                            undo.append(('remove_node', end))
+                        if uf is not None:
+                            parent[end] = end
+                            sizes[end] = 1
+                            ncomponents += 1
+                        if owned is not None:
+                            owned.add(end)
+                if owned is not None:
+                    if start not in owned:
+                        self._own(start)
+                    if end not in owned:
+                        self._own(end)
+                s = g[start]
+                t = g[end]
 
-            #add_edge(g[start][2], label, end, e)
-            d = g[start][2]
-            if label not in d:
-                d[label] = innerdict = {}
-            else:
-                innerdict = d[label]
-            if end not in innerdict:
-                innerdict[end] = e
-            else:
-                if innerdict[end][4] != e[4]:
-                    raise MiniGraphError(
-                        'Cannot update directed and undirected edges.'
-                    )
-                innerdict[end][3].update(e[3])
-
-            
-            #add_edge(g[end][3], label, start, e)
-            d = g[end][3]
-            if label not in d:
-                d[label] = innerdict = {}
-            else:
-                innerdict = d[label]
-            if start not in innerdict:
-                innerdict[start] = e
-            else:
-                if innerdict[start][4] != e[4]:
-                    raise MiniGraphError(
-                        'Cannot update directed and undirected edges.'
-                    )
-                innerdict[start][3].update(e[3])
-
-            if directed is False:
-                #add_edge(g[end][2], label, start, e)
-                d = g[end][2]
-                if label not in d:
-                    d[label] = innerdict = {}
-                else:
-                    innerdict = d[label]
-                if start not in innerdict:
-                    innerdict[start] = e
-                else:
-                    if innerdict[start][4] != e[4]:
+                # an existing edge only has its data updated
+                d = s[2]
+                innerdict = d.get(label)
+                if innerdict is not None and end in innerdict:
+                    if innerdict[end][4] != directed:
                         raise MiniGraphError(
                             'Cannot update directed and undirected edges.'
                         )
-                    innerdict[start][3].update(e[3])
-
-                #add_edge(g[start][3], label, end, e)
-                d = g[start][3]
-                if label not in d:
-                    d[label] = innerdict = {}
-                else:
-                    innerdict = d[label]
-                if end not in innerdict:
-                    innerdict[end] = e
-                else:
-                    if innerdict[end][4] != e[4]:
+                    if e[3]:
+                        # edges without data share an empty, read-only
+                        # mapping, and edges in a copied graph may share
+                        # their data, so those get their own first
+                        old = innerdict[end]
+                        if undo is not None:
+                            undo.append(('edge_data', old[0], old[1], label,
+                                         _copy_data(old[3])))
+                        if owned is None:
+                            shared = False
+                        else:
+                            key = (old[0], old[1], label)
+                            shared = key not in owned_edges
+                            owned_edges.add(key)
+                        if old[3] is _EMPTY or shared:
+                            self._replace_edge(
+                                old, old[:3] + (dict(old[3]),) + old[4:])
+                        if eindexes is not None:
+                            key = (old[0], old[1], label)
+                            _unindex_data(eindexes, old[3], key)
+                            innerdict[end][3].update(e[3])
+                            _index_data(eindexes, innerdict[end][3], key)
+                        else:
+                            innerdict[end][3].update(e[3])
+                    if journal is not None:
+                        journal.append(('add_edge', start, end, label,
+                                        _copy_data(e[3]), directed))
+                    continue
+                # an undirected edge cannot overlap a directed one going
+                # the other way; check before anything is modified
+                if directed is False:
+                    d = t[2].get(label)
+                    if d is not None and start in d:
                         raise MiniGraphError(
                             'Cannot update directed and undirected edges.'
                         )
-                    innerdict[end][3].update(e[3])
 
-    def _fast_add_edges1(self, edges):
-        g = self._graph
-        add_edge = _add_edge
-
-        for e in edges:
-            start = e[0]
-            end = e[1]
-            label = e[2]
-            directed = e[4]
-            if start not in g:
-                g[start] = (start, {}, {}, {})
-            if end not in g:
-                g[end] = (end, {}, {}, {})
+                if innerdict is None:
+                    s[2][label] = {end: e}
+                    if label in index:
+                        index[label].add(start)
+                    else:
+                        index[label] = set([start])
+                else:
+                    innerdict[end] = e
+                if owned is not None:
+                    owned_edges.add((start, end, label))
+                if eindexes is not None and e[3]:
+                    _index_data(eindexes, e[3], (start, end, label))
+                if logged:
+                    if journal is not None:
+                        journal.append(('add_edge', start, end, label,
+                                        _copy_data(e[3]), directed))
+                    if undo is not None:
+                        undo.append(('remove_edge', start, end, label))
+                d = t[3]
+                if label in d:
+                    d[label][start] = e
+                else:
+                    d[label] = {start: e}
 
-            #add_edge(g[start][2], label, end, e)
-            d = g[start][2]
-            if label not in d:
-                d[label] = innerdict = {}
-            else:
-                innerdict = d[label]
-            if end not in innerdict:
-                innerdict[end] = e
-            else:
-                if innerdict[end][4] != e[4]:
-                    raise MiniGraphError(
-                        'Cannot update directed and undirected edges.'
-                    )
-                innerdict[end][3].update(e[3])
-
-            
-            #add_edge(g[end][3], label, start, e)
-            d = g[end][3]
-            if label not in d:
-                d[label] = innerdict = {}
-            else:
-                innerdict = d[label]
-            if start not in innerdict:
-                innerdict[start] = e
-            else:
-                if innerdict[start][4] != e[4]:
-                    raise MiniGraphError(
-                        'Cannot update directed and undirected edges.'
-                    )
-                innerdict[start][3].update(e[3])
-
-            if directed is False:
-                #add_edge(g[end][2], label, start, e)
-                d = g[end][2]
-                if label not in d:
-                    d[label] = innerdict = {}
+                # undirected edges are also stored in the reverse direction
+                if directed is False:
+                    d = t[2]
+                    if label in d:
+                        d[label][start] = e
+                    else:
+                        d[label] = {start: e}
+                        index[label].add(end)
+                    d = s[3]
+                    if label in d:
+                        d[label][end] = e
+                    else:
+                        d[label] = {end: e}
+                    undirected += 1
+                    if start != end:
+                        degrees[start][2] += 1
+                        degrees[end][2] += 1
+                    else:
+                        degrees[start][0] += 1
+                        degrees[end][1] += 1
+                    if label in labels:
+                        labels[label][1] += 1
+                    else:
+                        labels[label] = [0, 1]
                 else:
-                    innerdict = d[label]
-                if start not in innerdict:
-                    innerdict[start] = e
+                    degrees[start][0] += 1
+                    degrees[end][1] += 1
+                    if label in labels:
+                        labels[label][0] += 1
+                    else:
+                        labels[label] = [1, 0]
+                # join the components of the nodes; see _UnionFind
+                if uf is not None and start != end:
+                    a = start
+                    while parent[a] != a:
+                        parent[a] = a = parent[parent[a]]
+                    b = end
+                    while parent[b] != b:
+                        parent[b] = b = parent[parent[b]]
+                    if a != b:
+                        if sizes[a] < sizes[b]:
+                            a, b = b, a
+                        parent[b] = a
+                        sizes[a] += sizes.pop(b)
+                        ncomponents -= 1
+                added += 1
+        finally:
+            self._nedges += added
+            self._nundirected += undirected
+            if uf is not None:
+                uf.count += ncomponents
+        if self._reach is not None:
+            self._patch_reachability(edges)
+
+    def _insert_new_edges(self, edges, create_nodes, normalize):
+        # _insert_edges() for the common case of a graph that was not
+        # copied and has no counters, components, indexes, journal, or
+        # undo log to keep up to date; only the adjacency dicts and the
+        # edge counts change, and edges are normalized inline as in
+        # _normalize_edges()
+        g = self._graph
+        added = undirected = 0
+        try:
+            for e in edges:
+                if normalize:
+                    edgelen = len(e)
+                    if edgelen == 5:
+                        start, end, label, data, directed = e
+                    elif edgelen == 2:
+                        start, end = e; label = data = None; directed = True
+                    elif edgelen == 4:
+                        start, end, label, data = e; directed = True
+                    elif edgelen == 3:
+                        start, end, label = e; data = None; directed = True
+                    else:
+                        raise MiniGraphError('Invalid edge: {}'.format(e))
+                    if not data: data = _EMPTY
+                    e = (start, end, label, data, directed)
                 else:
-                    if innerdict[start][4] != e[4]:
+                    start, end, label, _, directed = e
+                if create_nodes:
+                    if start not in g:
+                        g[start] = (start, _EMPTY, {}, {})
+                    if end not in g:
+                        g[end] = (end, _EMPTY, {}, {})
+                s = g[start]
+                t = g[end]
+                innerdict = s[2].get(label)
+                if innerdict is not None and end in innerdict:
+                    old = innerdict[end]
+                    if old[4] != directed:
                         raise MiniGraphError(
                             'Cannot update directed and undirected edges.'
                         )
-                    innerdict[start][3].update(e[3])
-
-                #add_edge(g[start][3], label, end, e)
-                d = g[start][3]
-                if label not in d:
-                    d[label] = innerdict = {}
-                else:
-                    innerdict = d[label]
-                if end not in innerdict:
-                    innerdict[end] = e
-                else:
-                    if innerdict[end][4] != e[4]:
+                    if e[3]:
+                        if old[3] is _EMPTY:
+                            self._replace_edge(
+                                old, old[:3] + (dict(e[3]),) + old[4:])
+                        else:
+                            old[3].update(e[3])
+                    continue
+                if directed is False:
+                    d = t[2].get(label)
+                    if d is not None and start in d:
                         raise MiniGraphError(
                             'Cannot update directed and undirected edges.'
                         )
-                    innerdict[end][3].update(e[3])
+                if innerdict is None:
+                    s[2][label] = {end: e}
+                else:
+                    innerdict[end] = e
+                d = t[3]
+                if label in d:
+                    d[label][start] = e
+                else:
+                    d[label] = {start: e}
+                if directed is False:
+                    d = t[2]
+                    if label in d:
+                        d[label][start] = e
+                    else:
+                        d[label] = {start: e}
+                    d = s[3]
+                    if label in d:
+                        d[label][end] = e
+                    else:
+                        d[label] = {end: e}
+                    undirected += 1
+                added += 1
+        finally:
+            self._nedges += added
+            self._nundirected += undirected
 
-    def _fast_add_edges2(self, edges):
+    def _count(self):
+        # build the degree and label counters and the label index from
+        # the adjacency dicts if they are not kept up to date yet
+        if self._degrees is not None:
+            return
+        degrees = {}
+        labels = {}
+        index = {}
+        for nid, n in self._graph.items():
+            nout = nundirected = 0
+            for label, ed in n[2].items():
+                if label in index:
+                    index[label].add(nid)
+                else:
+                    index[label] = set([nid])
+                c = labels.get(label)
+                if c is None:
+                    c = labels[label] = [0, 0]
+                for other, e in ed.items():
+                    if e[4] is not False:
+                        nout += 1
+                        c[0] += 1
+                    elif other != nid:
+                        nundirected += 1
+                        # each undirected edge is listed at both ends
+                        if e[0] == nid:
+                            c[1] += 1
+                    else:
+                        # simple loops count as in and out edges
+                        nout += 1
+                        c[1] += 1
+            nin = 0
+            for ed in n[3].values():
+                for other, e in ed.items():
+                    if e[4] is not False or other == nid:
+                        nin += 1
+            degrees[nid] = [nout, nin, nundirected]
+        self._degrees = degrees
+        self._labels = labels
+        self._label_index = index
+
+    def _patch_reachability(self, edges):
+        # keep the reachability index current after adding *edges*;
+        # an index left behind is rebuilt by the next query
+        reach = self._reach
+        if (reach.version != self._version - 1 or reach.order is None or
+                len(edges) > _REACH_PATCH_LIMIT):
+            return
+        for start, end, _, _, directed in edges:
+            reach.add_node(start)
+            reach.add_node(end)
+            if directed is not False and not reach.add_edge(start, end):
+                return
+        reach.version = self._version
+
+    def _own(self, nodeid):
+        # copy a node shared with another graph before it is changed
+        owned = self._owned
+        if nodeid not in owned:
+            n = self._graph[nodeid]
+            self._graph[nodeid] = (
+                nodeid,
+                _copy_data(n[1]),
+                dict((label, dict(ed)) for label, ed in n[2].items()),
+                dict((label, dict(ed)) for label, ed in n[3].items())
+            )
+            if self._degrees is not None:
+                self._degrees[nodeid] = list(self._degrees[nodeid])
+            owned.add(nodeid)
+
+    def _replace_edge(self, old, new):
+        # put *new* in every link dict holding the edge *old*
         g = self._graph
-        add_edge = _add_edge
-
-        for e in edges:
-            start = e[0]
-            end = e[1]
-            label = e[2]
-            directed = e[4]
-            add_edge(g[start][2], label, end, e)
-            add_edge(g[end][3], label, start, e)
-            if directed is False:
-                add_edge(g[end][2], label, start, e)
-                add_edge(g[start][3], label, end, e)
+        start, end, label = old[0], old[1], old[2]
+        g[start][2][label][end] = new
+        g[end][3][label][start] = new
+        if old[4] is False:
+            g[end][2][label][start] = new
+            g[start][3][label][end] = new
+
+    def _uncount_edge(self, e):
+        undirected = e[4] is False
+        if undirected:
+            self._nundirected -= 1
+        self._nedges -= 1
+        if self._degrees is None:
+            return
+        start = e[0]
+        end = e[1]
+        if undirected and start != end:
+            self._degrees[start][2] -= 1
+            self._degrees[end][2] -= 1
+        else:
+            self._degrees[start][0] -= 1
+            self._degrees[end][1] -= 1
+        counts = self._labels[e[2]]
+        counts[undirected] -= 1
+        if counts[0] == counts[1] == 0:
+            del self._labels[e[2]]
 
     def remove_edge(self, start, end, label=None, directed=None):
         g = self._graph
         if start not in g: raise KeyError(start)
+        if self._owned is not None and end in g:
+            self._own(start)
+            self._own(end)
         edges = g[start][2]
         if label not in edges: raise KeyError(label)
         if end not in edges[label]: raise KeyError(end)
-        _dir = g[start][2][label][end][4]
+        e = edges[label][end]
+        _dir = e[4]
         if directed is not None:
             assert _dir == directed
+        self._version += 1
 
         try:
             in_edges = g[end][3]
             del edges[label][end]
             if len(edges[label]) == 0:
                 del edges[label]
+                if self._label_index is not None:
+                    _unindex(self._label_index, label, start)
             del in_edges[label][start]
             if len(in_edges[label]) == 0:
                 del in_edges[label]
@@ -309,6 +900,8 @@ class MiniGraph(object):
                 del edges[label][start]
                 if len(edges[label]) == 0:
                     del edges[label]
+                    if self._label_index is not None:
+                        _unindex(self._label_index, label, end)
                 del in_edges[label][end]
                 if len(in_edges[label]) == 0:
                     del in_edges[label]
@@ -321,6 +914,84 @@ class MiniGraph(object):
                         start, end, label),
                 MiniGraphWarning
             )
+        self._uncount_edge(e)
+        if self._edge_indexes is not None and e[3]:
+            _unindex_data(self._edge_indexes, e[3], (e[0], e[1], e[2]))
+        if self._journal is not None:
+            self._journal.append(('remove_edge', e[0], e[1], e[2]))
+        if self._undo is not None:
+            self._undo.append(('add_edge', e))
+        # the components only change if no other edge joins the nodes
+        if self._components is not None and start != end:
+            if not (any(end in ed for ed in g[start][2].values()) or
+                    any(end in ed for ed in g[start][3].values())):
+                self._components = None
+
+    def remove_edges(self, edges):
+        """
+        Remove each edge in *edges*.
+
+        Edges are given as `(start, end)`, `(start, end, label)` or as
+        the 5-tuples returned by edges(). All edges are found before
+        any is removed, so a `KeyError` for a missing edge leaves the
+        graph unchanged.
+        """
+        g = self._graph
+        found = {}
+        for edge in edges:
+            edgelen = len(edge)
+            if edgelen == 2:
+                (start, end), label, directed = edge, None, None
+            elif edgelen == 3:
+                (start, end, label), directed = edge, None
+            elif edgelen == 5:
+                start, end, label, _, directed = edge
+            else:
+                raise MiniGraphError('Invalid edge: {}'.format(edge))
+            if start not in g: raise KeyError(start)
+            links = g[start][2]
+            if label not in links: raise KeyError(label)
+            if end not in links[label]: raise KeyError(end)
+            e = links[label][end]
+            if directed is not None and e[4] != directed:
+                raise KeyError(end)
+            key = (e[0], e[1], label)
+            if key in found:
+                raise KeyError(end)
+            found[key] = e
+        self._version += 1
+        if self._owned is not None:
+            for start, end, _ in found:
+                self._own(start)
+                self._own(end)
+        outlinks = defaultdict(list)
+        inlinks = defaultdict(list)
+        uncount = self._uncount_edge
+        for e in found.values():
+            start, end, label = e[0], e[1], e[2]
+            outlinks[start].append((label, end))
+            inlinks[end].append((label, start))
+            # undirected links are listed twice (except simple loops)
+            if e[4] is False and start != end:
+                outlinks[end].append((label, start))
+                inlinks[start].append((label, end))
+            uncount(e)
+            if self._edge_indexes is not None and e[3]:
+                _unindex_data(self._edge_indexes, e[3], (start, end, label))
+        if self._journal is not None:
+            self._journal.extend(('remove_edge',) + key for key in found)
+        if self._undo is not None:
+            self._undo.extend(('add_edge', e) for e in found.values())
+        _unlink(g, outlinks, 2, self._label_index)
+        _unlink(g, inlinks, 3, None)
+        # the components only change if no other edge joins the nodes
+        if self._components is not None:
+            for start, end, _ in found:
+                if start != end and \
+                        not (any(end in ed for ed in g[start][2].values()) or
+                             any(end in ed for ed in g[start][3].values())):
+                    self._components = None
+                    break
 
     def edge(self, start, end, label=None, directed=None):
         e = self._graph[start][2][label][end]
@@ -329,6 +1000,11 @@ class MiniGraph(object):
         return e
 
     def edges(self):
+        if self._cache is not None:
+            return list(self._cached(('edges',), self._edges))
+        return self._edges()
+
+    def _edges(self):
         return [e
             for nid, n in self._graph.items()
             for ed in n[2].values()
@@ -338,67 +1014,207 @@ class MiniGraph(object):
             if e[4] or e[0] == nid
         ]
 
-    def find_edges(self, start=None, end=None, **kwargs):
+    def iter_edges(self):
+        """
+        Iterate over the edges without building a list. As with
+        edges(), each undirected edge is only given once.
+        """
+        for nid, n in self._graph.items():
+            for ed in n[2].values():
+                for e in ed.values():
+                    if e[4] or e[0] == nid:
+                        yield e
+
+    def iter_out_edges(self, nodeid, label=Ellipsis):
+        """
+        Iterate over the edges going out of *nodeid*, including its
+        undirected edges. If *label* is given, only iterate over edges
+        with that label.
+        """
+        return _link_edges(self._graph[nodeid][2], label)
+
+    def iter_in_edges(self, nodeid, label=Ellipsis):
+        """
+        Iterate over the edges coming into *nodeid*, including its
+        undirected edges. If *label* is given, only iterate over edges
+        with that label.
+        """
+        return _link_edges(self._graph[nodeid][3], label)
+
+    def find_edges(self, start=None, end=None, label=Ellipsis,
+                   directed=None, data=None):
+        """
+        Return the list of edges matching the given constraints. An
+        unspecified *start* or *end* (`None` or `Ellipsis`) matches any
+        node and an unspecified *label* (`Ellipsis`) matches any label,
+        including `None`. If *directed* is `True` or `False`, only
+        directed or undirected edges are returned, and if *data* is a
+        dictionary, only edges whose data contain all of its items are
+        returned.
+        """
+        if self._cache is not None:
+            key = ('find_edges', start, end, label, directed,
+                   None if data is None else tuple(data.items()))
+            return list(self._cached(key, lambda: list(
+                self._find_edges(start, end, label, directed, data))))
+        return list(self._find_edges(start, end, label, directed, data))
+
+    def _find_edges(self, start, end, label, directed, data):
         if start is Ellipsis: start = None
         if end is Ellipsis: end = None
+        g = self._graph
+        anylabel = label is Ellipsis
+        ids = None
+        if start is None and end is None and data:
+            ids = _index_lookup(self._edge_indexes, data.items())
 
-        # get appropriate edge dicts (both if 'directed' is unspecified)
-        if 'directed' in kwargs:
-            if kwargs['directed'] is True: xs = [self.edges]
-            elif kwargs['directed'] is False: xs = [self.uedges]
-            else: xs = [self.edges, self.uedges]
-
-        # filter by start, if specified
-        if start is None:
-            xs = [(s, sd) for d in xs for s, sd in d.items()]
+        # pick the access path; only full scans over the forward links
+        # see undirected edges twice and need to be deduplicated
+        if start is not None:
+            if start not in g:
+                return
+            out = g[start][2]
+            if anylabel:
+                if end is None:
+                    xs = (e for ed in out.values() for e in ed.values())
+                else:
+                    xs = (ed[end] for ed in out.values() if end in ed)
+            elif label in out:
+                ed = out[label]
+                if end is None:
+                    xs = ed.values()
+                else:
+                    xs = [ed[end]] if end in ed else ()
+            else:
+                return
+        elif end is not None:
+            if end not in g:
+                return
+            in_ = g[end][3]
+            if anylabel:
+                xs = (e for ed in in_.values() for e in ed.values())
+            elif label in in_:
+                xs = in_[label].values()
+            else:
+                return
+        elif ids is not None:
+            xs = [g[s][2][lbl][t] for s, t, lbl in ids
+                  if anylabel or lbl == label]
+        elif anylabel:
+            xs = (e for nid, n in g.items()
+                    for ed in n[2].values()
+                    for e in ed.values()
+                    if e[4] is not False or e[0] == nid)
         else:
-            xs = [(start, d[start]) for d in xs if start in d]
+            self._count()
+            if label not in self._label_index:
+                return
+            xs = (e for nid in self._label_index[label]
+                    for e in g[nid][2][label].values()
+                    if e[4] is not False or e[0] == nid)
 
-        # filter by label, if specified
-        try:
-            lbl = kwargs['label']
-            xs = ((s, lbl, sd[lbl]) for s, sd in xs if lbl in sd)
-        except KeyError:
-            xs = ((s, lbl, ld) for s, sd in xs for lbl, ld in sd.items())
+        if directed is not None:
+            if directed:
+                xs = (e for e in xs if e[4] is not False)
+            else:
+                xs = (e for e in xs if e[4] is False)
+        if data:
+            items = list(data.items())
+            xs = (e for e in xs if _data_matches(e[3], items))
+        for e in xs:
+            yield e
 
-        # filter by end, if specified
-        if end is None:
-            xs = ((s, e, lbl, d) for s, lbl, ld in xs for e, d in ld.items())
-        else:
-            xs = ((s, end, lbl, ld[end]) for s, lbl, ld in xs if end in ld)
+    def create_node_index(self, key):
+        """
+        Index the nodes by the value of *key* in their data, so
+        find_nodes() can look them up instead of checking every node.
+        The index is kept up to date by the graph's methods, but not
+        when data dicts are changed directly. Values that are not
+        hashable are not indexed.
+        """
+        if self._node_indexes is None:
+            self._node_indexes = {}
+        index = {key: {}}
+        for nid, n in self._graph.items():
+            if n[1]:
+                _index_data(index, n[1], nid)
+        self._node_indexes.update(index)
 
-        # filter by data, if specified
-        try:
-            data = kwargs['data']
-            xs = filter(
-                lambda s,e,l,d: all(d.get(k) == v for k, v in data.items()),
-                xs
-            )
-        except KeyError:
-            pass
+    def create_edge_index(self, key):
+        """
+        Index the edges by the value of *key* in their data, for
+        find_edges() with a *data* argument. As with node indexes,
+        direct changes to data dicts are not tracked.
+        """
+        if self._edge_indexes is None:
+            self._edge_indexes = {}
+        index = {key: {}}
+        for e in self.iter_edges():
+            if e[3]:
+                _index_data(index, e[3], (e[0], e[1], e[2]))
+        self._edge_indexes.update(index)
+
+    def drop_node_index(self, key):
+        del self._node_indexes[key]
+        if not self._node_indexes:
+            self._node_indexes = None
 
-        return list(xs)
+    def drop_edge_index(self, key):
+        del self._edge_indexes[key]
+        if not self._edge_indexes:
+            self._edge_indexes = None
+
+    def find_nodes(self, **attrs):
+        """
+        Return the list of (nodeid, data) pairs of the nodes whose data
+        contain all of the items in *attrs*. If any of the keys are
+        indexed, only the nodes indexed under those values are checked.
+        """
+        g = self._graph
+        items = list(attrs.items())
+        ids = _index_lookup(self._node_indexes, items)
+        if ids is None:
+            return [(nid, n[1]) for nid, n in g.items()
+                    if _data_matches(n[1], items)]
+        return [(nid, g[nid][1]) for nid in ids
+                if _data_matches(g[nid][1], items)]
 
     def order(self):
         return len(self._graph)
 
-    def size(self):
-        return len(self.edges())
+    def size(self, label=Ellipsis, directed=None):
+        """
+        Return the number of edges in the graph. If *label* is given,
+        only count edges with that label. If *directed* is `True` or
+        `False`, only count directed or undirected edges, respectively.
+        """
+        if label is Ellipsis:
+            if directed is None:
+                return self._nedges
+            elif directed:
+                return self._nedges - self._nundirected
+            else:
+                return self._nundirected
+        self._count()
+        counts = self._labels.get(label, (0, 0))
+        if directed is None:
+            return counts[0] + counts[1]
+        return counts[not directed]
+
+    def labels(self):
+        self._count()
+        return list(self._labels)
 
     def degree(self, nodeid):
-        n = self._graph[nodeid]
-        return (
-            sum(len(ed) for ed in n[2].values()) +
-            len([
-                e for ed in n[3].values() for e in ed.values()
-                # only count undirected edges here if they are simple loops
-                if e[4] or e[0] == e[1]
-            ])
-        )
+        # undirected edges are counted once, except simple loops
+        self._count()
+        d = self._degrees[nodeid]
+        return d[0] + d[1] + d[2]
 
     def out_degree(self, nodeid):
-        n = self._graph[nodeid]
-        return sum(len(ed) for ed in n[2].values())
+        self._count()
+        d = self._degrees[nodeid]
+        return d[0] + d[2]
         # return (
         #     sum(len(ed) for ed in n[2].values()) +
         #     len([e  for ed in n[3].values()
@@ -407,8 +1223,9 @@ class MiniGraph(object):
         # )
 
     def in_degree(self, nodeid):
-        n = self._graph[nodeid]
-        return sum(len(ed) for ed in n[3].values())
+        self._count()
+        d = self._degrees[nodeid]
+        return d[1] + d[2]
         # return (
         #     sum(len(ed) for ed in n[3].values()) +
         #     len([e  for ed in n[2].values()
@@ -416,69 +1233,3256 @@ class MiniGraph(object):
         #             if e[4] == False and e[0] != e[1]])
         # )
 
+    def __getstate__(self):
+        return (_FORMAT_VERSION, _graph_state(self))
+
+    def __setstate__(self, state):
+        version, state = state
+        if version != _FORMAT_VERSION:
+            raise MiniGraphError(
+                'Unsupported serialization format version: {}'
+                .format(version))
+        MiniGraph.__init__(self)
+        _load_state(self, state)
+
+    def enable_cache(self, maxsize=128):
+        """
+        Cache the results of up to *maxsize* of the most recently used
+        queries: nodes(), edges(), find_edges() (and so slice queries),
+        and the shortest-path methods. Any change to the graph made
+        through its methods invalidates the cache, but changes made
+        directly to node or edge data dicts do not.
+        """
+        self._cache = _LRUCache(maxsize, self._version)
+
+    def disable_cache(self):
+        """
+        Stop caching query results and drop the cached ones.
+        """
+        self._cache = None
+
+    def cache_info(self):
+        """
+        Return the cache's hits, misses, maximum and current size as a
+        CacheInfo tuple, or `None` if caching is not enabled.
+        """
+        cache = self._cache
+        if cache is None:
+            return None
+        return CacheInfo(cache.hits, cache.misses, cache.maxsize,
+                         len(cache.entries))
+
+    def _cached(self, key, compute):
+        # return the cached result for *key*, calling compute() on a miss
+        cache = self._cache
+        if cache.version != self._version:
+            cache.entries.clear()
+            cache.version = self._version
+        entries = cache.entries
+        try:
+            value = entries[key]
+        except KeyError:
+            pass
+        except TypeError:  # unhashable arguments are not cached
+            return compute()
+        else:
+            entries.move_to_end(key)
+            cache.hits += 1
+            return value
+        cache.misses += 1
+        value = compute()
+        # the graph cannot change during a query, so the version holds
+        entries[key] = value
+        if len(entries) > cache.maxsize:
+            entries.popitem(last=False)
+        return value
+
+    def enable_journal(self):
+        """
+        Record each change made to the graph from now on, for
+        journal() to return.
+        """
+        if self._journal is None:
+            self._journal = []
+
+    def disable_journal(self):
+        """
+        Stop recording changes and drop the recorded ones.
+        """
+        self._journal = None
+
+    def journal(self, clear=False):
+        """
+        Return the list of changes recorded since enable_journal() (or
+        since the journal was last cleared), or `None` if changes are
+        not being recorded. If *clear* is `True`, recording starts over.
+
+        Each change is a tuple of its kind and arguments:
+          ('add_node', nodeid, data)
+          ('add_edge', start, end, label, data, directed)
+          ('remove_node', nodeid)
+          ('remove_edge', start, end, label)
+          ('set_node_data', nodeid, data)
+        Adding an existing node or edge merges its data, while
+        'set_node_data' (from apply_patch()) replaces a node's data.
+        Changes undone by a transaction() are dropped from the journal.
+        """
+        journal = self._journal
+        if journal is None:
+            return None
+        if clear:
+            self._journal = []
+            return journal
+        return list(journal)
+
+    def replay(self, changes):
+        """
+        Make the *changes* returned by journal() for another graph to
+        this graph, e.g., to keep a replica up to date.
+        """
+        for kind, ops in groupby(changes, lambda op: op[0]):
+            if kind == 'add_edge':
+                self._insert_edges([(s, t, lbl, _copy_data(d), directed)
+                                    for _, s, t, lbl, d, directed in ops],
+                                   True)
+            elif kind == 'remove_edge':
+                self.remove_edges([op[1:] for op in ops])
+            elif kind == 'add_node':
+                for _, nodeid, data in ops:
+                    self.add_node(nodeid, dict(data) if data else None)
+            elif kind == 'remove_node':
+                self.remove_nodes([op[1] for op in ops])
+            elif kind == 'set_node_data':
+                for _, nodeid, data in ops:
+                    self._set_node_data(nodeid, data)
+            else:
+                raise MiniGraphError('Invalid change: {}'.format(kind))
+
+    @contextmanager
+    def transaction(self):
+        """
+        Return a context manager making the changes in its block
+        atomic: if the block raises an exception, all changes made to
+        the graph in it are undone before the exception propagates.
+        Transactions may be nested.
+
+        Example:
+          with g.transaction():
+              g.add_edges(edges)
+        """
+        outermost = self._undo is None
+        if outermost:
+            self._undo = []
+        mark = len(self._undo)
+        journal = self._journal
+        journalmark = 0 if journal is None else len(journal)
+        try:
+            yield self
+        except BaseException:
+            self._rollback(mark)
+            if journal is not None and self._journal is journal:
+                del journal[journalmark:]
+            raise
+        finally:
+            if outermost:
+                self._undo = None
+
+    def _rollback(self, mark):
+        # undo the changes after the first *mark* steps of the undo log
+        undo = self._undo
+        journal = self._journal
+        self._undo = self._journal = None
+        g = self._graph
+        try:
+            while len(undo) > mark:
+                op = undo.pop()
+                kind = op[0]
+                if kind == 'remove_edge':
+                    self.remove_edges([op[1:]])
+                elif kind == 'add_edge':
+                    self._insert_edges([op[1]], True)
+                elif kind == 'remove_node':
+                    self.remove_nodes([op[1]])
+                elif kind == 'add_node':
+                    self.add_node(op[1], op[2])
+                elif kind == 'node_data':
+                    self._set_node_data(op[1], op[2])
+                elif kind == 'edge_data':
+                    start, end, label, data = op[1:]
+                    self._version += 1
+                    if self._owned is not None:
+                        self._own(start)
+                        self._own(end)
+                    e = g[start][2][label][end]
+                    if self._edge_indexes is not None:
+                        key = (start, end, label)
+                        _unindex_data(self._edge_indexes, e[3], key)
+                        _index_data(self._edge_indexes, data, key)
+                    # restore data dicts in place, as they were changed
+                    if data is _EMPTY:
+                        self._replace_edge(e, e[:3] + (_EMPTY,) + e[4:])
+                    else:
+                        e[3].clear()
+                        e[3].update(data)
+        finally:
+            self._undo = undo
+            self._journal = journal
+
+    def _set_node_data(self, nodeid, data):
+        # replace the items of the node's data with those of *data*; as
+        # with add_node(), the data dict is changed in place
+        self._version += 1
+        g = self._graph
+        if self._owned is not None:
+            self._own(nodeid)
+        n = g[nodeid]
+        if self._journal is not None:
+            self._journal.append(('set_node_data', nodeid, dict(data)))
+        if self._undo is not None:
+            self._undo.append(('node_data', nodeid, _copy_data(n[1])))
+        indexes = self._node_indexes
+        if indexes is not None:
+            _unindex_data(indexes, n[1], nodeid)
+        if not data:
+            g[nodeid] = (nodeid, _EMPTY, n[2], n[3])
+        elif n[1] is _EMPTY:
+            g[nodeid] = (nodeid, dict(data), n[2], n[3])
+        else:
+            n[1].clear()
+            n[1].update(data)
+        if indexes is not None:
+            _index_data(indexes, g[nodeid][1], nodeid)
+
+    def copy(self):
+        """
+        Return a copy of the graph. The copy shares its nodes, edges,
+        and data with this graph until either graph changes them;
+        changing a node copies its link dicts, data, and counters
+        first, and updating an edge's data copies the data. Data
+        dicts changed directly, e.g., via `g.node(x)[1]`, are still
+        shared.
+        """
+        cls = self.__class__
+        g = cls.__new__(cls)
+        g._graph = dict(self._graph)
+        g._nedges = self._nedges
+        g._nundirected = self._nundirected
+        if self._degrees is None:
+            g._degrees = g._labels = g._label_index = None
+        else:
+            g._degrees = dict(self._degrees)
+            g._labels = dict((lbl, c[:]) for lbl, c in self._labels.items())
+            g._label_index = dict(
+                (lbl, set(nids)) for lbl, nids in self._label_index.items())
+        if self._components is None:
+            g._components = None
+        else:
+            g._components = self._components.copy()
+        # every node and edge is now shared by both graphs
+        g._owned = set()
+        self._owned = set()
+        g._owned_edges = set()
+        self._owned_edges = set()
+        g._version = 0
+        g._cache = None
+        g._reach = None
+        g._node_indexes = _copy_indexes(self._node_indexes)
+        g._edge_indexes = _copy_indexes(self._edge_indexes)
+        g._journal = None
+        g._undo = None
+        g._hash = None
+        if self._hash is not None and self._hash[0] == self._version:
+            g._hash = (0, self._hash[1])
+        return g
+
     def subgraph(self, nodeids):
         g = self._graph
+        nodeids = list(nodeids)
         nidset = set(nodeids)
-        return MiniGraph(
-            nodes=[(nid, g[nid][1]) for nid in nodeids],
-            edges=[e for start in nodeids
-                     for label, ed in g[start][2].items()
-                     for end, e in ed.items() if end in nidset]
+        # the edges come from this graph, so skip argument checking
+        return MiniGraph.fast_init2(
+            [(nid, g[nid][1]) for nid in nodeids],
+            [e for start in nodeids
+               for label, ed in g[start][2].items()
+               for end, e in ed.items()
+               if end in nidset and (e[4] or e[0] == start)]
         )
 
-    # def connected(self):
-    #     nodeset = set()
-    #     remaining = set(self.nodes.keys())
+    def subgraph_view(self, nodeids=None, edge_filter=None):
+        """
+        Return a read-only MiniGraphView of the graph without copying
+        it. If *nodeids* is given, the view only contains those nodes
+        and the edges between them. If *edge_filter* is given, it is a
+        function of an edge returning `True` for edges in the view.
+        """
+        if nodeids is not None:
+            g = self._graph
+            nodeids = frozenset(nodeids)
+            for nid in nodeids:
+                if nid not in g:
+                    raise KeyError(nid)
+        return MiniGraphView(self, nodeids, edge_filter)
 
-    #     for start in self.nodes:
-    #         if node not in nodeset:
-    #             nodeset.add(node)
+    def freeze(self):
+        """
+        Return a FrozenMiniGraph snapshot of the graph. Node and edge
+        data dictionaries are copied.
+        """
+        return _freeze(self.nodes(), self.edges())
 
-# def _degree(nodeid, edgedicts):
-#     ds = []
-#     for d in edgedicts:
-#         if nodeid in d:
-#             ds.append(d[nodeid])
-#     return sum(len(ld) for d in ds for ld in d.values())
+    def is_connected(self):
+        """
+        Return `True` if the graph has exactly one weakly connected
+        component. The empty graph is not connected.
+        """
+        return self.number_of_components() == 1
 
-def _prune_edges(graph, nodeid):
-    g = graph[nodeid]
-    # forward links; remove reverse links on ends
-    edict = defaultdict(list)
-    for ed in g[2].values():
-        for e in ed.values():
-            if e[1] != nodeid:  # this will get removed anyway
-                edict[e[1]].append(e)
-    for end, es in edict.items():
-        ld = graph[end][3]
-        for e in es:
-            del ld[e[2]][e[0]]
-            if len(ld[e[2]]) == 0:
-                del ld[e[2]]
-    # backward links; remove forward links on starts
-    edict = defaultdict(list)
-    for ed in g[3].values():
-        for e in ed.values():
-            if e[0] != nodeid:  # this will get removed anyway
-                edict[e[0]].append(e)
-    for start, es in edict.items():
-        ld = graph[start][2]
-        for e in es:
-            del ld[e[2]][e[1]]
-            if len(ld[e[2]]) == 0:
-                del ld[e[2]]
-
-# for a bit more speed, this can be inlined directly
-def _add_edge(d, label, idx, e):
-    if label not in d:
-        d[label] = innerdict = {}
-    else:
-        innerdict = d[label]
-    if idx not in innerdict:
-        innerdict[idx] = e
-    else:
-        if innerdict[idx][4] != e[4]:
-            raise MiniGraphError(
-                'Cannot update directed and undirected edges.'
-            )
-        innerdict[idx][3].update(e[3])
+    def number_of_components(self):
+        return self._connectivity().count
+
+    def component_of(self, nodeid):
+        """
+        Return the set of node ids in the weakly connected component
+        containing *nodeid*.
+        """
+        g = self._graph
+        seen = set([nodeid])
+        agenda = [g[nodeid]]
+        while agenda:
+            n = agenda.pop()
+            for ed in n[2].values():
+                for nid in ed:
+                    if nid not in seen:
+                        seen.add(nid)
+                        agenda.append(g[nid])
+            for ed in n[3].values():
+                for nid in ed:
+                    if nid not in seen:
+                        seen.add(nid)
+                        agenda.append(g[nid])
+        return seen
+
+    def components(self):
+        """
+        Return the list of weakly connected components as sets of
+        node ids.
+        """
+        uf = self._connectivity()
+        find = uf.find
+        comps = defaultdict(set)
+        for nid in self._graph:
+            comps[find(nid)].add(nid)
+        return list(comps.values())
+
+    def strongly_connected_components(self):
+        """
+        Iterate over the strongly connected components as sets of node
+        ids, in reverse topological order: no component has an edge to
+        one given before it. Undirected edges join nodes both ways.
+        """
+        return _strongly_connected(self._graph)
+
+    def condensation(self):
+        """
+        Return the condensation of the graph: a new MiniGraph with a
+        node for each strongly connected component, numbered in
+        topological order, and with a directed edge between two of them
+        for each label of the edges between their nodes. Each node's
+        data is `{'members': set_of_node_ids}`.
+        """
+        g = self._graph
+        comps = list(_strongly_connected(g))
+        comps.reverse()
+        compof = {}
+        for i, comp in enumerate(comps):
+            for nid in comp:
+                compof[nid] = i
+        links = set()
+        for nid, n in g.items():
+            c = compof[nid]
+            for label, ed in n[2].items():
+                for other in ed:
+                    d = compof[other]
+                    if c != d:
+                        links.add((c, d, label))
+        return MiniGraph.fast_init2(
+            [(i, {'members': comp}) for i, comp in enumerate(comps)],
+            [(c, d, label, _EMPTY, True) for c, d, label in links])
+
+    def _connectivity(self):
+        # components are tracked while adding nodes and edges, but
+        # removals may split them, so recompute from scratch if needed;
+        # bulk construction is cheaper without tracking, so this is
+        # also where they are first computed
+        uf = self._components
+        if uf is None:
+            uf = _UnionFind()
+            parent = uf.parent
+            size = uf.size
+            for nid in self._graph:
+                if nid not in parent:
+                    comp = self.component_of(nid)
+                    for x in comp:
+                        parent[x] = nid
+                    size[nid] = len(comp)
+                    uf.count += 1
+            self._components = uf
+        return uf
+
+    def topological_sort(self):
+        """
+        Return the list of node ids in an order where every directed
+        edge goes from an earlier node to a later one. Undirected edges
+        are ignored. Raise a MiniGraphError if the directed edges make
+        a cycle.
+        """
+        order = _topological_sort(self._graph)
+        if len(order) != len(self._graph):
+            raise MiniGraphError('The graph has a directed cycle.')
+        return order
+
+    def find_cycle(self):
+        """
+        Return a cycle of directed edges as the list of node ids along
+        it, or `None` if there is none. Undirected edges are ignored.
+        """
+        return _find_cycle(self._graph)
+
+    def enable_reachability_index(self):
+        """
+        Index which nodes reach which others over directed edges, so
+        that reachable(), descendants(), and ancestors() need no
+        traversal. The index is updated as nodes and edges are added
+        and rebuilt by the first query after other changes. The graph
+        must not have a directed cycle when the index is built; while
+        it has one, queries traverse the graph instead.
+        """
+        reach = _Reachability(self)
+        if reach.order is None:
+            raise MiniGraphError('The graph has a directed cycle.')
+        self._reach = reach
+
+    def disable_reachability_index(self):
+        """
+        Drop the reachability index.
+        """
+        self._reach = None
+
+    def _reachability(self):
+        # return the current reachability index, if it can be used
+        reach = self._reach
+        if reach is None:
+            return None
+        if reach.version != self._version:
+            reach = self._reach = _Reachability(self)
+        return reach if reach.order is not None else None
+
+    def reachable(self, start, end):
+        """
+        Return `True` if *end* is *start* or can be reached from it by
+        following directed edges.
+        """
+        g = self._graph
+        if start not in g:
+            raise KeyError(start)
+        if end not in g:
+            raise KeyError(end)
+        reach = self._reachability()
+        if reach is not None:
+            return reach.reachable(start, end)
+        return end in _directed_search(g, start, 2, end)
+
+    def descendants(self, nodeid):
+        """
+        Return the set of nodes reachable from *nodeid* by following
+        directed edges, not including *nodeid* unless it is on a cycle.
+        """
+        g = self._graph
+        if nodeid not in g:
+            raise KeyError(nodeid)
+        reach = self._reachability()
+        if reach is not None:
+            return reach.descendants(nodeid)
+        nids = _directed_search(g, nodeid, 2)
+        if not any(nodeid in _directed_links(g[x], 2) for x in nids):
+            nids.discard(nodeid)
+        return nids
+
+    def ancestors(self, nodeid):
+        """
+        Return the set of nodes from which *nodeid* is reachable by
+        following directed edges, not including *nodeid* unless it is
+        on a cycle.
+        """
+        g = self._graph
+        if nodeid not in g:
+            raise KeyError(nodeid)
+        reach = self._reachability()
+        if reach is not None:
+            return reach.ancestors(nodeid)
+        nids = _directed_search(g, nodeid, 3)
+        if not any(nodeid in _directed_links(g[x], 3) for x in nids):
+            nids.discard(nodeid)
+        return nids
+
+    def shortest_path(self, start, end, labels=None, directed=None,
+                      weight=None, heuristic=None, bidirectional=False):
+        """
+        Return a shortest path from *start* to *end* as a list of node
+        ids, or `None` if *end* is not reachable.
+
+        Only edges with a label in *labels* are followed, if given, and
+        if *directed* is `True` or `False` only directed or undirected
+        edges are followed. If *weight* is given, it is the key of each
+        edge's data used as its weight (defaulting to 1), otherwise
+        every edge has a weight of 1. If *heuristic* is given, it is a
+        function `heuristic(nodeid, end)` estimating the remaining
+        distance for an A* search. If *bidirectional* is `True`, the
+        search alternates from both ends; it cannot be used with
+        *heuristic*.
+        """
+        g = self._graph
+        if end not in g:
+            raise KeyError(end)
+        if self._cache is not None:
+            key = ('shortest_path', start, end, _label_key(labels), directed,
+                   weight, heuristic, bidirectional)
+            path = self._cached(key, lambda: self._shortest_path(
+                start, end, labels, directed, weight, heuristic,
+                bidirectional))
+            return None if path is None else list(path)
+        return self._shortest_path(start, end, labels, directed, weight,
+                                   heuristic, bidirectional)
+
+    def _shortest_path(self, start, end, labels, directed, weight,
+                       heuristic, bidirectional):
+        succ = self._adjacency(2, labels, directed)
+        pred = self._adjacency(3, labels, directed) if bidirectional else None
+        return _shortest_path(succ, pred, self._graph[start][0], end,
+                              weight, heuristic, bidirectional)
+
+    def all_shortest_paths(self, start, end, labels=None, directed=None,
+                           weight=None):
+        """
+        Return the list of all shortest paths from *start* to *end*.
+        Paths only differing by the labels of their edges are the same
+        path. See shortest_path() for the arguments.
+        """
+        g = self._graph
+        if end not in g:
+            raise KeyError(end)
+        if self._cache is not None:
+            key = ('all_shortest_paths', start, end, _label_key(labels),
+                   directed, weight)
+            paths = self._cached(key, lambda: _all_shortest_paths(
+                self._adjacency(2, labels, directed), g[start][0], end,
+                weight))
+            return [list(path) for path in paths]
+        succ = self._adjacency(2, labels, directed)
+        return _all_shortest_paths(succ, g[start][0], end, weight)
+
+    def shortest_path_lengths(self, start, labels=None, directed=None,
+                              weight=None):
+        """
+        Return a dictionary mapping each node reachable from *start* to
+        the length of its shortest path from *start*. See
+        shortest_path() for the arguments.
+        """
+        if self._cache is not None:
+            key = ('shortest_path_lengths', start, _label_key(labels),
+                   directed, weight)
+            return dict(self._cached(key, lambda: _shortest_path_lengths(
+                self._adjacency(2, labels, directed), self._graph[start][0],
+                weight)))
+        succ = self._adjacency(2, labels, directed)
+        return _shortest_path_lengths(succ, self._graph[start][0], weight)
+
+    def match(self, pattern, nodes=None, bindings=None):
+        """
+        Iterate over the matches of *pattern* as dictionaries mapping
+        its variables to node ids.
+
+        The *pattern* is a MiniGraph, whose node ids are variables and
+        whose node and edge data must be contained in the matched nodes'
+        and edges' data, or a list of edge constraints `(start, end,
+        label, data, directed)` whose *start* and *end* are variables;
+        as in find_edges(), a missing or `Ellipsis` *label* matches any
+        label, a missing or `None` *data* matches any data, and a
+        missing or `None` *directed* matches either kind of edge. An
+        undirected edge matches a constraint in both directions. If
+        *nodes* is given, it maps variables to dictionaries their
+        nodes' data must contain, and if *bindings* is given, it maps
+        variables to the node ids they must be bound to. Different
+        variables may be bound to the same node.
+        """
+        constraints, nodedata = _pattern_constraints(pattern)
+        if nodes:
+            nodedata.update(nodes)
+        binding = dict(bindings or {})
+        variables = set(nodedata)
+        if isinstance(pattern, MiniGraph):
+            variables.update(nid for nid, _ in pattern.nodes())
+        self._count()
+        plan = _match_plan(self, constraints, variables, binding)
+        return _match(self, plan, nodedata, binding)
+
+    def canonical_hash(self):
+        """
+        Return a hash of the graph's structure as a hex string.
+
+        The hash covers node data, edge labels, and whether edges are
+        directed, but not node ids or edge data, so isomorphic graphs
+        have the same hash (as long as equal data values have the same
+        repr()). It is computed by Weisfeiler-Lehman refinement, which
+        rarely but possibly gives non-isomorphic graphs the same hash;
+        use is_isomorphic() to be sure. The hash is cached until the
+        graph changes; changing data dicts directly does not reset it.
+        """
+        h = self._hash
+        if h is None or h[0] != self._version:
+            h = self._hash = (self._version, _wl_colors(self)[0])
+        return h[1]
+
+    def is_isomorphic(self, other):
+        """
+        Return `True` if the MiniGraph *other* is isomorphic to this
+        graph: if there is a mapping of nodes that preserves node data
+        and the labels and directions of all edges.
+        """
+        return _isomorphism(self, other) is not None
+
+    def _adjacency(self, idx, labels, directed):
+        # Return a function listing the (neighbor, edge) pairs of a node
+        # using its forward (idx=2) or backward (idx=3) links
+        g = self._graph
+        if labels is not None:
+            labels = list(labels)
+        if labels is None and directed is None:
+            def adjacency(nid):
+                return [x for ed in g[nid][idx].values() for x in ed.items()]
+        elif directed is None:
+            def adjacency(nid):
+                d = g[nid][idx]
+                return [x for lbl in labels if lbl in d
+                          for x in d[lbl].items()]
+        else:
+            directed = bool(directed)
+            if labels is None:
+                def adjacency(nid):
+                    return [x for ed in g[nid][idx].values()
+                              for x in ed.items()
+                              if (x[1][4] is not False) == directed]
+            else:
+                def adjacency(nid):
+                    d = g[nid][idx]
+                    return [x for lbl in labels if lbl in d
+                              for x in d[lbl].items()
+                              if (x[1][4] is not False) == directed]
+        return adjacency
+
+class FrozenMiniGraph(object):
+    """
+    An immutable, compact snapshot of a MiniGraph.
+
+    Node ids and labels are interned as contiguous integers. Each edge
+    is stored once, in arrays sorted by label, start, and end, and the
+    forward and backward links of each node are stored as compressed
+    sparse rows: the links of node *i* are positions `offsets[i]` to
+    `offsets[i+1]` of parallel arrays of neighbors and edge indices,
+    sorted by label and neighbor. As with MiniGraph, undirected edges
+    are linked from both of their nodes.
+
+    Use MiniGraph.freeze() to create a frozen graph.
+    """
+
+    __slots__ = ('_ids', '_index', '_nodedata', '_labels', '_label_ids',
+                 '_label_offsets', '_estart', '_eend', '_elabel',
+                 '_edirected', '_edata', '_out', '_in')
+
+    def __init__(self, ids, nodedata, labels, label_offsets,
+                 estart, eend, elabel, edirected, edata, out, in_):
+        self._ids = ids
+        self._index = dict((nid, i) for i, nid in enumerate(ids))
+        self._nodedata = nodedata
+        self._labels = labels
+        self._label_ids = dict((lbl, i) for i, lbl in enumerate(labels))
+        self._label_offsets = label_offsets
+        self._estart = estart
+        self._eend = eend
+        self._elabel = elabel
+        self._edirected = edirected
+        self._edata = edata
+        # (offsets, neighbors, edge indices)
+        self._out = out
+        self._in = in_
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.find_edges(idx.start, idx.stop, label=idx.step)
+        else:
+            return (idx, self._nodedata.get(self._index[idx], _EMPTY))
+
+    def _edge(self, k):
+        return (self._ids[self._estart[k]],
+                self._ids[self._eend[k]],
+                self._labels[self._elabel[k]],
+                self._edata.get(k, _EMPTY),
+                self._edirected[k] == 1)
+
+    def _links(self, idx, nodeid):
+        # return the link rows and the range of *nodeid* in them
+        offsets, nbrs, eids = idx
+        i = self._index[nodeid]
+        return nbrs, eids, offsets[i], offsets[i + 1]
+
+    def _search(self, eids, nbrs, lo, hi, lid, j):
+        # leftmost position in lo:hi not less than (lid, j)
+        elabel = self._elabel
+        while lo < hi:
+            mid = (lo + hi) // 2
+            l = elabel[eids[mid]]
+            if l < lid or (l == lid and nbrs[mid] < j):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def node(self, nodeid):
+        i = self._index[nodeid]
+        return (nodeid, self._nodedata.get(i, _EMPTY),
+                self._link_dict(self._out, i), self._link_dict(self._in, i))
+
+    def _link_dict(self, idx, i):
+        offsets, nbrs, eids = idx
+        ids = self._ids
+        labels = self._labels
+        elabel = self._elabel
+        d = {}
+        for pos in range(offsets[i], offsets[i + 1]):
+            k = eids[pos]
+            lbl = labels[elabel[k]]
+            if lbl not in d:
+                d[lbl] = {}
+            d[lbl][ids[nbrs[pos]]] = self._edge(k)
+        return d
+
+    def nodes(self):
+        data = self._nodedata
+        return [(nid, data.get(i, _EMPTY)) for i, nid in enumerate(self._ids)]
+
+    def successors(self, nodeid):
+        """
+        Iterate over the ids of nodes linked from *nodeid*. See
+        MiniGraph.successors().
+        """
+        nbrs, eids, lo, hi = self._links(self._out, nodeid)
+        ids = self._ids
+        return _unique(ids[nbrs[pos]] for pos in range(lo, hi))
+
+    def predecessors(self, nodeid):
+        """
+        Iterate over the ids of nodes linking to *nodeid*. See
+        MiniGraph.predecessors().
+        """
+        nbrs, eids, lo, hi = self._links(self._in, nodeid)
+        ids = self._ids
+        return _unique(ids[nbrs[pos]] for pos in range(lo, hi))
+
+    def neighbors(self, nodeid):
+        """
+        Iterate over the ids of nodes adjacent to *nodeid* by any edge.
+        """
+        ids = self._ids
+        def positions():
+            for idx in (self._out, self._in):
+                nbrs, eids, lo, hi = self._links(idx, nodeid)
+                for pos in range(lo, hi):
+                    yield nbrs[pos]
+        return (ids[j] for j in _unique(positions()))
+
+    def iter_out_edges(self, nodeid, label=Ellipsis):
+        """
+        Iterate over the edges going out of *nodeid*, including its
+        undirected edges, optionally only those with *label*.
+        """
+        return self._iter_link_edges(self._out, nodeid, label)
+
+    def iter_in_edges(self, nodeid, label=Ellipsis):
+        """
+        Iterate over the edges coming into *nodeid*, including its
+        undirected edges, optionally only those with *label*.
+        """
+        return self._iter_link_edges(self._in, nodeid, label)
+
+    def _iter_link_edges(self, idx, nodeid, label):
+        nbrs, eids, lo, hi = self._links(idx, nodeid)
+        if label is not Ellipsis:
+            if label not in self._label_ids:
+                return
+            lid = self._label_ids[label]
+            lo = self._search(eids, nbrs, lo, hi, lid, -1)
+            hi = self._search(eids, nbrs, lo, hi, lid + 1, -1)
+        for pos in range(lo, hi):
+            yield self._edge(eids[pos])
+
+    def edge(self, start, end, label=None, directed=None):
+        if label not in self._label_ids:
+            raise KeyError(label)
+        nbrs, eids, lo, hi = self._links(self._out, start)
+        lid = self._label_ids[label]
+        j = self._index[end]
+        pos = self._search(eids, nbrs, lo, hi, lid, j)
+        if pos == hi or nbrs[pos] != j or self._elabel[eids[pos]] != lid:
+            raise KeyError(end)
+        e = self._edge(eids[pos])
+        if directed is not None:
+            assert e[4] == directed
+        return e
+
+    def edges(self):
+        return [self._edge(k) for k in range(len(self._estart))]
+
+    def iter_edges(self):
+        return map(self._edge, range(len(self._estart)))
+
+    def iter_nodes(self):
+        data = self._nodedata
+        return ((nid, data.get(i, _EMPTY)) for i, nid in enumerate(self._ids))
+
+    def find_edges(self, start=None, end=None, label=Ellipsis,
+                   directed=None, data=None):
+        """
+        Return the list of edges matching the given constraints. See
+        MiniGraph.find_edges() for the arguments.
+        """
+        if start is Ellipsis: start = None
+        if end is Ellipsis: end = None
+        index = self._index
+        if label is Ellipsis:
+            lid = None
+        elif label in self._label_ids:
+            lid = self._label_ids[label]
+        else:
+            return []
+
+        if start is not None or end is not None:
+            if start is not None:
+                if start not in index or (end is not None and
+                                          end not in index):
+                    return []
+                nbrs, eids, lo, hi = self._links(self._out, start)
+                other = end
+            else:
+                if end not in index:
+                    return []
+                nbrs, eids, lo, hi = self._links(self._in, end)
+                other = None
+            if lid is not None:
+                lo = self._search(eids, nbrs, lo, hi, lid, -1)
+                hi = self._search(eids, nbrs, lo, hi, lid + 1, -1)
+            if other is None:
+                ks = [eids[pos] for pos in range(lo, hi)]
+            else:
+                j = index[other]
+                ks = [eids[pos] for pos in range(lo, hi) if nbrs[pos] == j]
+        elif lid is not None:
+            ks = range(self._label_offsets[lid], self._label_offsets[lid + 1])
+        else:
+            ks = range(len(self._estart))
+
+        if directed is not None:
+            flag = 1 if directed else 0
+            edirected = self._edirected
+            ks = [k for k in ks if edirected[k] == flag]
+        if data:
+            items = list(data.items())
+            edata = self._edata
+            ks = [k for k in ks if k in edata
+                                and _data_matches(edata[k], items)]
+        return [self._edge(k) for k in ks]
+
+    def order(self):
+        return len(self._ids)
+
+    def size(self, label=Ellipsis, directed=None):
+        """
+        Return the number of edges in the graph. See MiniGraph.size()
+        for the arguments.
+        """
+        if label is Ellipsis:
+            lo, hi = 0, len(self._estart)
+        elif label in self._label_ids:
+            lid = self._label_ids[label]
+            lo = self._label_offsets[lid]
+            hi = self._label_offsets[lid + 1]
+        else:
+            return 0
+        if directed is None:
+            return hi - lo
+        undirected = bytes(self._edirected[lo:hi]).count(0)
+        return hi - lo - undirected if directed else undirected
+
+    def labels(self):
+        return list(self._labels)
+
+    def degree(self, nodeid):
+        # undirected edges are counted once, except simple loops
+        nbrs, eids, lo, hi = self._links(self._in, nodeid)
+        i = self._index[nodeid]
+        edirected = self._edirected
+        loops = 0
+        for pos in range(lo, hi):
+            if edirected[eids[pos]] or nbrs[pos] == i:
+                loops += 1
+        return self.out_degree(nodeid) + loops
+
+    def out_degree(self, nodeid):
+        nbrs, eids, lo, hi = self._links(self._out, nodeid)
+        return hi - lo
+
+    def in_degree(self, nodeid):
+        nbrs, eids, lo, hi = self._links(self._in, nodeid)
+        return hi - lo
+
+    def subgraph(self, nodeids):
+        nodeids = list(nodeids)
+        index = self._index
+        nidset = set(index[nid] for nid in nodeids)
+        offsets, nbrs, eids = self._out
+        estart = self._estart
+        edges = []
+        for nid in nodeids:
+            i = index[nid]
+            for pos in range(offsets[i], offsets[i + 1]):
+                # undirected edges are only taken from their start node
+                if nbrs[pos] in nidset and estart[eids[pos]] == i:
+                    edges.append(self._edge(eids[pos]))
+        data = self._nodedata
+        return _freeze([(nid, data.get(index[nid], _EMPTY))
+                        for nid in nodeids],
+                       edges)
+
+    def shortest_path(self, start, end, labels=None, directed=None,
+                      weight=None, heuristic=None, bidirectional=False):
+        """
+        Return a shortest path from *start* to *end*, or `None`. See
+        MiniGraph.shortest_path() for the arguments.
+        """
+        if end not in self._index:
+            raise KeyError(end)
+        succ = self._adjacency(self._out, labels, directed)
+        pred = (self._adjacency(self._in, labels, directed)
+                if bidirectional else None)
+        return _shortest_path(succ, pred, self._ids[self._index[start]], end,
+                              weight, heuristic, bidirectional)
+
+    def all_shortest_paths(self, start, end, labels=None, directed=None,
+                           weight=None):
+        if end not in self._index:
+            raise KeyError(end)
+        succ = self._adjacency(self._out, labels, directed)
+        return _all_shortest_paths(succ, self._ids[self._index[start]], end,
+                                   weight)
+
+    def shortest_path_lengths(self, start, labels=None, directed=None,
+                              weight=None):
+        succ = self._adjacency(self._out, labels, directed)
+        return _shortest_path_lengths(succ, self._ids[self._index[start]],
+                                      weight)
+
+    def _adjacency(self, idx, labels, directed):
+        # the (neighbor, edge) pairs of a node from the *idx* links
+        offsets, nbrs, eids = idx
+        index = self._index
+        ids = self._ids
+        edge = self._edge
+        elabel = self._elabel
+        edirected = self._edirected
+        if labels is not None:
+            label_ids = self._label_ids
+            labels = set(label_ids[lbl] for lbl in labels if lbl in label_ids)
+        flag = None if directed is None else (1 if directed else 0)
+        def adjacency(nid):
+            i = index[nid]
+            return [(ids[nbrs[pos]], edge(eids[pos]))
+                    for pos in range(offsets[i], offsets[i + 1])
+                    if (labels is None or elabel[eids[pos]] in labels)
+                    and (flag is None or edirected[eids[pos]] == flag)]
+        return adjacency
+
+    def write_mmap(self, path):
+        """
+        Write the graph to the file at *path* in a layout that
+        MiniGraph.open_mmap() can query without loading it.
+        """
+        _write_mmap(self, path)
+
+    def thaw(self):
+        """
+        Return a new, mutable MiniGraph with the same nodes and edges.
+        """
+        return MiniGraph.fast_init2(
+            [(nid, _copy_data(data)) for nid, data in self.nodes()],
+            [(s, e, l, _copy_data(d), dr) for s, e, l, d, dr in self.edges()]
+        )
+
+class MiniGraphView(object):
+    """
+    A read-only view of the nodes and edges of a MiniGraph.
+
+    The view holds no nodes or edges of its own; queries go to the
+    parent graph's adjacency dicts and skip nodes outside the view's
+    node set and edges failing its edge filter. Changes to the parent
+    graph are visible through the view. Use copy() to get a separate
+    MiniGraph.
+
+    Use MiniGraph.subgraph_view() to create a view.
+    """
+
+    __slots__ = ('_parent', '_nodes', '_edge_filter')
+
+    def __init__(self, parent, nodes=None, edge_filter=None):
+        self._parent = parent
+        self._nodes = nodes
+        self._edge_filter = edge_filter
+
+    def _has_node(self, nodeid):
+        nodes = self._nodes
+        return ((nodes is None or nodeid in nodes) and
+                nodeid in self._parent._graph)
+
+    def _keep(self, e):
+        # whether an edge of the parent graph is in the view
+        nodes = self._nodes
+        if nodes is not None and (e[0] not in nodes or e[1] not in nodes):
+            return False
+        return self._edge_filter is None or self._edge_filter(e)
+
+    def _node(self, nodeid):
+        if not self._has_node(nodeid):
+            raise KeyError(nodeid)
+        return self._parent._graph[nodeid]
+
+    def _links(self, links, label=Ellipsis):
+        keep = self._keep
+        for e in _link_edges(links, label):
+            if keep(e):
+                yield e
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.find_edges(idx.start, idx.stop, label=idx.step)
+        else:
+            return (idx, self._node(idx)[1])
+
+    def node(self, nodeid):
+        n = self._node(nodeid)
+        return (nodeid, n[1], self._link_dict(n[2]), self._link_dict(n[3]))
+
+    def _link_dict(self, links):
+        keep = self._keep
+        d = {}
+        for label, ed in links.items():
+            ed = dict((nid, e) for nid, e in ed.items() if keep(e))
+            if ed:
+                d[label] = ed
+        return d
+
+    def nodes(self):
+        return list(self.iter_nodes())
+
+    def iter_nodes(self):
+        g = self._parent._graph
+        if self._nodes is None:
+            for nid, n in g.items():
+                yield (nid, n[1])
+        else:
+            for nid in self._nodes:
+                if nid in g:
+                    yield (nid, g[nid][1])
+
+    def successors(self, nodeid):
+        return _unique(e[1] if e[0] == nodeid else e[0]
+                       for e in self._links(self._node(nodeid)[2]))
+
+    def predecessors(self, nodeid):
+        return _unique(e[0] if e[1] == nodeid else e[1]
+                       for e in self._links(self._node(nodeid)[3]))
+
+    def neighbors(self, nodeid):
+        n = self._node(nodeid)
+        return _unique(e[1] if e[0] == nodeid else e[0]
+                       for links in (n[2], n[3])
+                       for e in self._links(links))
+
+    def edge(self, start, end, label=None, directed=None):
+        e = self._node(start)[2][label][end]
+        if not self._keep(e):
+            raise KeyError(end)
+        if directed is not None:
+            assert e[4] == directed
+        return e
+
+    def edges(self):
+        return list(self.iter_edges())
+
+    def iter_edges(self):
+        return self._scan_edges(Ellipsis)
+
+    def _scan_edges(self, label):
+        # the edges with *label* in the forward links of the view's
+        # nodes; undirected edges are only taken from their start
+        g = self._parent._graph
+        keep = self._keep
+        anylabel = label is Ellipsis
+        for nid, _ in self.iter_nodes():
+            links = g[nid][2]
+            if anylabel:
+                eds = links.values()
+            elif label in links:
+                eds = (links[label],)
+            else:
+                continue
+            for ed in eds:
+                for e in ed.values():
+                    if (e[4] or e[0] == nid) and keep(e):
+                        yield e
+
+    def iter_out_edges(self, nodeid, label=Ellipsis):
+        return self._links(self._node(nodeid)[2], label)
+
+    def iter_in_edges(self, nodeid, label=Ellipsis):
+        return self._links(self._node(nodeid)[3], label)
+
+    def find_edges(self, start=None, end=None, label=Ellipsis,
+                   directed=None, data=None):
+        """
+        Return the list of edges matching the given constraints. See
+        MiniGraph.find_edges() for the arguments.
+        """
+        return list(self._find_edges(start, end, label, directed, data))
+
+    def _find_edges(self, start, end, label, directed, data):
+        if start is Ellipsis: start = None
+        if end is Ellipsis: end = None
+        for nid in (start, end):
+            if nid is not None and not self._has_node(nid):
+                return
+        if start is None and end is None and self._nodes is not None:
+            # only scan the view's nodes, not the whole parent graph
+            xs = self._scan_edges(label)
+            if directed is not None:
+                if directed:
+                    xs = (e for e in xs if e[4] is not False)
+                else:
+                    xs = (e for e in xs if e[4] is False)
+            if data:
+                items = list(data.items())
+                xs = (e for e in xs if _data_matches(e[3], items))
+        else:
+            keep = self._keep
+            xs = (e for e in self._parent._find_edges(
+                      start, end, label, directed, data)
+                  if keep(e))
+        for e in xs:
+            yield e
+
+    def order(self):
+        if self._nodes is None:
+            return self._parent.order()
+        g = self._parent._graph
+        return sum(1 for nid in self._nodes if nid in g)
+
+    def size(self, label=Ellipsis, directed=None):
+        return sum(1 for _ in self._find_edges(
+            None, None, label, directed, None))
+
+    def labels(self):
+        return list(set(e[2] for e in self.iter_edges()))
+
+    def degree(self, nodeid):
+        # undirected edges are counted once, except simple loops
+        n = self._node(nodeid)
+        return (sum(1 for _ in self._links(n[2])) +
+                sum(1 for e in self._links(n[3]) if e[4] or e[0] == e[1]))
+
+    def out_degree(self, nodeid):
+        return sum(1 for _ in self._links(self._node(nodeid)[2]))
+
+    def in_degree(self, nodeid):
+        return sum(1 for _ in self._links(self._node(nodeid)[3]))
+
+    def subgraph_view(self, nodeids=None, edge_filter=None):
+        """
+        Return a view of this view restricted to *nodeids* and to the
+        edges passing *edge_filter*. See MiniGraph.subgraph_view().
+        """
+        nodes = self._nodes
+        if nodeids is not None:
+            nodeids = frozenset(nodeids)
+            for nid in nodeids:
+                self._node(nid)
+            nodes = nodeids
+        outer = self._edge_filter
+        if outer is not None and edge_filter is not None:
+            inner = edge_filter
+            edge_filter = lambda e: outer(e) and inner(e)
+        elif edge_filter is None:
+            edge_filter = outer
+        return MiniGraphView(self._parent, nodes, edge_filter)
+
+    def subgraph(self, nodeids):
+        return self.subgraph_view(nodeids).copy()
+
+    def copy(self):
+        """
+        Return a new MiniGraph with the nodes and edges of the view.
+        Node and edge data dictionaries are copied.
+        """
+        return MiniGraph.fast_init2(
+            [(nid, _copy_data(data)) for nid, data in self.iter_nodes()],
+            ((s, e, l, _copy_data(d), dr)
+             for s, e, l, d, dr in self.iter_edges())
+        )
+
+    def is_connected(self):
+        return self.number_of_components() == 1
+
+    def number_of_components(self):
+        return len(self.components())
+
+    def component_of(self, nodeid):
+        self._node(nodeid)
+        seen = set([nodeid])
+        agenda = [nodeid]
+        while agenda:
+            for nid in self.neighbors(agenda.pop()):
+                if nid not in seen:
+                    seen.add(nid)
+                    agenda.append(nid)
+        return seen
+
+    def components(self):
+        comps = []
+        seen = set()
+        for nid, _ in self.iter_nodes():
+            if nid not in seen:
+                comp = self.component_of(nid)
+                seen.update(comp)
+                comps.append(comp)
+        return comps
+
+    def shortest_path(self, start, end, labels=None, directed=None,
+                      weight=None, heuristic=None, bidirectional=False):
+        """
+        Return a shortest path from *start* to *end* within the view.
+        See MiniGraph.shortest_path() for the arguments.
+        """
+        self._node(end)
+        succ = self._adjacency(2, labels, directed)
+        pred = self._adjacency(3, labels, directed) if bidirectional else None
+        return _shortest_path(succ, pred, self._node(start)[0], end,
+                              weight, heuristic, bidirectional)
+
+    def all_shortest_paths(self, start, end, labels=None, directed=None,
+                           weight=None):
+        self._node(end)
+        succ = self._adjacency(2, labels, directed)
+        return _all_shortest_paths(succ, self._node(start)[0], end, weight)
+
+    def shortest_path_lengths(self, start, labels=None, directed=None,
+                              weight=None):
+        succ = self._adjacency(2, labels, directed)
+        return _shortest_path_lengths(succ, self._node(start)[0], weight)
+
+    def _adjacency(self, idx, labels, directed):
+        adjacency = self._parent._adjacency(idx, labels, directed)
+        keep = self._keep
+        def filtered(nid):
+            return [x for x in adjacency(nid) if keep(x[1])]
+        return filtered
+
+# def _degree(nodeid, edgedicts):
+#     ds = []
+#     for d in edgedicts:
+#         if nodeid in d:
+#             ds.append(d[nodeid])
+#     return sum(len(ld) for d in ds for ld in d.values())
+
+def _typecode(maxval):
+    # the smallest unsigned array type that can hold *maxval*
+    for tc in 'BHIQ':
+        if maxval < 256 ** array(tc).itemsize:
+            return tc
+    raise MiniGraphError('Value too large for an array: {}'.format(maxval))
+
+def _csr(n, rows, typecode):
+    # *rows* is a sorted list of (row, label id, column, edge index)
+    counts = [0] * (n + 1)
+    for r in rows:
+        counts[r[0] + 1] += 1
+    for i in range(n):
+        counts[i + 1] += counts[i]
+    return (array(_typecode(len(rows)), counts),
+            array(typecode, [r[2] for r in rows]),
+            array(typecode, [r[3] for r in rows]))
+
+def _freeze(nodes, edges):
+    # *nodes* are (id, data) pairs and *edges* are unique 5-tuples
+    ids = []
+    index = {}
+    nodedata = {}
+    for nid, data in nodes:
+        i = index[nid] = len(ids)
+        ids.append(nid)
+        if data:
+            nodedata[i] = dict(data)
+
+    labels = []
+    label_ids = {}
+    rows = []
+    for e in edges:
+        label = e[2]
+        if label not in label_ids:
+            label_ids[label] = len(labels)
+            labels.append(label)
+        rows.append((label_ids[label], index[e[0]], index[e[1]],
+                     e[4] is not False, e[3]))
+    rows.sort(key=lambda r: r[:3])
+
+    label_offsets = [0] * (len(labels) + 1)
+    out = []
+    in_ = []
+    for k, (lid, s, t, directed, _) in enumerate(rows):
+        label_offsets[lid + 1] += 1
+        out.append((s, lid, t, k))
+        in_.append((t, lid, s, k))
+        if not directed and s != t:
+            out.append((t, lid, s, k))
+            in_.append((s, lid, t, k))
+    for i in range(len(labels)):
+        label_offsets[i + 1] += label_offsets[i]
+    out.sort()
+    in_.sort()
+
+    n = len(ids)
+    tc = _typecode(max(n, len(rows)))
+    return FrozenMiniGraph(
+        ids,
+        nodedata,
+        labels,
+        array(_typecode(len(rows)), label_offsets),
+        array(tc, [r[1] for r in rows]),
+        array(tc, [r[2] for r in rows]),
+        array(_typecode(len(labels)), [r[0] for r in rows]),
+        bytearray(r[3] for r in rows),
+        dict((k, dict(r[4])) for k, r in enumerate(rows) if r[4]),
+        _csr(n, out, tc),
+        _csr(n, in_, tc)
+    )
+
+# Memory-mapped frozen graphs
+#
+# The file starts with a header (magic, format version, byte order, and
+# section count) and a table of (typecode, offset, size in bytes)
+# entries, followed by the sections: the frozen graph's arrays in the
+# machine's byte order, each aligned to 8 bytes, and lastly the pickled
+# node id, label, and data tables.
+
+_MMAP_MAGIC = b'MiniGrMM'
+_MMAP_VERSION = 1
+_MMAP_HEADER = struct.Struct('<8sHBxI')
+_MMAP_SECTION = struct.Struct('<c7xQQ')
+
+def _write_mmap(fg, path):
+    out, in_ = fg._out, fg._in
+    arrays = [fg._label_offsets, fg._estart, fg._eend, fg._elabel,
+              memoryview(fg._edirected), out[0], out[1], out[2],
+              in_[0], in_[1], in_[2]]
+    tables = pickle.dumps((fg._ids, fg._labels, fg._nodedata, fg._edata),
+                          pickle.HIGHEST_PROTOCOL)
+    sections = [(a.typecode if isinstance(a, array) else a.format,
+                 memoryview(a).cast('B')) for a in arrays]
+    sections.append(('-', memoryview(tables)))
+    offset = _MMAP_HEADER.size + _MMAP_SECTION.size * len(sections)
+    entries = []
+    for typecode, data in sections:
+        offset += -offset % 8
+        entries.append((typecode, offset, len(data)))
+        offset += len(data)
+    with open(path, 'wb') as f:
+        f.write(_MMAP_HEADER.pack(_MMAP_MAGIC, _MMAP_VERSION,
+                                  sys.byteorder == 'big', len(sections)))
+        for typecode, offset, size in entries:
+            f.write(_MMAP_SECTION.pack(typecode.encode('ascii'), offset, size))
+        for (_, offset, _), (_, data) in zip(entries, sections):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(data)
+
+def _open_mmap(path):
+    with open(path, 'rb') as f:
+        buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    magic, version, bigendian, n = _MMAP_HEADER.unpack_from(buf)
+    if magic != _MMAP_MAGIC:
+        raise MiniGraphError('Not a memory-mappable MiniGraph: {}'
+                             .format(path))
+    if version != _MMAP_VERSION:
+        raise MiniGraphError(
+            'Unsupported memory-mapped format version: {}'.format(version))
+    if bigendian != (sys.byteorder == 'big'):
+        raise MiniGraphError('Memory-mapped graph has the wrong byte order')
+    views = []
+    for i in range(n):
+        typecode, offset, size = _MMAP_SECTION.unpack_from(
+            buf, _MMAP_HEADER.size + i * _MMAP_SECTION.size)
+        views.append(buf[offset:offset + size].cast(typecode.decode('ascii'))
+                     if typecode != b'-' else buf[offset:offset + size])
+    ids, labels, nodedata, edata = pickle.loads(views.pop())
+    (label_offsets, estart, eend, elabel, edirected,
+     out0, out1, out2, in0, in1, in2) = views
+    return FrozenMiniGraph(ids, nodedata, labels, label_offsets, estart,
+                           eend, elabel, edirected, edata,
+                           (out0, out1, out2), (in0, in1, in2))
+
+# Building many graphs in parallel
+
+def build_many(edge_lists, processes=None, chunksize=64, freeze=False):
+    """
+    Build a MiniGraph from each list of edges in *edge_lists* using a
+    pool of *processes* worker processes (by default, one per CPU) and
+    return the graphs in the same order.
+
+    Edge lists are sent to the workers in chunks of *chunksize*, and
+    each worker sends its graphs back pickled in the compact form used
+    by dumps(), from which the adjacency dicts are rebuilt without
+    checking the edges again. If *freeze* is `True`,
+    the workers return FrozenMiniGraph objects, whose arrays need no
+    rebuilding at all.
+    """
+    return list(iter_build_many(edge_lists, processes, chunksize, freeze))
+
+def iter_build_many(edge_lists, processes=None, chunksize=64,
+                    freeze=False):
+    """
+    Like build_many(), but yield the graphs in order as they are
+    built. Only a couple of chunks per process are read ahead from
+    *edge_lists*, so it may be a long-running generator.
+    """
+    it = iter(edge_lists)
+    chunks = iter(lambda: list(islice(it, chunksize)), [])
+    if processes is None:
+        processes = os.cpu_count() or 1
+    window = 2 * processes
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_build_chunk, chunk, freeze))
+            if len(pending) >= window:
+                for g in pending.popleft().result():
+                    yield g
+        while pending:
+            for g in pending.popleft().result():
+                yield g
+
+def _build_chunk(edge_lists, freeze):
+    # runs in a worker process; graphs are pickled with their compact
+    # state (see MiniGraph.__getstate__())
+    if freeze:
+        return [MiniGraph(edges=edges).freeze() for edges in edge_lists]
+    return [MiniGraph(edges=edges) for edges in edge_lists]
+
+# Serialization
+#
+# A graph's state is its node ids, their data, and its labels, followed
+# by the edges as columns of node and label positions (in the smallest
+# array type that fits) and directed flags, with data dicts only for
+# the nodes and edges that have any. Each edge is stored once; the
+# adjacency dicts are stored as groups of (node position, edge index)
+# links, so loading needs no sorting, and the degree and label counts
+# are stored too. The binary format is a header followed by the pickled
+# state.
+
+_MAGIC = b'MiniGrph'
+_FORMAT_VERSION = 1
+
+def dumps(g):
+    """
+    Return the MiniGraph *g* serialized as bytes.
+    """
+    return b''.join([_MAGIC, struct.pack('<H', _FORMAT_VERSION),
+                     pickle.dumps(_graph_state(g), pickle.HIGHEST_PROTOCOL)])
+
+def loads(s, cls=None):
+    """
+    Return the MiniGraph (or an instance of *cls*) serialized in the
+    bytes *s* by dumps(). Node ids, labels, and data are unpickled, so
+    only load data from trusted sources.
+    """
+    if s[:len(_MAGIC)] != _MAGIC:
+        raise MiniGraphError('Not a serialized MiniGraph')
+    start = len(_MAGIC) + 2
+    version = struct.unpack('<H', s[len(_MAGIC):start])[0]
+    if version != _FORMAT_VERSION:
+        raise MiniGraphError(
+            'Unsupported serialization format version: {}'.format(version))
+    g = (cls or MiniGraph)()
+    _load_state(g, pickle.loads(s[start:]))
+    return g
+
+def dump(g, f):
+    """
+    Write the MiniGraph *g* to the binary file object *f*.
+    """
+    f.write(dumps(g))
+
+def load(f, cls=None):
+    """
+    Return the MiniGraph read from the binary file object *f*.
+    """
+    return loads(f.read(), cls=cls)
+
+def _graph_state(g):
+    g._count()
+    graph = g._graph
+    ids = list(graph)
+    pos = dict((nid, i) for i, nid in enumerate(ids))
+    nodedata = dict((i, dict(graph[nid][1]))
+                    for i, nid in enumerate(ids) if graph[nid][1])
+    labels = list(g._labels)
+    lpos = dict((label, i) for i, label in enumerate(labels))
+    edges = g.edges()
+    eindex = dict((id(e), k) for k, e in enumerate(edges))
+    n = len(ids)
+    m = len(edges)
+    tc = _typecode(n)
+    ltc = _typecode(len(labels))
+    etc = _typecode(m)
+    starts = array(tc, [pos[e[0]] for e in edges])
+    ends = array(tc, [pos[e[1]] for e in edges])
+    elabels = array(ltc, [lpos[e[2]] for e in edges])
+    directed = bytearray(e[4] is not False for e in edges)
+    edgedata = dict((k, dict(e[3])) for k, e in enumerate(edges) if e[3])
+    degrees = array(_typecode(2 * m), [
+        x for nid in ids for x in g._degrees[nid]])
+    counts = array(etc, [x for label in labels for x in g._labels[label]])
+    index = [array(tc, [pos[nid] for nid in g._label_index.get(label, ())])
+             for label in labels]
+    links = []
+    for idx in (2, 3):
+        # one group of links per node and label, in the order of the
+        # graph's dicts, with offsets to each node's groups and to each
+        # group's links
+        nodeoffsets, lbls, offsets, cols, eids = [0], [], [0], [], []
+        for nid in ids:
+            for label, ed in graph[nid][idx].items():
+                lbls.append(lpos[label])
+                cols.extend(map(pos.__getitem__, ed))
+                eids.extend(map(eindex.__getitem__, map(id, ed.values())))
+                offsets.append(len(cols))
+            nodeoffsets.append(len(lbls))
+        links.append((array(_typecode(len(lbls)), nodeoffsets),
+                      array(ltc, lbls), array(_typecode(len(cols)), offsets),
+                      array(tc, cols), array(etc, eids)))
+    return (ids, nodedata, labels, starts, ends, elabels, directed,
+            edgedata, degrees, counts, index, links[0], links[1])
+
+def _slices(xs, offsets):
+    return map(xs.__getitem__, map(slice, offsets, islice(offsets, 1, None)))
+
+def _load_state(g, state):
+    # the state is of a valid graph, so the empty graph *g* gets its
+    # dicts and counters rebuilt directly instead of through
+    # add_edges(); the loops are all in map() and zip()
+    (ids, nodedata, labels, starts, ends, elabels, directed, edgedata,
+     degrees, counts, index, outlinks, inlinks) = state
+    getid = ids.__getitem__
+    getlabel = labels.__getitem__
+    data = [_EMPTY] * len(starts)
+    for k, d in edgedata.items():
+        data[k] = d
+    edges = list(zip(map(getid, starts), map(getid, ends),
+                     map(getlabel, elabels), data, map(bool, directed)))
+    nodelinks = []
+    for nodeoffsets, lbls, offsets, cols, eids in (outlinks, inlinks):
+        links = list(zip(map(getid, cols), map(edges.__getitem__, eids)))
+        groups = list(zip(map(getlabel, lbls), map(dict, _slices(links,
+                                                                 offsets))))
+        nodelinks.append(map(dict, _slices(groups, nodeoffsets)))
+    data = [_EMPTY] * len(ids)
+    for i, d in nodedata.items():
+        data[i] = d
+    g._graph = dict(zip(ids, zip(ids, data, *nodelinks)))
+    it = iter(degrees)
+    g._degrees = dict(zip(ids, map(list, zip(it, it, it))))
+    it = iter(counts)
+    g._labels = dict(zip(labels, map(list, zip(it, it))))
+    g._label_index = dict((label, set(map(getid, nids)))
+                          for label, nids in zip(labels, index) if nids)
+    g._nedges = len(edges)
+    g._nundirected = len(directed) - sum(directed)
+
+# Differences between graphs
+#
+# The node dicts of the two graphs are walked together, comparing the
+# forward links of each node present in both; each edge is only looked
+# at from its start (for undirected edges, the start it was added
+# with). Nodes and link dicts still shared by a graph and its copy are
+# skipped, as are equal label dicts, which are compared in C.
+
+def diff(g1, g2):
+    """
+    Return the changes from MiniGraph *g1* to MiniGraph *g2* as a
+    GraphDelta of:
+      added_nodes: list of (nodeid, data) pairs
+      removed_nodes: list of node ids
+      changed_nodes: list of (nodeid, data) pairs with *g2*'s data
+      added_edges: list of 5-tuple edges
+      removed_edges: list of (start, end, label, directed) keys
+      changed_edges: list of 5-tuple edges with *g2*'s data
+    Removed nodes' edges are also listed as removed, and added nodes'
+    edges as added. An undirected edge is the same edge in either
+    direction.
+    """
+    a = g1._graph
+    b = g2._graph
+    delta = GraphDelta([], [], [], [], [], [])
+    for nid, n in a.items():
+        m = b.get(nid)
+        if m is None:
+            delta.removed_nodes.append(nid)
+        elif n is m:
+            continue
+        elif (n[1] or None) != (m[1] or None):
+            delta.changed_nodes.append((nid, m[1]))
+        _diff_links(nid, n, m, delta.removed_edges, None)
+    for nid, m in b.items():
+        n = a.get(nid)
+        if n is None:
+            delta.added_nodes.append((nid, m[1]))
+        elif n is m:
+            continue
+        _diff_links(nid, m, n, delta.added_edges, delta.changed_edges)
+    return delta
+
+def _diff_links(nid, n, other, missing, changed):
+    # list the edges starting at node *n* but missing from *other*, the
+    # same node in the other graph, in *missing* as keys, or as edges if
+    # *changed* is a list, in which case the edges whose data differ
+    # are also listed there
+    if other is not None and n[2] is other[2]:
+        return
+    otherlinks = {} if other is None else other[2]
+    for label, ed in n[2].items():
+        ed2 = otherlinks.get(label)
+        if ed is ed2 or ed == ed2:
+            continue
+        for end, e in ed.items():
+            directed = e[4] is not False
+            if not directed and e[0] != nid:
+                continue
+            f = None if ed2 is None else ed2.get(end)
+            if f is None or (f[4] is not False) != directed:
+                if changed is None:
+                    missing.append((e[0], e[1], label, directed))
+                else:
+                    missing.append(e)
+            elif changed is not None and (e[3] or None) != (f[3] or None):
+                changed.append(e)
+
+def apply_patch(g, delta):
+    """
+    Apply the GraphDelta *delta* returned by diff() to MiniGraph *g*.
+
+    Removals and additions go through the bulk remove_edges(),
+    remove_nodes(), and edge insertion paths. The patch is applied in a
+    transaction, so if it does not fit the graph, e.g., it removes a
+    missing edge, the graph is left unchanged.
+    """
+    with g.transaction():
+        if delta.removed_edges:
+            g.remove_edges([(start, end, label, None, directed)
+                            for start, end, label, directed
+                            in delta.removed_edges])
+        if delta.removed_nodes:
+            g.remove_nodes(delta.removed_nodes)
+        for nid, data in delta.added_nodes:
+            g.add_node(nid, dict(data) if data else None)
+        for nid, data in delta.changed_nodes:
+            g._set_node_data(nid, data)
+        # edges losing data items are replaced; the others are merged
+        replaced = []
+        merged = []
+        for e in delta.changed_edges:
+            old = g.edge(e[0], e[1], e[2])[3]
+            if old and not all(key in e[3] for key in old):
+                replaced.append(e)
+            else:
+                merged.append(e)
+        if replaced:
+            g.remove_edges(replaced)
+        edges = delta.added_edges + replaced + merged
+        if edges:
+            g._insert_edges(
+                [e[:3] + (_copy_data(e[3]),) + e[4:] for e in edges], True)
+
+# Reading and writing edge and node lists
+#
+# Readers are generators over the lines of a text file, so their edges
+# can be passed straight to MiniGraph.fast_init() or add_edges() and
+# only one line is in memory at a time; MiniGraph.from_edges() keeps
+# them as compact columns for building frozen or memory-mapped graphs.
+# Columns are given as positions or, for files with a header and for
+# JSON Lines, as field names.
+
+# default columns are those written by write_edges() and write_nodes()
+_DEFAULT = object()
+_DEFAULT_COLUMNS = {
+    'jsonl': {'start': 'start', 'end': 'end', 'label': 'label',
+              'directed': 'directed', 'data': 'data', 'id': 'id'},
+    'tsv': {'start': 0, 'end': 1, 'label': 2, 'directed': 3,
+            'data': None, 'id': 0},
+}
+
+_TRUE = frozenset(['1', 'true', 't', 'yes', 'y', 'directed'])
+_FALSE = frozenset(['0', 'false', 'f', 'no', 'n', 'undirected'])
+
+def read_edges(f, format='tsv', start=_DEFAULT, end=_DEFAULT,
+               label=_DEFAULT, directed=_DEFAULT, data=_DEFAULT,
+               header=False, nodetype=None):
+    """
+    Iterate over the edges in the text file *f* as 5-tuples.
+
+    The *format* is `'tsv'`, `'csv'`, or `'jsonl'`. The *start* and
+    *end* node ids and the edge *label* are read from the given
+    columns, or the label is `None` if *label* is `None` or the column
+    is empty. If *directed* is `True` or `False`, every edge is
+    directed or undirected, otherwise it is the column with the
+    directed flag (e.g., `1`/`0` or `true`/`false`). *data* is a list
+    of columns whose values become the edge data under the column
+    names (empty values are left out), or a dict mapping data keys to
+    columns; for JSON Lines it may also be the name of a field
+    containing an object. If *header* is `True`, the first line of a
+    TSV or CSV file names the columns. If given, *nodetype* (e.g.,
+    `int`) converts node ids.
+
+    By default, the columns are those written by write_edges(): the
+    `start`, `end`, `label`, `directed`, and `data` fields of JSON
+    Lines, and the first four columns of TSV and CSV rows. Rows with
+    only two or three columns read as unlabeled or directed edges.
+    """
+    defaults = _DEFAULT_COLUMNS['jsonl' if format == 'jsonl' else 'tsv']
+    # default columns may be missing from short TSV and CSV rows
+    optional = format != 'jsonl' and label is _DEFAULT
+    optflag = format != 'jsonl' and directed is _DEFAULT
+    if start is _DEFAULT: start = defaults['start']
+    if end is _DEFAULT: end = defaults['end']
+    if label is _DEFAULT: label = defaults['label']
+    if directed is _DEFAULT: directed = defaults['directed']
+    if data is _DEFAULT: data = defaults['data']
+    rows, columns = _read_rows(f, format, header)
+    start = _column(start, columns)
+    end = _column(end, columns)
+    label = _column(label, columns)
+    flag = None
+    if not isinstance(directed, bool):
+        flag = _column(directed, columns)
+    datacols = _data_columns(data, columns)
+    for row in rows:
+        s = row[start]
+        t = row[end]
+        if nodetype is not None:
+            s = nodetype(s)
+            t = nodetype(t)
+        if label is None or optional and label >= len(row):
+            lbl = None
+        else:
+            lbl = row[label]
+        if lbl == '':
+            lbl = None
+        if flag is None:
+            d = directed
+        elif optflag and flag >= len(row):
+            d = True
+        else:
+            d = _flag(row[flag])
+        yield (s, t, lbl, _row_data(row, datacols), d)
+
+def read_nodes(f, format='tsv', id=_DEFAULT, data=_DEFAULT, header=False,
+               nodetype=None):
+    """
+    Iterate over the `(id, data)` pairs of the nodes in the text file
+    *f*. See read_edges() for the arguments; by default, the columns
+    are those written by write_nodes().
+    """
+    defaults = _DEFAULT_COLUMNS['jsonl' if format == 'jsonl' else 'tsv']
+    if id is _DEFAULT: id = defaults['id']
+    if data is _DEFAULT: data = defaults['data']
+    rows, columns = _read_rows(f, format, header)
+    id = _column(id, columns)
+    datacols = _data_columns(data, columns)
+    for row in rows:
+        nid = row[id]
+        if nodetype is not None:
+            nid = nodetype(nid)
+        yield (nid, _row_data(row, datacols))
+
+def write_edges(g, f, format='tsv', data=None, header=False):
+    """
+    Write the edges of *g* to the text file *f* as they are iterated.
+
+    TSV and CSV rows have the start, end, label (empty for `None`),
+    and directed flag (`1` or `0`), followed by the values of the data
+    keys in *data*, if given, and are preceded by a header line if
+    *header* is `True`. JSON Lines objects have `start`, `end`,
+    `label`, and `directed` fields and a `data` field with the whole
+    data dict. TSV values cannot contain tabs or newlines; writing one
+    raises `MiniGraphError`, as TSV has no quoting (use CSV or JSON
+    Lines instead).
+    """
+    edges = g.iter_edges()
+    if format == 'jsonl':
+        for s, t, l, d, directed in edges:
+            f.write(json.dumps({'start': s, 'end': t, 'label': l,
+                                'directed': directed is not False,
+                                'data': dict(d)}))
+            f.write('\n')
+        return
+    data = list(data or ())
+    write = _row_writer(f, format)
+    if header:
+        write(['start', 'end', 'label', 'directed'] + data)
+    for s, t, l, d, directed in edges:
+        write([s, t, '' if l is None else l,
+               0 if directed is False else 1] +
+              [d.get(key, '') for key in data])
+
+def write_nodes(g, f, format='tsv', data=None, header=False):
+    """
+    Write the nodes of *g* to the text file *f*. TSV and CSV rows have
+    the node id followed by the values of the data keys in *data*;
+    JSON Lines objects have `id` and `data` fields. As in
+    write_edges(), TSV values cannot contain tabs or newlines.
+    """
+    nodes = g.iter_nodes()
+    if format == 'jsonl':
+        for nid, d in nodes:
+            f.write(json.dumps({'id': nid, 'data': dict(d)}))
+            f.write('\n')
+        return
+    data = list(data or ())
+    write = _row_writer(f, format)
+    if header:
+        write(['id'] + data)
+    for nid, d in nodes:
+        write([nid] + [d.get(key, '') for key in data])
+
+def _read_rows(f, format, header):
+    # return an iterator of rows and the column names, if any
+    if format == 'jsonl':
+        return (json.loads(line) for line in f if line.strip()), None
+    if format == 'tsv':
+        rows = (line.rstrip('\r\n').split('\t') for line in f
+                if line.strip())
+    elif format == 'csv':
+        rows = (row for row in csv.reader(f) if row)
+    else:
+        raise MiniGraphError('Invalid format: {}'.format(format))
+    columns = None
+    if header:
+        columns = dict((name, i) for i, name in enumerate(next(rows, [])))
+    return rows, columns
+
+def _column(col, columns):
+    # map a column name to its position in TSV and CSV rows
+    if columns is None or col is None or isinstance(col, int):
+        return col
+    if col not in columns:
+        raise MiniGraphError('No such column: {}'.format(col))
+    return columns[col]
+
+def _data_columns(data, columns):
+    if data is None:
+        return None
+    if isinstance(data, str):
+        return data
+    if not isinstance(data, dict):
+        data = dict((col, col) for col in data)
+    return [(key, _column(col, columns)) for key, col in data.items()]
+
+def _row_data(row, datacols):
+    if datacols is None:
+        return _EMPTY
+    if isinstance(datacols, str):
+        return row.get(datacols) or _EMPTY
+    # empty cells are missing values
+    return dict((key, row[col]) for key, col in datacols
+                if row[col] != '') or _EMPTY
+
+def _flag(value):
+    if value is True or value is False:
+        return value
+    value = str(value).strip().lower()
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    raise MiniGraphError('Invalid directed flag: {}'.format(value))
+
+def _row_writer(f, format):
+    if format == 'tsv':
+        def write(row):
+            row = [str(x) for x in row]
+            for x in row:
+                if '\t' in x or '\n' in x or '\r' in x:
+                    raise MiniGraphError(
+                        'Cannot write tab or newline in TSV: {!r}'
+                        .format(x))
+            f.write('\t'.join(row))
+            f.write('\n')
+        return write
+    elif format == 'csv':
+        return csv.writer(f, lineterminator='\n').writerow
+    raise MiniGraphError('Invalid format: {}'.format(format))
+
+# Synthetic graph generators
+#
+# These yield 5-tuple edges one at a time, so they can be passed
+# straight to MiniGraph.fast_init() or add_edges(). Each takes a *seed*
+# for reproducible output and, where it makes sense, an *undirected*
+# probability for mixing directed and undirected edges.
+
+def erdos_renyi(n, p, seed=None, undirected=0.0, label=None):
+    """
+    Yield the edges of a random G(*n*, *p*) graph on nodes `0..n-1`.
+
+    Each unordered pair of distinct nodes is joined with probability
+    *p*; the edge is undirected with probability *undirected* and is
+    otherwise directed one way or the other at random. Pairs are
+    skipped geometrically, so memory use is constant and time is
+    proportional to the number of edges.
+    """
+    rnd = random.Random(seed)
+    for start, end in _random_pairs(rnd, n, p):
+        if rnd.random() < undirected:
+            yield (start, end, label, _EMPTY, False)
+        elif rnd.random() < 0.5:
+            yield (start, end, label, _EMPTY, True)
+        else:
+            yield (end, start, label, _EMPTY, True)
+
+def barabasi_albert(n, m, seed=None, undirected=0.0, label=None):
+    """
+    Yield the edges of a preferential-attachment graph on nodes
+    `0..n-1`, where each new node links to *m* distinct existing nodes
+    chosen in proportion to their degree, giving a power-law degree
+    distribution.
+
+    Directed edges point from the new node to the older one, and each
+    edge is undirected with probability *undirected*. The list of
+    endpoints used for sampling is an integer array, so memory grows
+    by a few bytes per edge.
+    """
+    if m < 1 or m >= n:
+        raise MiniGraphError('m must be at least 1 and less than n')
+    rnd = random.Random(seed)
+    ends = array('q')
+    targets = range(m)
+    for node in range(m, n):
+        for target in targets:
+            yield (node, target, label, _EMPTY,
+                   rnd.random() >= undirected)
+            ends.append(target)
+            ends.append(node)
+        targets = set()
+        while len(targets) < m:
+            targets.add(ends[int(rnd.random() * len(ends))])
+
+def grid(rows, cols, seed=None, undirected=1.0, label=None):
+    """
+    Yield the edges of a *rows* x *cols* grid whose nodes are
+    `(row, col)` pairs, each joined to its right and lower neighbors.
+
+    Edges are undirected with probability *undirected* (by default all
+    of them), and directed edges point right or down.
+    """
+    rnd = random.Random(seed)
+    for r in range(rows):
+        for c in range(cols):
+            if c + 1 < cols:
+                yield ((r, c), (r, c + 1), label, _EMPTY,
+                       rnd.random() >= undirected)
+            if r + 1 < rows:
+                yield ((r, c), (r + 1, c), label, _EMPTY,
+                       rnd.random() >= undirected)
+
+def random_dag(n, p, seed=None, label=None):
+    """
+    Yield the edges of a random directed acyclic graph on nodes
+    `0..n-1`, where each pair is joined with probability *p* by an
+    edge from the lower to the higher node id.
+    """
+    rnd = random.Random(seed)
+    for start, end in _random_pairs(rnd, n, p):
+        yield (start, end, label, _EMPTY, True)
+
+def labeled_multigraph(n, nedges, labels=('a', 'b', 'c'), seed=None,
+                       undirected=0.0):
+    """
+    Yield *nedges* random edges (including loops) on nodes `0..n-1`,
+    each with a label from *labels*, so nodes may be joined by several
+    differently labeled edges.
+
+    Whether an edge is undirected is decided per pair of nodes and
+    label with probability *undirected*, so repeated edges always agree
+    and only have their data merged by the graph. Memory use is
+    constant.
+    """
+    rnd = random.Random(seed)
+    labels = list(labels)
+    salt = rnd.getrandbits(32)
+    threshold = int(undirected * 2 ** 32)
+    for _ in range(nedges):
+        start = int(rnd.random() * n)
+        end = int(rnd.random() * n)
+        k = int(rnd.random() * len(labels))
+        a, b = (start, end) if start < end else (end, start)
+        # a cheap hash of the unordered pair and label
+        h = ((a * 0x9E3779B1) ^ (b * 0x85EBCA77) ^ (k * 0xC2B2AE3D) ^ salt)
+        h = ((h ^ (h >> 15)) * 0x2C1B3C6D) & 0xFFFFFFFF
+        yield (start, end, labels[k], _EMPTY, h >= threshold)
+
+def _random_pairs(rnd, n, p):
+    # yield the pairs (i, j), i < j < n, each with probability p, by
+    # skipping ahead geometrically (Batagelj and Brandes, 2005)
+    if p <= 0:
+        return
+    if p >= 1:
+        for j in range(n):
+            for i in range(j):
+                yield (i, j)
+        return
+    lp = math.log(1.0 - p)
+    j, i = 1, -1
+    while j < n:
+        i += 1 + int(math.log(1.0 - rnd.random()) / lp)
+        while i >= j and j < n:
+            i -= j
+            j += 1
+        if j < n:
+            yield (i, j)
+
+# Bulk construction from columns
+
+def _from_columns(cls, src, dst, labels, directed, node_ids, freeze):
+    # the pure-Python path for from_arrays()
+    if node_ids is not None:
+        node_ids = _id_list(node_ids)
+        n = len(node_ids)
+        src = list(src)
+        dst = list(dst)
+        for i in src + dst:
+            if not 0 <= i < n:
+                raise MiniGraphError(
+                    'Node position out of range: {}'.format(i))
+        src = [node_ids[i] for i in src]
+        dst = [node_ids[i] for i in dst]
+    if labels is None:
+        labels = repeat(None)
+    if directed is None or directed is True or directed is False:
+        directed = repeat(directed is not False)
+    else:
+        directed = (bool(d) for d in directed)
+    g = cls([(nid, {}) for nid in node_ids or ()])
+    g._fast_add_edges1(
+        (s, t, l, _EMPTY, d)
+        for s, t, l, d in zip(src, dst, labels, directed)
+    )
+    if freeze:
+        return g.freeze()
+    return g
+
+def _edge_columns(edges):
+    # intern the node ids and labels of *edges* and collect the edges
+    # as columns of positions and directed flags
+    ids = {}
+    lbls = {}
+    src = array('q')
+    dst = array('q')
+    labels = array('q')
+    directed = bytearray()
+    for e in _normalize_edges(edges):
+        if e[3]:
+            raise MiniGraphError('Cannot keep edge data: {}'.format(e))
+        src.append(ids.setdefault(e[0], len(ids)))
+        dst.append(ids.setdefault(e[1], len(ids)))
+        labels.append(lbls.setdefault(e[2], len(lbls)))
+        directed.append(e[4] is not False)
+    return list(ids), list(lbls), src, dst, labels, directed
+
+def _id_list(values):
+    # node ids as Python objects, not NumPy or array scalars
+    if hasattr(values, 'tolist'):
+        return values.tolist()
+    return list(values)
+
+def _intern_column(*columns):
+    # return the unique values (as Python objects) of the columns, one
+    # after the other, and integer codes; numpy.unique() is only used
+    # on typed arrays of one dtype, as converting other columns to
+    # arrays would change mixed values, e.g., 1 and 'a', to one type
+    columns = [numpy.asarray(c) if isinstance(c, array) else c
+               for c in columns]
+    if (all(isinstance(c, numpy.ndarray) and c.dtype.kind in 'biufUS'
+            for c in columns) and
+            len(set(c.dtype for c in columns)) == 1):
+        uniq, codes = numpy.unique(numpy.concatenate(columns),
+                                   return_inverse=True)
+        return uniq.tolist(), codes.reshape(-1)
+    ids = {}
+    codes = numpy.fromiter(
+        (ids.setdefault(v, len(ids)) for c in columns for v in _id_list(c)),
+        numpy.intp
+    )
+    return list(ids), codes
+
+def _prepare_columns(src, dst, labels, directed, node_ids, label_ids=None):
+    m = len(src)
+    if len(dst) != m:
+        raise MiniGraphError('Edge columns have different lengths.')
+    if node_ids is not None:
+        ids = _id_list(node_ids)
+        s = numpy.asarray(src).astype(numpy.intp)
+        t = numpy.asarray(dst).astype(numpy.intp)
+        for pos in (s, t):
+            if m and (pos.min() < 0 or pos.max() >= len(ids)):
+                bad = pos[(pos < 0) | (pos >= len(ids))][0]
+                raise MiniGraphError(
+                    'Node position out of range: {}'.format(bad))
+    else:
+        ids, codes = _intern_column(src, dst)
+        s = codes[:m]
+        t = codes[m:]
+    if label_ids is not None:
+        # labels given as positions, as from _edge_columns()
+        lbls = list(label_ids)
+        l = numpy.asarray(labels).astype(numpy.intp)
+    elif labels is None:
+        lbls = [None] if m else []
+        l = numpy.zeros(m, numpy.intp)
+    else:
+        lbls, l = _intern_column(labels)
+    if directed is None or directed is True or directed is False:
+        und = numpy.full(m, directed is False)
+    else:
+        und = ~numpy.asarray(directed, dtype=bool)
+
+    # undirected edges are the same in either direction, so compare
+    # them with their nodes in a canonical order and keep the first
+    n = len(ids)
+    nlbls = max(len(lbls), 1)
+    a = numpy.where(und, numpy.minimum(s, t), s)
+    b = numpy.where(und, numpy.maximum(s, t), t)
+    _, first = numpy.unique(_pack_keys(n, nlbls, a, l, b, und),
+                            axis=0, return_index=True)
+    first.sort()
+    s, t, l, und = s[first], t[first], l[first], und[first]
+
+    # each remaining edge must have its own forward links
+    rev = und & (s != t)
+    slots = _pack_keys(n, nlbls,
+                       numpy.concatenate([s, t[rev]]),
+                       numpy.concatenate([l, l[rev]]),
+                       numpy.concatenate([t, s[rev]]))
+    if len(numpy.unique(slots, axis=0)) != len(slots):
+        raise MiniGraphError('Cannot update directed and undirected edges.')
+    return ids, lbls, s, t, l, und
+
+def _pack_keys(n, nlbls, rows, lbls, cols, flags=None):
+    # combine node, label, node (and flag) codes into sortable keys;
+    # one integer per edge if it fits, otherwise one row per edge
+    nflags = 1 if flags is None else 2
+    if n * n * nlbls * nflags < 2 ** 62:
+        keys = (rows.astype(numpy.int64) * nlbls + lbls) * n + cols
+        if flags is not None:
+            keys = keys * 2 + flags
+        return keys
+    cols = [rows, lbls, cols]
+    if flags is not None:
+        cols.append(flags.astype(numpy.intp))
+    return numpy.stack(cols, axis=1)
+
+def _link_rows(n, nlbls, s, t, l, und):
+    # rows, columns, labels, and edge indices of the forward links,
+    # sorted by row, label, and column
+    rev = und & (s != t)
+    k = numpy.arange(len(s))
+    rows = numpy.concatenate([s, t[rev]])
+    cols = numpy.concatenate([t, s[rev]])
+    lbls = numpy.concatenate([l, l[rev]])
+    eids = numpy.concatenate([k, k[rev]])
+    keys = _pack_keys(n, nlbls, rows, lbls, cols)
+    if keys.ndim == 1:
+        order = numpy.argsort(keys)
+    else:
+        order = numpy.lexsort((cols, lbls, rows))
+    return rows[order], cols[order], lbls[order], eids[order]
+
+def _graph_from_columns(cls, ids, lbls, s, t, l, und):
+    n = len(ids)
+    nlbls = max(len(lbls), 1)
+    g = cls()
+    graph = g._graph = dict((nid, (nid, _EMPTY, {}, {})) for nid in ids)
+    g._label_index = {}
+    objids = numpy.empty(n, object)
+    objids[:] = ids
+    objlbls = numpy.empty(len(lbls), object)
+    objlbls[:] = lbls
+    edges = numpy.empty(len(s), object)
+    edges[:] = [
+        (a, b, c, _EMPTY, d) for a, b, c, d in zip(objids[s].tolist(),
+                                                   objids[t].tolist(),
+                                                   objlbls[l].tolist(),
+                                                   (~und).tolist())
+    ]
+
+    # forward links use the edges as given, backward links swap them;
+    # each (node, label) group of links becomes one inner dict
+    for idx, (rows, cols, ls, eids) in (
+            (2, _link_rows(n, nlbls, s, t, l, und)),
+            (3, _link_rows(n, nlbls, t, s, l, und))):
+        if len(rows) == 0:
+            continue
+        starts = numpy.concatenate([[0], numpy.flatnonzero(
+            (numpy.diff(rows) != 0) | (numpy.diff(ls) != 0)) + 1])
+        sizes = numpy.diff(numpy.append(starts, len(rows))).tolist()
+        nids = objids[rows[starts]].tolist()
+        labels = objlbls[ls[starts]].tolist()
+        links = zip(objids[cols].tolist(), edges[eids].tolist())
+        for nid, label, size in zip(nids, labels, sizes):
+            graph[nid][idx][label] = dict(islice(links, size))
+        if idx == 2:
+            index = g._label_index
+            for nid, label in zip(nids, labels):
+                if label in index:
+                    index[label].add(nid)
+                else:
+                    index[label] = set([nid])
+
+    rev = und & (s != t)
+    fwd = ~rev
+    degrees = zip(numpy.bincount(s[fwd], minlength=n).tolist(),
+                  numpy.bincount(t[fwd], minlength=n).tolist(),
+                  (numpy.bincount(s[rev], minlength=n) +
+                   numpy.bincount(t[rev], minlength=n)).tolist())
+    g._degrees = dict((nid, list(d)) for nid, d in zip(ids, degrees))
+    counts = zip(numpy.bincount(l[~und], minlength=len(lbls)).tolist(),
+                 numpy.bincount(l[und], minlength=len(lbls)).tolist())
+    g._labels = dict((lbl, list(c)) for lbl, c in zip(lbls, counts) if any(c))
+    g._nedges = len(s)
+    g._nundirected = int(und.sum())
+    # components are recomputed on demand
+    g._components = None
+    return g
+
+def _to_array(values, maxval):
+    a = array(_typecode(maxval))
+    a.frombytes(numpy.ascontiguousarray(
+        values, dtype=numpy.dtype(a.typecode)).tobytes())
+    return a
+
+def _frozen_from_columns(ids, lbls, s, t, l, und):
+    n = len(ids)
+    nlbls = max(len(lbls), 1)
+    m = len(s)
+    # edges are stored sorted by label, start, and end
+    order = numpy.lexsort((t, s, l))
+    s, t, l, und = s[order], t[order], l[order], und[order]
+    label_offsets = numpy.concatenate(
+        [[0], numpy.cumsum(numpy.bincount(l, minlength=len(lbls)))])
+    maxval = max(n, m)
+    links = []
+    for rows, cols, _, eids in (_link_rows(n, nlbls, s, t, l, und),
+                                _link_rows(n, nlbls, t, s, l, und)):
+        offsets = numpy.concatenate(
+            [[0], numpy.cumsum(numpy.bincount(rows, minlength=n))])
+        links.append((_to_array(offsets, len(rows)),
+                      _to_array(cols, maxval),
+                      _to_array(eids, maxval)))
+    return FrozenMiniGraph(
+        ids, {}, lbls,
+        _to_array(label_offsets, m),
+        _to_array(s, maxval),
+        _to_array(t, maxval),
+        _to_array(l, len(lbls)),
+        bytearray((~und).astype(numpy.uint8).tobytes()),
+        {},
+        links[0],
+        links[1]
+    )
+
+# Strongly connected components
+
+def _strongly_connected(graph):
+    # Tarjan's algorithm with an explicit stack of link iterators; each
+    # node's forward links include its undirected edges, so those are
+    # followed both ways
+    index = {}
+    lowlink = {}
+    stack = []
+    onstack = set()
+    counter = 0
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        onstack.add(root)
+        work = [(root, _forward_links(graph[root]))]
+        while work:
+            nid, links = work[-1]
+            for other in links:
+                if other not in index:
+                    index[other] = lowlink[other] = counter
+                    counter += 1
+                    stack.append(other)
+                    onstack.add(other)
+                    work.append((other, _forward_links(graph[other])))
+                    break
+                elif other in onstack and index[other] < lowlink[nid]:
+                    lowlink[nid] = index[other]
+            else:
+                work.pop()
+                low = lowlink[nid]
+                if work:
+                    parent = work[-1][0]
+                    if low < lowlink[parent]:
+                        lowlink[parent] = low
+                if low == index[nid]:
+                    comp = set()
+                    while True:
+                        x = stack.pop()
+                        onstack.discard(x)
+                        comp.add(x)
+                        if x == nid:
+                            break
+                    yield comp
+
+def _forward_links(n):
+    return (other for ed in n[2].values() for other in ed)
+
+# Directed acyclic graphs
+#
+# Only directed edges are followed here. The reachability index numbers
+# the nodes in the post-order of a depth-first spanning forest, so the
+# descendants of a node in its tree are the interval of numbers from
+# its first descendant's up to its own. Descendants reached through
+# other edges are kept as a bitset (an int) of their numbers, for the
+# nodes that have any.
+
+_REACH_PATCH_LIMIT = 32  # larger batches of edges rebuild the index
+
+def _directed_links(n, idx):
+    # the nodes linked to node *n* by its directed forward (idx=2) or
+    # backward (idx=3) links
+    return [other
+            for ed in n[idx].values()
+            for other, e in ed.items()
+            if e[4] is not False]
+
+def _topological_sort(graph):
+    # Kahn's algorithm; nodes on or after a cycle are left out
+    indegree = {}
+    for nid, n in graph.items():
+        indegree[nid] = len(_directed_links(n, 3))
+    order = [nid for nid, d in indegree.items() if d == 0]
+    for nid in order:
+        for other in _directed_links(graph[nid], 2):
+            indegree[other] -= 1
+            if indegree[other] == 0:
+                order.append(other)
+    return order
+
+def _find_cycle(graph):
+    # iterative depth-first search for a node on the current path
+    onpath = {}  # node id -> True while on the path, False once done
+    for root in graph:
+        if root in onpath:
+            continue
+        onpath[root] = True
+        path = [root]
+        stack = [iter(_directed_links(graph[root], 2))]
+        while stack:
+            for other in stack[-1]:
+                state = onpath.get(other)
+                if state is None:
+                    onpath[other] = True
+                    path.append(other)
+                    stack.append(iter(_directed_links(graph[other], 2)))
+                    break
+                elif state:
+                    return path[path.index(other):]
+            else:
+                onpath[path.pop()] = False
+                stack.pop()
+    return None
+
+def _directed_search(graph, start, idx, end=None):
+    # the set of nodes reachable from *start* over directed forward
+    # (idx=2) or backward (idx=3) links, stopping early at *end*
+    seen = set([start])
+    agenda = [start]
+    while agenda:
+        for other in _directed_links(graph[agenda.pop()], idx):
+            if other not in seen:
+                if other == end:
+                    seen.add(other)
+                    return seen
+                seen.add(other)
+                agenda.append(other)
+    return seen
+
+def _interval(lo, hi):
+    # the bitset of numbers from *lo* to *hi*
+    return (1 << (hi + 1)) - (1 << lo)
+
+# Isomorphism
+#
+# Nodes are colored by Weisfeiler-Lehman refinement: the initial color
+# comes from the node's data, and each round a node's color becomes the
+# combination of its color and the multiset of (direction, label,
+# neighbor color) of its links. Color ids are assigned in the sorted
+# order of these signatures, so they do not depend on node ids or on
+# insertion order, and isomorphic graphs get the same colors.
+
+def _wl_colors(g):
+    # return a digest of the refinement and the final node colors
+    graph = g._graph
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((len(graph), g._nedges, g._nundirected)).encode())
+    sigs = dict((nid, tuple(sorted(map(repr, n[1].items()))))
+                for nid, n in graph.items())
+    links = dict((nid, _wl_links(n)) for nid, n in graph.items())
+    ncolors = 0
+    while True:
+        table = sorted(set(sigs.values()))
+        digest.update(repr(table).encode())
+        ids = dict((sig, i) for i, sig in enumerate(table))
+        colors = dict((nid, ids[sig]) for nid, sig in sigs.items())
+        if len(table) == ncolors:
+            break
+        ncolors = len(table)
+        sigs = dict(
+            (nid, (colors[nid],
+                   tuple(sorted((tag, lbl, colors[other])
+                                for tag, lbl, other in links[nid]))))
+            for nid in graph)
+    # the color counts distinguish graphs with the same color tables
+    digest.update(repr(sorted(colors.values())).encode())
+    return digest.hexdigest(), colors
+
+def _wl_links(n):
+    # (direction, label, neighbor) of each link; undirected edges are
+    # in both link dicts, so they are only taken from the forward ones
+    links = []
+    for label, ed in n[2].items():
+        lbl = repr(label)
+        for other, e in ed.items():
+            links.append(('-' if e[4] is False else '>', lbl, other))
+    for label, ed in n[3].items():
+        lbl = repr(label)
+        for other, e in ed.items():
+            if e[4] is not False:
+                links.append(('<', lbl, other))
+    return links
+
+def _wl_pairs(g):
+    # map each node to its neighbors and the sorted links between them
+    pairs = {}
+    for nid, n in g._graph.items():
+        d = pairs[nid] = {}
+        for tag, lbl, other in _wl_links(n):
+            d.setdefault(other, []).append((tag, lbl))
+        for other in d:
+            d[other].sort()
+    return pairs
+
+def _isomorphism(g1, g2):
+    # return a node mapping from *g1* to *g2* or None; a VF2-style
+    # search extending a partial mapping one node at a time, trying
+    # only nodes of the same color that agree on the links to the
+    # nodes already mapped
+    if (g1.order() != g2.order() or g1.size() != g2.size() or
+            g1.size(directed=False) != g2.size(directed=False)):
+        return None
+    hash1, colors1 = _wl_colors(g1)
+    hash2, colors2 = _wl_colors(g2)
+    if hash1 != hash2:
+        return None
+    pairs1 = _wl_pairs(g1)
+    pairs2 = _wl_pairs(g2)
+    byclass = defaultdict(list)
+    for nid, c in colors2.items():
+        byclass[c].append(nid)
+    order = _match_order(pairs1, colors1, byclass)
+
+    mapping = {}
+    used = set()
+
+    def candidates(u):
+        # neighbors of a mapped neighbor's image, or the whole class
+        for w in pairs1[u]:
+            if w in mapping:
+                c = colors1[u]
+                return [v for v in pairs2[mapping[w]]
+                        if v not in used and colors2[v] == c]
+        return [v for v in byclass[colors1[u]] if v not in used]
+
+    def feasible(u, v):
+        if g1._graph[u][1] != g2._graph[v][1]:
+            return False
+        p1 = pairs1[u]
+        p2 = pairs2[v]
+        if p1.get(u) != p2.get(v):  # loops
+            return False
+        n = 0
+        for w, links in p1.items():
+            if w in mapping and w != u:
+                n += 1
+                if p2.get(mapping[w]) != links:
+                    return False
+        return n == sum(1 for x in p2 if x in used and x != v)
+
+    # iterative depth-first search over the nodes in *order*
+    stack = [iter(candidates(order[0]))] if order else []
+    while stack:
+        depth = len(stack) - 1
+        u = order[depth]
+        if u in mapping:
+            used.discard(mapping.pop(u))
+        for v in stack[-1]:
+            if feasible(u, v):
+                mapping[u] = v
+                used.add(v)
+                if depth + 1 == len(order):
+                    return mapping
+                stack.append(iter(candidates(order[depth + 1])))
+                break
+        else:
+            stack.pop()
+    return mapping if not order else None
+
+def _match_order(pairs, colors, byclass):
+    # nodes in breadth-first order from the most constrained ones, so
+    # each node after the first of its component has a mapped neighbor
+    order = []
+    seen = set()
+    for root in sorted(pairs, key=lambda nid: len(byclass[colors[nid]])):
+        if root in seen:
+            continue
+        seen.add(root)
+        queue = deque([root])
+        while queue:
+            nid = queue.popleft()
+            order.append(nid)
+            for other in pairs[nid]:
+                if other not in seen:
+                    seen.add(other)
+                    queue.append(other)
+    return order
+
+# Pattern matching
+#
+# A pattern is a list of (start, end, label, data, directed) edge
+# constraints over variables. The constraints are put in an order where
+# each one, after the first, shares a variable with an earlier one if
+# possible, preferring those with the fewest expected matches given the
+# label counts. Matching then extends a binding of variables to nodes
+# one constraint at a time through the label-keyed link dicts.
+
+def _pattern_constraints(pattern):
+    if isinstance(pattern, MiniGraph):
+        return ([(e[0], e[1], e[2], e[3], e[4]) for e in pattern.iter_edges()],
+                dict((nid, data) for nid, data in pattern.nodes() if data))
+    constraints = []
+    for c in pattern:
+        clen = len(c)
+        if clen == 2:
+            (start, end), label, data, directed = c, Ellipsis, None, None
+        elif clen == 3:
+            (start, end, label), data, directed = c, None, None
+        elif clen == 4:
+            (start, end, label, data), directed = c, None
+        elif clen == 5:
+            start, end, label, data, directed = c
+        else:
+            raise MiniGraphError('Invalid edge constraint: {}'.format(c))
+        constraints.append((start, end, label, data, directed))
+    return constraints, {}
+
+def _match_plan(g, constraints, variables, bound):
+    # order the constraints, each with the index (0-2) of its bound end
+    # at that point: 0 for neither, 1 for start, 2 for end, or 3 for both
+    nnodes = max(1, len(g._graph))
+    bound = set(bound)
+    remaining = list(constraints)
+    plan = []
+    while remaining:
+        best = None
+        for c in remaining:
+            start, end, label = c[0], c[1], c[2]
+            which = (start in bound) + 2 * (end in bound)
+            if label is Ellipsis:
+                count = g._nedges
+                fanout = count / nnodes
+            else:
+                count = g.size(label)
+                fanout = count / max(1, len(g._label_index.get(label, ())))
+            if which == 3 or start == end and which:
+                cost = (0, 0)
+            elif which:
+                cost = (0, fanout)
+            else:
+                cost = (1, count)
+            if best is None or cost < best[0]:
+                best = (cost, c, which)
+        _, c, which = best
+        remaining.remove(c)
+        plan.append((c, 3 if c[0] == c[1] and which else which))
+        bound.update(c[:2])
+    # variables not in any constraint are bound to every node
+    for var in variables:
+        if var not in bound:
+            plan.append(((var, var, None, None, None), -1))
+            bound.add(var)
+    return plan
+
+def _match(g, plan, nodes, binding):
+    graph = g._graph
+    nodeitems = dict((var, list(data.items())) for var, data in nodes.items())
+
+    def edge_ok(e, data, directed):
+        if directed is not None and (e[4] is not False) != directed:
+            return False
+        return not data or _data_matches(e[3], data)
+
+    def node_ok(var, nid):
+        return (var not in nodeitems or
+                _data_matches(graph[nid][1], nodeitems[var]))
+
+    def links(ld, label):
+        if label is Ellipsis:
+            return ld.values()
+        return (ld[label],) if label in ld else ()
+
+    def expand(i):
+        if i == len(plan):
+            yield dict(binding)
+            return
+        (start, end, label, data, directed), which = plan[i]
+        data = list(data.items()) if data else None
+        if which == 3:
+            s, t = binding[start], binding[end]
+            if any(t in ed and edge_ok(ed[t], data, directed)
+                   for ed in links(graph[s][2], label)):
+                for b in expand(i + 1):
+                    yield b
+            return
+        if which == -1:
+            pairs = ((nid, nid) for nid in graph)
+        elif which == 0:
+            if label is Ellipsis:
+                nids = graph
+            else:
+                nids = g._label_index.get(label, ())
+            pairs = ((nid, other)
+                     for nid in nids
+                     for ed in links(graph[nid][2], label)
+                     for other, e in ed.items()
+                     if edge_ok(e, data, directed))
+        else:
+            # one end is bound; find the other end through its links
+            var, nid, idx = ((end, binding[start], 2) if which == 1
+                             else (start, binding[end], 3))
+            others = (other
+                      for ed in links(graph[nid][idx], label)
+                      for other, e in ed.items()
+                      if edge_ok(e, data, directed))
+            if label is Ellipsis:
+                others = _unique(others)
+            for other in others:
+                if node_ok(var, other):
+                    binding[var] = other
+                    for b in expand(i + 1):
+                        yield b
+            binding.pop(var, None)
+            return
+        if label is Ellipsis:
+            pairs = _unique(pairs)
+        for s, t in pairs:
+            if (start == end and s != t) or not node_ok(start, s):
+                continue
+            if not node_ok(end, t):
+                continue
+            binding[start] = s
+            binding[end] = t
+            for b in expand(i + 1):
+                yield b
+            del binding[start]
+            binding.pop(end, None)
+
+    for var, nid in binding.items():
+        if nid not in graph or not node_ok(var, nid):
+            return
+    for b in expand(0):
+        yield b
+
+# Pathfinding
+#
+# The searches are written against adjacency functions that return the
+# (neighbor, edge) pairs of a node, so they do not depend on how a graph
+# stores its edges.
+
+def _weight_function(weight):
+    if weight is None:
+        return None
+    def weight_of(e):
+        w = e[3].get(weight, 1)
+        if w < 0:
+            raise MiniGraphError(
+                'Negative edge weight: {}'.format(e)
+            )
+        return w
+    return weight_of
+
+def _shortest_path(succ, pred, start, end, weight, heuristic, bidirectional):
+    if bidirectional and heuristic is not None:
+        raise MiniGraphError(
+            'Bidirectional search cannot use a heuristic.'
+        )
+    if start == end:
+        return [start]
+    weight_of = _weight_function(weight)
+    if weight_of is None and heuristic is None:
+        if bidirectional:
+            return _bibfs_path(succ, pred, start, end)
+        return _bfs_path(succ, start, end)
+    if weight_of is None:
+        weight_of = lambda e: 1
+    if bidirectional:
+        return _bidijkstra_path(succ, pred, start, end, weight_of)
+    return _dijkstra_path(succ, start, end, weight_of, heuristic)
+
+def _trace(preds, nid):
+    path = []
+    while nid is not _NOPRED:
+        path.append(nid)
+        nid = preds[nid]
+    path.reverse()
+    return path
+
+def _join(fwd, bwd, nid):
+    path = _trace(fwd, nid)
+    nid = bwd[nid]
+    while nid is not _NOPRED:
+        path.append(nid)
+        nid = bwd[nid]
+    return path
+
+# node ids may be None, so mark the ends of predecessor chains with this
+_NOPRED = object()
+
+def _bfs_path(succ, start, end):
+    preds = {start: _NOPRED}
+    frontier = [start]
+    while frontier:
+        nextfrontier = []
+        for nid in frontier:
+            for nbr, _ in succ(nid):
+                if nbr not in preds:
+                    preds[nbr] = nid
+                    if nbr == end:
+                        return _trace(preds, end)
+                    nextfrontier.append(nbr)
+        frontier = nextfrontier
+    return None
+
+def _bibfs_path(succ, pred, start, end):
+    # expand a full level of the smaller frontier each time; the first
+    # node found by both searches is on a shortest path
+    fwd = {start: _NOPRED}
+    bwd = {end: _NOPRED}
+    ffrontier = [start]
+    bfrontier = [end]
+    while ffrontier and bfrontier:
+        if len(ffrontier) <= len(bfrontier):
+            frontier, adjacency, seen, other = ffrontier, succ, fwd, bwd
+        else:
+            frontier, adjacency, seen, other = bfrontier, pred, bwd, fwd
+        nextfrontier = []
+        for nid in frontier:
+            for nbr, _ in adjacency(nid):
+                if nbr not in seen:
+                    seen[nbr] = nid
+                    if nbr in other:
+                        return _join(fwd, bwd, nbr)
+                    nextfrontier.append(nbr)
+        if seen is fwd:
+            ffrontier = nextfrontier
+        else:
+            bfrontier = nextfrontier
+    return None
+
+def _dijkstra_path(succ, start, end, weight_of, heuristic):
+    # stale heap entries are skipped when popped (lazy deletion); the
+    # counter breaks ties so node ids are never compared
+    c = count()
+    dist = {start: 0}
+    preds = {start: _NOPRED}
+    h = heuristic(start, end) if heuristic is not None else 0
+    heap = [(h, 0, next(c), start)]
+    while heap:
+        _, d, _, nid = heappop(heap)
+        if d > dist[nid]:
+            continue
+        if nid == end:
+            return _trace(preds, end)
+        for nbr, e in succ(nid):
+            nd = d + weight_of(e)
+            if nbr not in dist or nd < dist[nbr]:
+                dist[nbr] = nd
+                preds[nbr] = nid
+                if heuristic is not None:
+                    h = nd + heuristic(nbr, end)
+                else:
+                    h = nd
+                heappush(heap, (h, nd, next(c), nbr))
+    return None
+
+def _bidijkstra_path(succ, pred, start, end, weight_of):
+    c = count()
+    dists = ({start: 0}, {end: 0})
+    preds = ({start: _NOPRED}, {end: _NOPRED})
+    heaps = ([(0, next(c), start)], [(0, next(c), end)])
+    adjacencies = (succ, pred)
+    best = meet = None
+    while heaps[0] and heaps[1]:
+        # no path through unsettled nodes can beat the best one found
+        if best is not None and heaps[0][0][0] + heaps[1][0][0] >= best:
+            break
+        side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+        d, _, nid = heappop(heaps[side])
+        dist = dists[side]
+        if d > dist[nid]:
+            continue
+        other = dists[1 - side]
+        for nbr, e in adjacencies[side](nid):
+            nd = d + weight_of(e)
+            if nbr not in dist or nd < dist[nbr]:
+                dist[nbr] = nd
+                preds[side][nbr] = nid
+                heappush(heaps[side], (nd, next(c), nbr))
+            if nbr in other:
+                total = dist[nbr] + other[nbr]
+                if best is None or total < best:
+                    best, meet = total, nbr
+    if meet is None:
+        return None
+    return _join(preds[0], preds[1], meet)
+
+def _shortest_path_preds(succ, start, end, weight):
+    # Map each node to the dict of its predecessors on shortest paths;
+    # stop once nodes farther than *end* would be visited.
+    weight_of = _weight_function(weight)
+    preds = {start: {}}
+    if weight_of is None:
+        dist = {start: 0}
+        frontier = [start]
+        while frontier and end not in dist:
+            nextfrontier = []
+            for nid in frontier:
+                d = dist[nid] + 1
+                for nbr, _ in succ(nid):
+                    if nbr not in dist:
+                        dist[nbr] = d
+                        preds[nbr] = {nid: None}
+                        nextfrontier.append(nbr)
+                    elif dist[nbr] == d:
+                        preds[nbr][nid] = None
+            frontier = nextfrontier
+    else:
+        c = count()
+        dist = {start: 0}
+        heap = [(0, next(c), start)]
+        # predecessors are only recorded into nodes not yet settled, so
+        # zero-weight cycles cannot make nodes each other's predecessors
+        settled = set()
+        while heap:
+            d, _, nid = heappop(heap)
+            if d > dist[nid] or nid in settled:
+                continue
+            # zero-weight edges can still add predecessors to the end
+            if end in dist and d > dist[end]:
+                break
+            if nid == end:
+                continue
+            settled.add(nid)
+            for nbr, e in succ(nid):
+                if nbr in settled:
+                    continue
+                nd = d + weight_of(e)
+                if nbr not in dist or nd < dist[nbr]:
+                    dist[nbr] = nd
+                    preds[nbr] = {nid: None}
+                    heappush(heap, (nd, next(c), nbr))
+                elif nd == dist[nbr]:
+                    preds[nbr][nid] = None
+    return preds
+
+def _all_shortest_paths(succ, start, end, weight):
+    if start == end:
+        return [[start]]
+    preds = _shortest_path_preds(succ, start, end, weight)
+    if end not in preds:
+        return []
+    # walk the predecessor DAG back from the end without recursion
+    paths = []
+    stack = [(end, [end])]
+    while stack:
+        nid, path = stack.pop()
+        if nid == start:
+            paths.append(path[::-1])
+            continue
+        for p in preds[nid]:
+            stack.append((p, path + [p]))
+    return paths
+
+def _shortest_path_lengths(succ, start, weight):
+    weight_of = _weight_function(weight)
+    dist = {start: 0}
+    if weight_of is None:
+        frontier = [start]
+        d = 0
+        while frontier:
+            d += 1
+            nextfrontier = []
+            for nid in frontier:
+                for nbr, _ in succ(nid):
+                    if nbr not in dist:
+                        dist[nbr] = d
+                        nextfrontier.append(nbr)
+            frontier = nextfrontier
+    else:
+        c = count()
+        heap = [(0, next(c), start)]
+        while heap:
+            d, _, nid = heappop(heap)
+            if d > dist[nid]:
+                continue
+            for nbr, e in succ(nid):
+                nd = d + weight_of(e)
+                if nbr not in dist or nd < dist[nbr]:
+                    dist[nbr] = nd
+                    heappush(heap, (nd, next(c), nbr))
+    return dist
+
+class _UnionFind(object):
+    """
+    Disjoint sets with union by size and path halving.
+    """
+
+    __slots__ = ('parent', 'size', 'count')
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+        self.count = 0
+
+    def add(self, x):
+        self.parent[x] = x
+        self.size[x] = 1
+        self.count += 1
+
+    def copy(self):
+        uf = _UnionFind()
+        uf.parent = dict(self.parent)
+        uf.size = dict(self.size)
+        uf.count = self.count
+        return uf
+
+    def discard(self, x):
+        # only valid for singleton sets
+        del self.parent[x]
+        del self.size[x]
+        self.count -= 1
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = x = parent[parent[x]]
+        return x
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return False
+        size = self.size
+        if size[a] < size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        size[a] += size.pop(b)
+        self.count -= 1
+        return True
+
+class _Reachability(object):
+    """
+    Post-order intervals of a depth-first spanning forest over the
+    directed edges, with bitsets of the other descendants. If the graph
+    has a directed cycle, *order* is `None`.
+    """
+
+    __slots__ = ('version', 'order', 'post', 'low', 'extra')
+
+    def __init__(self, g):
+        self.version = g._version
+        graph = g._graph
+        # searching from the nodes in topological order makes the
+        # trees start at the sources
+        roots = _topological_sort(graph)
+        if len(roots) != len(graph):
+            self.order = self.post = self.low = self.extra = None
+            return
+        order = []
+        post = {}
+        low = {}
+        for root in roots:
+            if root in low:
+                continue
+            low[root] = 0
+            stack = [(root, iter(_directed_links(graph[root], 2)))]
+            lows = [len(order)]
+            while stack:
+                nid, links = stack[-1]
+                for other in links:
+                    if other not in low:
+                        low[other] = 0
+                        stack.append(
+                            (other, iter(_directed_links(graph[other], 2))))
+                        lows.append(len(order))
+                        break
+                else:
+                    stack.pop()
+                    low[nid] = lows.pop()
+                    post[nid] = len(order)
+                    order.append(nid)
+        # successors come earlier in post-order, so their bitsets are done
+        extra = {}
+        for nid in order:
+            lo = low[nid]
+            p = post[nid]
+            bits = 0
+            for other in _directed_links(graph[nid], 2):
+                q = post[other]
+                if not lo <= q <= p:
+                    bits |= _interval(low[other], q)
+                if other in extra:
+                    bits |= extra[other]
+            if bits:
+                bits &= ~_interval(lo, p)
+                if bits:
+                    extra[nid] = bits
+        self.order = order
+        self.post = post
+        self.low = low
+        self.extra = extra
+
+    def reachable(self, start, end):
+        q = self.post[end]
+        return (self.low[start] <= q <= self.post[start] or
+                bool(self.extra.get(start, 0) >> q & 1))
+
+    def descendants(self, nodeid):
+        order = self.order
+        nids = set(order[self.low[nodeid]:self.post[nodeid]])
+        bits = self.extra.get(nodeid)
+        if bits:
+            s = bin(bits)[:1:-1]  # digits from the lowest bit
+            i = s.find('1')
+            while i != -1:
+                nids.add(order[i])
+                i = s.find('1', i + 1)
+        return nids
+
+    def ancestors(self, nodeid):
+        q = self.post[nodeid]
+        low = self.low
+        post = self.post
+        extra = self.extra
+        return set(nid for nid in self.order
+                   if (low[nid] <= q <= post[nid] or
+                       nid in extra and extra[nid] >> q & 1)
+                   and nid != nodeid)
+
+    def add_node(self, nodeid):
+        # a new node is a tree of its own
+        if nodeid not in self.post:
+            self.low[nodeid] = self.post[nodeid] = len(self.order)
+            self.order.append(nodeid)
+
+    def add_edge(self, start, end):
+        # add the descendants of *end* to the nodes reaching *start*;
+        # return False if the edge makes a cycle
+        if self.reachable(end, start):
+            return False
+        if self.reachable(start, end):
+            return True
+        bits = _interval(self.low[end], self.post[end])
+        bits |= self.extra.get(end, 0)
+        low = self.low
+        post = self.post
+        extra = self.extra
+        for nid in self.ancestors(start) | set([start]):
+            new = (extra.get(nid, 0) | bits) & ~_interval(low[nid], post[nid])
+            if new:
+                extra[nid] = new
+        return True
+
+class _LRUCache(object):
+    """
+    Query results for one version of a graph, in least- to
+    most-recently used order.
+    """
+
+    __slots__ = ('entries', 'maxsize', 'version', 'hits', 'misses')
+
+    def __init__(self, maxsize, version):
+        self.entries = OrderedDict()
+        self.maxsize = maxsize
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+
+def _label_key(labels):
+    # labels are followed as a set, so their order does not matter
+    return None if labels is None else frozenset(labels)
+
+def _copy_data(data):
+    return dict(data) if data else _EMPTY
+
+def _copy_indexes(indexes):
+    if indexes is None:
+        return None
+    return dict((key, dict((val, set(ids)) for val, ids in values.items()))
+                for key, values in indexes.items())
+
+def _index_data(indexes, data, id):
+    for key, values in indexes.items():
+        if key in data:
+            try:
+                ids = values.get(data[key])
+            except TypeError:  # unhashable values are not indexed
+                continue
+            if ids is None:
+                values[data[key]] = set([id])
+            else:
+                ids.add(id)
+
+def _unindex_data(indexes, data, id):
+    for key, values in indexes.items():
+        if key in data:
+            val = data[key]
+            try:
+                ids = values.get(val)
+            except TypeError:
+                continue
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del values[val]
+
+def _index_lookup(indexes, items):
+    # the smallest set of ids indexed under any of *items*, or None if
+    # none of them can use an index
+    best = None
+    if indexes:
+        for key, val in items:
+            if key in indexes:
+                try:
+                    ids = indexes[key].get(val, ())
+                except TypeError:
+                    continue
+                if best is None or len(ids) < len(best):
+                    best = ids
+    return best
+
+def _unindex(index, label, nodeid):
+    nodeids = index[label]
+    nodeids.discard(nodeid)
+    if not nodeids:
+        del index[label]
+
+def _unlink(graph, links, i, index):
+    # delete grouped (label, nodeid) links from the *i*th link dict of
+    # each node, then drop the label dicts left empty
+    for nid, pairs in links.items():
+        ld = graph[nid][i]
+        for label, other in pairs:
+            del ld[label][other]
+        if len(pairs) == 1:
+            labels = (pairs[0][0],)
+        else:
+            labels = set(label for label, _ in pairs)
+        for label in labels:
+            if not ld[label]:
+                del ld[label]
+                if index is not None:
+                    _unindex(index, label, nid)
+
+def _link_edges(links, label):
+    if label is Ellipsis:
+        for ed in links.values():
+            for e in ed.values():
+                yield e
+    elif label in links:
+        for e in links[label].values():
+            yield e
+
+def _unique(xs):
+    seen = set()
+    for x in xs:
+        if x not in seen:
+            seen.add(x)
+            yield x
+
+def _link_nodes(*linkdicts):
+    # the same node may be linked under several labels
+    seen = set()
+    for links in linkdicts:
+        for ed in links.values():
+            for nid in ed:
+                if nid not in seen:
+                    seen.add(nid)
+                    yield nid
+
+def _data_matches(data, items):
+    for key, val in items:
+        if key not in data or data[key] != val:
+            return False
+    return True
+
+def _normalize_edges(edges):
+    for edge in edges:
+        edgelen = len(edge)
+        if edgelen == 5:
+            start, end, label, data, directed = edge
+        elif edgelen == 2:
+            start, end = edge; label = data = None; directed = True
+        elif edgelen == 4:
+            start, end, label, data = edge; directed = True
+        elif edgelen == 3:
+            start, end, label = edge; data = None; directed = True
+        else:
+            raise MiniGraphError('Invalid edge: {}'.format(edge))
+        if not data: data = _EMPTY
+        yield (start, end, label, data, directed)
@@ -5,6 +5,30 @@ import minigraph as mg
 def esort(es):
     return sorted(es, key=lambda e: (e[0], e[1], e[2] is not None, e[2]))
 
+def check_counters(g):
+    # compare the maintained counters against a full recount
+    es = g.edges()
+    assert g.size() == len(es)
+    assert g.size(directed=False) == len([e for e in es if e[4] is False])
+    for lbl in set(e[2] for e in es):
+        assert g.size(label=lbl) == len([e for e in es if e[2] == lbl])
+    assert (sorted(g.labels(), key=str) ==
+            sorted(set(e[2] for e in es), key=str))
+    for nid, n in g._graph.items():
+        out = sum(len(ed) for ed in n[2].values())
+        in_ = sum(len(ed) for ed in n[3].values())
+        loops = len([e for ed in n[3].values() for e in ed.values()
+                     if e[4] or e[0] == e[1]])
+        assert g.out_degree(nid) == out
+        assert g.in_degree(nid) == in_
+        assert g.degree(nid) == out + loops
+    # the label index lists exactly the nodes with forward links
+    index = {}
+    for nid, n in g._graph.items():
+        for lbl in n[2]:
+            index.setdefault(lbl, set()).add(nid)
+    assert g._label_index == index
+
 def test_simple_init():
     g = mg.MiniGraph()
     assert g.nodes() == []
@@ -151,6 +175,18 @@ def test_remove_node():
     assert g.edges() == [(2, 3, None, {}, True)]
     with pytest.raises(KeyError):
         g.remove_node(1)
+    check_counters(g)
+
+    # undirected edges are removed from both ends
+    g = mg.MiniGraph(edges=[(1,2,None,None,False), (3,1,'a',None,False),
+                            (1,1,'b',None,False), (2,3)])
+    g.remove_node(1)
+    assert sorted(g.nodes()) == [(2, {}), (3, {})]
+    assert g.edges() == [(2, 3, None, {}, True)]
+    assert g._graph[2][2] == {None: {3: (2, 3, None, {}, True)}}
+    assert g._graph[2][3] == {}
+    assert g._graph[3][2] == {}
+    check_counters(g)
 
 def test_add_edge():
     g = mg.MiniGraph()
@@ -224,6 +260,79 @@ def test_remove_edge():
         g.edge(1,2)
     with pytest.raises(KeyError):
         g.edge(2,1)
+    check_counters(g)
+    assert g.degree(1) == g.degree(2) == 0
+
+def test_remove_nodes():
+    for nodeids in ([1], [1, 3], [3, 4, 5], [1, 2, 3, 4, 5, 6], []):
+        g = mixed_graph()
+        h = mixed_graph()
+        g.remove_nodes(nodeids)
+        for nid in nodeids:
+            h.remove_node(nid)
+        assert sorted(g.nodes()) == sorted(h.nodes())
+        assert esort(g.edges()) == esort(h.edges())
+        check_counters(g)
+        check_counters(h)
+        # the same with counters kept up to date during the removals
+        h = mixed_graph()
+        check_counters(h)
+        for nid in nodeids:
+            h.remove_node(nid)
+        assert esort(g.edges()) == esort(h.edges())
+        check_counters(h)
+    g = mixed_graph()
+    with pytest.raises(KeyError):
+        g.remove_nodes([1, 7])
+    assert g.order() == 6
+    check_counters(g)
+
+def test_remove_edges():
+    g = mixed_graph()
+    g.remove_edges([(1, 2), (2, 3, 'a'), (1, 3, 'b'), (3, 3, 'a', {}, False)])
+    assert esort(g.edges()) == [(1, 2, 'a', {}, True), (4, 1, 'a', {}, True),
+                                (4, 4, None, {}, True), (5, 4, 'b', {}, True)]
+    assert g.degree(3) == 0
+    check_counters(g)
+    g.remove_edges(g.find_edges(end=4))
+    assert esort(g.edges()) == [(1, 2, 'a', {}, True), (4, 1, 'a', {}, True)]
+    check_counters(g)
+    # nothing is removed if any edge is missing or repeated
+    for edges in ([(1, 2, 'a'), (1, 4)], [(1, 2, 'a'), (1, 2, 'a')],
+                  [(4, 1, 'a', {}, False)]):
+        with pytest.raises(KeyError):
+            g.remove_edges(edges)
+        assert g.size() == 2
+    # undirected edges are the same from either end
+    g = mg.MiniGraph(edges=[(1, 2, None, None, False)])
+    with pytest.raises(KeyError):
+        g.remove_edges([(1, 2), (2, 1)])
+    g.remove_edges([(2, 1)])
+    assert g.size() == 0
+    check_counters(g)
+
+def test_counters_kept_up_to_date():
+    # counters are built by the first query, then updated by changes
+    g = mixed_graph()
+    assert g._degrees is None
+    check_counters(g)
+    g.add_edges([(6, 1, 'c'), (2, 6, 'a', None, False), (7, 7, 'c', None,
+                                                         False)])
+    g.add_node(8)
+    check_counters(g)
+    g.remove_edges([(2, 3, 'a'), (6, 2, 'a')])
+    g.remove_edge(7, 7, 'c')
+    check_counters(g)
+    g.remove_nodes([1, 8])
+    check_counters(g)
+    g.remove_node(5)
+    g.remove_node(7)
+    check_counters(g)
+    h = g.copy()
+    h.add_edge(4, 5, 'c')
+    h.remove_node(3)
+    check_counters(g)
+    check_counters(h)
 
 def test_node():
     pass
@@ -232,7 +341,71 @@ def test_edge():
     pass
 
 def test_find_edges():
-    pass
+    g = mg.MiniGraph(edges=[
+        (1, 2), (1, 2, 'a'), (2, 3, 'a', {'x': 1}), (3, 1, 'b', None, False),
+        (3, 3, 'a', {'x': 2}, False), (4, 1, 'a')
+    ])
+    all_edges = esort(g.edges())
+    assert esort(g.find_edges()) == all_edges
+    assert esort(g.find_edges(Ellipsis, Ellipsis)) == all_edges
+    # by start
+    assert esort(g.find_edges(1)) == [(1, 2, None, {}, True),
+                                      (1, 2, 'a', {}, True),
+                                      (3, 1, 'b', {}, False)]
+    assert g.find_edges(1, label='a') == [(1, 2, 'a', {}, True)]
+    assert g.find_edges(1, label='c') == []
+    assert g.find_edges(5) == []
+    # by end
+    assert esort(g.find_edges(end=1)) == [(3, 1, 'b', {}, False),
+                                          (4, 1, 'a', {}, True)]
+    assert g.find_edges(end=1, label='b') == [(3, 1, 'b', {}, False)]
+    assert g.find_edges(end=5) == []
+    # by start and end
+    assert esort(g.find_edges(1, 2)) == [(1, 2, None, {}, True),
+                                         (1, 2, 'a', {}, True)]
+    assert g.find_edges(1, 2, label=None) == [(1, 2, None, {}, True)]
+    assert g.find_edges(2, 1) == []
+    assert g.find_edges(1, 3) == [(3, 1, 'b', {}, False)]
+    # by label only
+    assert esort(g.find_edges(label='a')) == [(1, 2, 'a', {}, True),
+                                              (2, 3, 'a', {'x': 1}, True),
+                                              (3, 3, 'a', {'x': 2}, False),
+                                              (4, 1, 'a', {}, True)]
+    assert g.find_edges(label='b') == [(3, 1, 'b', {}, False)]
+    assert g.find_edges(label=None) == [(1, 2, None, {}, True)]
+    assert g.find_edges(label='c') == []
+    # by directedness
+    assert esort(g.find_edges(directed=False)) == [
+        (3, 1, 'b', {}, False), (3, 3, 'a', {'x': 2}, False)]
+    assert g.find_edges(3, directed=True) == []
+    assert len(g.find_edges(label='a', directed=True)) == 3
+    # by data
+    assert g.find_edges(data={'x': 1}) == [(2, 3, 'a', {'x': 1}, True)]
+    assert g.find_edges(label='a', data={'x': 2}) == [
+        (3, 3, 'a', {'x': 2}, False)]
+    assert g.find_edges(data={'x': None}) == []
+    # the label index follows removals
+    g.remove_edge(1, 3, 'b')
+    g.remove_node(4)
+    assert g.find_edges(label='b') == []
+    assert esort(g.find_edges(label='a')) == [(1, 2, 'a', {}, True),
+                                              (2, 3, 'a', {'x': 1}, True),
+                                              (3, 3, 'a', {'x': 2}, False)]
+    check_counters(g)
+
+def test_getitem():
+    g = mg.MiniGraph([(1, {'attr': 'val'})],
+                     [(1, 2), (1, 2, 'a'), (2, 3, 'a')])
+    assert g[1] == (1, {'attr': 'val'})
+    with pytest.raises(KeyError):
+        g[4]
+    assert g[1:2] == [(1, 2, None, {}, True)]
+    assert esort(g[1:2:...]) == [(1, 2, None, {}, True),
+                                 (1, 2, 'a', {}, True)]
+    assert esort(g[::'a']) == [(1, 2, 'a', {}, True), (2, 3, 'a', {}, True)]
+    assert g[:3:'a'] == [(2, 3, 'a', {}, True)]
+    assert g[1:...:'a'] == [(1, 2, 'a', {}, True)]
+    assert esort(g[::...]) == esort(g.edges())
 
 def test_order():
     assert mg.MiniGraph().order() == 0
@@ -255,6 +428,40 @@ def test_size():
     # undirected
     assert mg.MiniGraph(edges=[(1,1,None,None,False)]).size() == 1
     assert mg.MiniGraph(edges=[(1,2,None,None,False)]).size() == 1
+    # updating an existing edge does not add to the count
+    g = mg.MiniGraph(edges=[(1,2,None,{'a': 1}),(1,2,None,{'b': 2})])
+    assert g.size() == 1
+    g = mg.MiniGraph(edges=[(1,2,None,None,False),(2,1,None,None,False)])
+    assert g.size() == 1
+    # by label and directedness
+    g = mg.MiniGraph(edges=[(1,2),(1,2,'a'),(2,3,'a',None,False),(3,3,'b')])
+    assert g.size(directed=True) == 3
+    assert g.size(directed=False) == 1
+    assert g.size(label=None) == 1
+    assert g.size(label='a') == 2
+    assert g.size(label='a', directed=False) == 1
+    assert g.size(label='b', directed=False) == 0
+    assert g.size(label='c') == 0
+    check_counters(g)
+    g.remove_edge(3, 2, 'a')
+    g.remove_edge(3, 3, 'b')
+    assert g.size() == 2
+    assert g.size(directed=False) == 0
+    assert sorted(g.labels(), key=str) == [None, 'a']
+    check_counters(g)
+
+def test_mixed_edge_conflict():
+    # an undirected edge may not overlap a directed one, and the graph
+    # is not changed by the failed edge
+    g = mg.MiniGraph(edges=[(2,1)])
+    with pytest.raises(mg.MiniGraphError):
+        g.add_edge(1, 2, directed=False)
+    assert g.edges() == [(2, 1, None, {}, True)]
+    assert g._graph[1][2] == {}
+    check_counters(g)
+    with pytest.raises(mg.MiniGraphError):
+        g.add_edge(2, 1, directed=False)
+    check_counters(g)
 
 def test_out_degree():
     with pytest.raises(KeyError):
@@ -421,3 +628,1153 @@ def test_subgraph():
     assert esort(sg.edges()) == [(1, 1, None, {}, True),
                                  (1, 1, 'und', {}, False)]
 
+
+def csort(cs):
+    return sorted(sorted(c) for c in cs)
+
+def test_connectivity():
+    g = mg.MiniGraph()
+    assert g.number_of_components() == 0
+    assert not g.is_connected()
+    g.add_node(1)
+    assert g.is_connected()
+    assert g.component_of(1) == set([1])
+    g.add_edges([(1, 2), (3, 4, 'a', None, False), (5, 5)])
+    assert g.number_of_components() == 3
+    assert not g.is_connected()
+    assert csort(g.components()) == [[1, 2], [3, 4], [5]]
+    assert g.component_of(4) == set([3, 4])
+    # direction does not matter for weak connectivity
+    g.add_edge(4, 1)
+    g.add_edge(2, 5)
+    assert g.is_connected()
+    assert g.component_of(5) == set([1, 2, 3, 4, 5])
+    with pytest.raises(KeyError):
+        g.component_of(6)
+
+def test_connectivity_after_removal():
+    g = mg.MiniGraph(edges=[(1, 2), (2, 3), (2, 3, 'a'), (3, 3)])
+    # components are computed on the first query, then maintained
+    assert g._components is None
+    assert g.is_connected()
+    g.add_node(4)
+    assert g._components is not None
+    assert g.number_of_components() == 2
+    # isolated nodes and loops do not require a recount
+    g.remove_node(4)
+    g.remove_edge(3, 3)
+    assert g._components is not None
+    assert g.is_connected()
+    # nor do edges with a parallel edge remaining
+    g.remove_edge(2, 3)
+    assert g._components is not None
+    assert g.is_connected()
+    g.remove_edge(2, 3, 'a')
+    assert g._components is None
+    assert csort(g.components()) == [[1, 2], [3]]
+    g.add_edge(3, 1)
+    assert g.is_connected()
+    g.remove_node(1)
+    assert g.number_of_components() == 2
+    g.add_edge(2, 3, directed=False)
+    assert g.is_connected()
+    assert g.component_of(2) == set([2, 3])
+
+def test_shortest_path():
+    # 1 -> 2 -> 3 -> 4 and a labeled shortcut 1 -> 4, plus an
+    # undirected edge 4 - 5 and a weighted detour 1 -> 6 -> 4
+    g = mg.MiniGraph(edges=[
+        (1, 2, None, {'w': 1}), (2, 3, None, {'w': 1}),
+        (3, 4, None, {'w': 1}), (1, 4, 'x', {'w': 10}),
+        (4, 5, None, None, False), (1, 6, None, {'w': 1}),
+        (6, 4, 'y', {'w': 1.5})
+    ])
+    g.add_node(7)
+    for bidirectional in (False, True):
+        sp = lambda *a, **kw: g.shortest_path(
+            *a, bidirectional=bidirectional, **kw)
+        assert sp(1, 1) == [1]
+        assert sp(1, 4) == [1, 4]
+        assert sp(1, 5) == [1, 4, 5]
+        assert sp(5, 4) == [5, 4]
+        assert sp(4, 1) is None
+        assert sp(1, 7) is None
+        assert sp(1, 4, labels=[None]) == [1, 2, 3, 4]
+        assert sp(1, 4, labels=[None, 'y']) == [1, 6, 4]
+        assert sp(1, 5, directed=True) is None
+        assert sp(4, 5, directed=False) == [4, 5]
+        assert sp(1, 4, weight='w') == [1, 6, 4]
+        assert sp(1, 5, weight='w') == [1, 6, 4, 5]
+        assert sp(1, 4, weight='w', labels=[None]) == [1, 2, 3, 4]
+        assert sp(5, 1, weight='w') is None
+    # A*
+    h = lambda n, end: 0
+    assert g.shortest_path(1, 5, weight='w', heuristic=h) == [1, 6, 4, 5]
+    assert g.shortest_path(1, 5, heuristic=h) == [1, 4, 5]
+    with pytest.raises(mg.MiniGraphError):
+        g.shortest_path(1, 5, heuristic=h, bidirectional=True)
+    with pytest.raises(KeyError):
+        g.shortest_path(1, 8)
+    with pytest.raises(KeyError):
+        g.shortest_path(8, 1)
+    g.add_edge(5, 7, data={'w': -1})
+    with pytest.raises(mg.MiniGraphError):
+        g.shortest_path(1, 7, weight='w')
+
+def test_shortest_path_long_chain():
+    # searches are iterative, so long paths do not hit recursion limits
+    n = 5000
+    g = mg.MiniGraph.fast_init(
+        edges=[(i, i + 1, None, {}, True) for i in range(n)])
+    assert len(g.shortest_path(0, n)) == n + 1
+    assert len(g.shortest_path(0, n, bidirectional=True)) == n + 1
+    assert len(g.shortest_path(0, n, weight='w')) == n + 1
+    assert len(g.all_shortest_paths(0, n)[0]) == n + 1
+    assert g.shortest_path_lengths(0)[n] == n
+
+def test_all_shortest_paths():
+    g = mg.MiniGraph(edges=[
+        (1, 2), (1, 3), (2, 4), (3, 4), (1, 4, 'long'), (4, 5),
+        (1, 2, 'parallel')
+    ])
+    assert sorted(g.all_shortest_paths(1, 5, labels=[None])) == [
+        [1, 2, 4, 5], [1, 3, 4, 5]]
+    assert g.all_shortest_paths(1, 5) == [[1, 4, 5]]
+    assert g.all_shortest_paths(1, 1) == [[1]]
+    assert g.all_shortest_paths(5, 1) == []
+    g = mg.MiniGraph(edges=[
+        (1, 2, None, {'w': 2}), (2, 4, None, {'w': 2}),
+        (1, 3, None, {'w': 1}), (3, 4, None, {'w': 3}),
+        (1, 4, None, {'w': 5})
+    ])
+    assert sorted(g.all_shortest_paths(1, 4, weight='w')) == [
+        [1, 2, 4], [1, 3, 4]]
+    # zero-weight cycles, e.g., one undirected edge, must not loop
+    g = mg.MiniGraph(edges=[(0, 1, None, {'w': 1}),
+                            (1, 2, None, {'w': 0}, False),
+                            (2, 3, None, {'w': 1})])
+    assert g.all_shortest_paths(0, 3, weight='w') == [[0, 1, 2, 3]]
+    g = mg.MiniGraph(edges=[(0, 1, None, {'w': 1}), (1, 3, None, {'w': 0}),
+                            (1, 2, None, {'w': 0}), (2, 3, None, {'w': 0}),
+                            (2, 1, None, {'w': 0})])
+    assert sorted(g.all_shortest_paths(0, 3, weight='w')) == [
+        [0, 1, 2, 3], [0, 1, 3]]
+
+def test_shortest_path_lengths():
+    g = mg.MiniGraph(edges=[
+        (1, 2, None, {'w': 5}), (2, 3), (1, 3, 'a', {'w': 1}),
+        (3, 4, None, {'w': 2}, False)
+    ])
+    assert g.shortest_path_lengths(1) == {1: 0, 2: 1, 3: 1, 4: 2}
+    assert g.shortest_path_lengths(1, weight='w') == {1: 0, 2: 5, 3: 1, 4: 3}
+    assert g.shortest_path_lengths(4) == {4: 0, 3: 1}
+    assert g.shortest_path_lengths(1, labels=[None]) == {
+        1: 0, 2: 1, 3: 2, 4: 3}
+    assert g.shortest_path_lengths(1, directed=True) == {1: 0, 2: 1, 3: 1}
+
+def mixed_graph():
+    g = mg.MiniGraph(
+        [(1, {'attr': 'val'}), 6],
+        [(1, 2), (1, 2, 'a'), (2, 3, 'a', {'x': 1}), (3, 1, 'b', None, False),
+         (3, 3, 'a', {'x': 2}, False), (4, 1, 'a'), (4, 4), (5, 4, 'b')]
+    )
+    return g
+
+def mmapped(fg, tmp_path):
+    path = str(tmp_path / 'graph.mm')
+    fg.write_mmap(path)
+    return mg.MiniGraph.open_mmap(path)
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_freeze(mmap, tmp_path):
+    g = mixed_graph()
+    fg = g.freeze()
+    if mmap:
+        fg = mmapped(fg, tmp_path)
+    assert isinstance(fg, mg.FrozenMiniGraph)
+    assert fg.order() == g.order()
+    assert sorted(fg.nodes()) == sorted(g.nodes())
+    assert esort(fg.edges()) == esort(g.edges())
+    assert sorted(fg.labels(), key=str) == sorted(g.labels(), key=str)
+    for lbl in (Ellipsis, None, 'a', 'b', 'c'):
+        for directed in (None, True, False):
+            assert fg.size(lbl, directed) == g.size(lbl, directed)
+    for nid in g._graph:
+        assert fg.node(nid) == g.node(nid)
+        assert fg[nid] == g[nid]
+        assert fg.degree(nid) == g.degree(nid)
+        assert fg.out_degree(nid) == g.out_degree(nid)
+        assert fg.in_degree(nid) == g.in_degree(nid)
+    for e in g.edges():
+        assert fg.edge(e[0], e[1], e[2]) == e
+        if e[4] is False:
+            assert fg.edge(e[1], e[0], e[2]) == e
+    with pytest.raises(KeyError):
+        fg.edge(2, 1)
+    with pytest.raises(KeyError):
+        fg.edge(1, 2, 'c')
+    with pytest.raises(KeyError):
+        fg.node(7)
+    nodes = list(g._graph) + [7, None]
+    for start in nodes:
+        for end in nodes:
+            for lbl in (Ellipsis, None, 'a', 'b', 'c'):
+                assert (esort(fg.find_edges(start, end, label=lbl)) ==
+                        esort(g.find_edges(start, end, label=lbl)))
+    for kw in ({'directed': True}, {'directed': False},
+               {'data': {'x': 1}}, {'label': 'a', 'data': {'x': 2}}):
+        assert esort(fg.find_edges(**kw)) == esort(g.find_edges(**kw))
+    assert esort(fg[1::...]) == esort(g[1::...])
+    assert fg[::'b'] == g[::'b']
+    # subgraphs are frozen too
+    sg = fg.subgraph([1, 2, 3])
+    assert isinstance(sg, mg.FrozenMiniGraph)
+    assert esort(sg.edges()) == esort(g.subgraph([1, 2, 3]).edges())
+    # thawing gives back an equivalent, independent graph
+    g2 = fg.thaw()
+    assert esort(g2.edges()) == esort(g.edges())
+    assert sorted(g2.nodes()) == sorted(g.nodes())
+    g2.add_edge(1, 6)
+    assert fg.size() == g.size()
+    # frozen data is a snapshot
+    g.add_edge(1, 2, data={'new': True})
+    assert fg.edge(1, 2) == (1, 2, None, {}, True)
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_frozen_traversal(mmap, tmp_path):
+    g = mixed_graph()
+    fg = g.freeze()
+    if mmap:
+        fg = mmapped(fg, tmp_path)
+        assert isinstance(fg._estart, memoryview)
+    for nid in g._graph:
+        assert set(fg.successors(nid)) == set(g.successors(nid))
+        assert set(fg.predecessors(nid)) == set(g.predecessors(nid))
+        assert sorted(fg.neighbors(nid)) == sorted(g.neighbors(nid))
+        for lbl in (Ellipsis, None, 'a', 'c'):
+            assert (esort(fg.iter_out_edges(nid, lbl)) ==
+                    esort(g.iter_out_edges(nid, lbl)))
+            assert (esort(fg.iter_in_edges(nid, lbl)) ==
+                    esort(g.iter_in_edges(nid, lbl)))
+    for kw in ({}, {'labels': ['a']}, {'directed': True},
+               {'weight': 'x'}, {'bidirectional': True}):
+        assert fg.shortest_path(5, 3, **kw) == g.shortest_path(5, 3, **kw)
+        kw.pop('bidirectional', None)
+        assert fg.shortest_path_lengths(4, **kw) == \
+            g.shortest_path_lengths(4, **kw)
+    assert fg.all_shortest_paths(4, 3) == g.all_shortest_paths(4, 3)
+    assert fg.shortest_path(6, 1) is None
+    with pytest.raises(KeyError):
+        fg.shortest_path(1, 7)
+
+def test_mmap_errors(tmp_path):
+    path = tmp_path / 'graph.mm'
+    path.write_bytes(b'not a graph file')
+    with pytest.raises(mg.MiniGraphError):
+        mg.MiniGraph.open_mmap(str(path))
+    fg = mmapped(mg.MiniGraph().freeze(), tmp_path)
+    assert fg.order() == fg.size() == 0
+
+def test_freeze_empty():
+    fg = mg.MiniGraph().freeze()
+    assert fg.order() == 0
+    assert fg.size() == 0
+    assert fg.edges() == []
+    assert fg.find_edges(label='a') == []
+    fg = mg.MiniGraph([1]).freeze()
+    assert fg.nodes() == [(1, {})]
+    assert fg.degree(1) == 0
+    assert fg.find_edges(1) == []
+
+@pytest.fixture(params=['numpy', 'python'])
+def columns_backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(mg, 'numpy', None)
+    return request.param
+
+def test_from_arrays(columns_backend):
+    src = [1, 1, 2, 3, 3, 4, 4, 2, 1]
+    dst = [2, 2, 3, 1, 3, 1, 4, 3, 2]
+    lbl = [None, 'a', 'a', 'b', 'a', 'a', None, 'a', None]
+    drc = [True, True, True, False, False, True, True, True, True]
+    g = mg.MiniGraph.from_arrays(src, dst, labels=lbl, directed=drc)
+    expected = mg.MiniGraph.fast_init(
+        edges=[(s, t, l, {}, d) for s, t, l, d in zip(src, dst, lbl, drc)])
+    assert isinstance(g, mg.MiniGraph)
+    assert sorted(g.nodes()) == sorted(expected.nodes())
+    assert esort(g.edges()) == esort(expected.edges())
+    for nid in expected._graph:
+        assert g.node(nid) == expected.node(nid)
+    check_counters(g)
+    assert g.is_connected()
+    # the graph is an ordinary, mutable graph
+    g.add_edge(4, 5)
+    g.remove_node(1)
+    check_counters(g)
+
+    fg = mg.MiniGraph.from_arrays(src, dst, labels=lbl, directed=drc,
+                                  freeze=True)
+    assert isinstance(fg, mg.FrozenMiniGraph)
+    assert esort(fg.edges()) == esort(expected.edges())
+    for nid in expected._graph:
+        assert fg.node(nid) == expected.node(nid)
+        assert fg.degree(nid) == expected.degree(nid)
+    assert esort(fg.find_edges(label='a')) == esort(
+        expected.find_edges(label='a'))
+
+def test_from_arrays_options(columns_backend):
+    from array import array
+    g = mg.MiniGraph.from_arrays(array('i', [0, 1]), array('i', [1, 0]),
+                                 node_ids=['x', 'y', 'zz'], directed=False)
+    assert sorted(g.nodes()) == [('x', {}), ('y', {}), ('zz', {})]
+    assert g.edges() == [('x', 'y', None, {}, False)]
+    assert g.size() == 1
+    assert g.degree('x') == g.degree('y') == 1
+    assert g.number_of_components() == 2
+    g = mg.MiniGraph.from_arrays([], [])
+    assert g.nodes() == [] and g.edges() == []
+    fg = mg.MiniGraph.from_arrays([], [], freeze=True)
+    assert fg.order() == 0 and fg.size() == 0
+    # undirected edges cannot overlap directed ones
+    with pytest.raises(mg.MiniGraphError):
+        mg.MiniGraph.from_arrays([1, 2], [2, 1], directed=[True, False])
+    with pytest.raises(mg.MiniGraphError):
+        mg.MiniGraph.from_arrays([1, 1], [2, 2], directed=[True, False])
+    # mixed node id and label types are kept as they are
+    g = mg.MiniGraph.from_arrays([1, 'a', 1.5], ['a', 2, 3],
+                                 labels=[1, '1', None])
+    assert sorted(g.edges(), key=repr) == sorted(
+        [(1, 'a', 1, {}, True), ('a', 2, '1', {}, True),
+         (1.5, 3, None, {}, True)], key=repr)
+    assert sorted((type(nid).__name__, nid) for nid, _ in g.nodes()) == [
+        ('float', 1.5), ('int', 1), ('int', 2), ('int', 3), ('str', 'a')]
+    assert set(g.labels()) == {1, '1', None}
+    # positions must be in node_ids
+    for src in ([0, -1], [0, 3]):
+        with pytest.raises(mg.MiniGraphError):
+            mg.MiniGraph.from_arrays(src, [1, 2], node_ids=['x', 'y', 'z'])
+
+def test_from_arrays_numpy():
+    numpy = pytest.importorskip('numpy')
+    src = numpy.arange(1000) % 97
+    dst = (numpy.arange(1000) * 7) % 101
+    lbl = numpy.array(['a', 'b', 'c', 'd'])[numpy.arange(1000) % 4]
+    g = mg.MiniGraph.from_arrays(src, dst, labels=lbl)
+    expected = mg.MiniGraph.fast_init(edges=[
+        (int(s), int(t), str(l), {}, True) for s, t, l in zip(src, dst, lbl)])
+    assert esort(g.edges()) == esort(expected.edges())
+    check_counters(g)
+    fg = mg.MiniGraph.from_arrays(src, dst, labels=lbl, freeze=True)
+    assert esort(fg.edges()) == esort(expected.edges())
+    assert fg.size(label='c') == expected.size(label='c')
+    # node ids given as an array become Python objects
+    g = mg.MiniGraph.from_arrays([0], [1], node_ids=numpy.array([5, 6]))
+    assert [type(nid) for nid, _ in g.nodes()] == [int, int]
+
+def test_from_edges(columns_backend, tmp_path):
+    import io
+    edges = [(1, 2), (4, 1, 'a'), (2, 4, 'a', None, False), (1, 2),
+             (4, 2, 'a', {}, False), (3, 3, None, {}, False)]
+    expected = mg.MiniGraph(edges=edges)
+    g = mg.MiniGraph.from_edges(iter(edges))
+    assert sorted(g.nodes(), key=repr) == sorted(expected.nodes(), key=repr)
+    assert esort(g.edges()) == esort(expected.edges())
+    check_counters(g)
+    fg = mg.MiniGraph.from_edges(iter(edges), freeze=True)
+    assert esort(fg.edges()) == esort(expected.edges())
+    # a streamed edge list can go straight to a memory-mapped graph
+    f = io.StringIO()
+    mg.write_edges(expected, f)
+    f.seek(0)
+    fg = mg.MiniGraph.from_edges(
+        mg.read_edges(f, label=2, directed=3, nodetype=int), freeze=True)
+    h = mmapped(fg, tmp_path)
+    assert esort(h.edges()) == esort(expected.edges())
+    assert mg.MiniGraph.from_edges([]).order() == 0
+    with pytest.raises(mg.MiniGraphError):
+        mg.MiniGraph.from_edges([(1, 2, None, {'w': 1})])
+    with pytest.raises(mg.MiniGraphError):
+        mg.MiniGraph.from_edges([(1, 2), (1, 2, None, None, False)])
+
+def test_iterators():
+    g = mixed_graph()
+    nodes = g.iter_nodes()
+    assert not isinstance(nodes, list)
+    assert sorted(nodes) == sorted(g.nodes())
+    assert esort(g.iter_edges()) == esort(g.edges())
+    assert esort(g.iter_out_edges(1)) == [(1, 2, None, {}, True),
+                                          (1, 2, 'a', {}, True),
+                                          (3, 1, 'b', {}, False)]
+    assert list(g.iter_out_edges(1, label='a')) == [(1, 2, 'a', {}, True)]
+    assert list(g.iter_out_edges(1, label='c')) == []
+    assert esort(g.iter_in_edges(1)) == [(3, 1, 'b', {}, False),
+                                         (4, 1, 'a', {}, True)]
+    assert list(g.iter_in_edges(1, label='a')) == [(4, 1, 'a', {}, True)]
+    # each node is only given once, even with several labels
+    assert sorted(g.successors(1)) == [2, 3]
+    assert sorted(g.successors(3)) == [1, 3]
+    assert sorted(g.predecessors(1)) == [3, 4]
+    assert sorted(g.predecessors(2)) == [1]
+    assert sorted(g.neighbors(1)) == [2, 3, 4]
+    assert sorted(g.neighbors(4)) == [1, 4, 5]
+    assert list(g.neighbors(6)) == []
+    with pytest.raises(KeyError):
+        g.successors(7)
+    with pytest.raises(KeyError):
+        g.iter_out_edges(7)
+    # iteration can stop early
+    it = g.iter_edges()
+    assert len(next(it)) == 5
+
+def test_subgraph_edges():
+    g = mixed_graph()
+    sg = g.subgraph([1, 2, 3])
+    assert sorted(sg.nodes()) == [(1, {'attr': 'val'}), (2, {}), (3, {})]
+    assert esort(sg.edges()) == [(1, 2, None, {}, True),
+                                 (1, 2, 'a', {}, True),
+                                 (2, 3, 'a', {'x': 1}, True),
+                                 (3, 1, 'b', {}, False),
+                                 (3, 3, 'a', {'x': 2}, False)]
+    check_counters(sg)
+    assert g.subgraph(iter([4])).edges() == [(4, 4, None, {}, True)]
+
+def test_subgraph_view():
+    g = mixed_graph()
+    with pytest.raises(KeyError):
+        g.subgraph_view([1, 7])
+    v = g.subgraph_view([1, 2, 3])
+    sg = g.subgraph([1, 2, 3])
+    assert isinstance(v, mg.MiniGraphView)
+    assert v.order() == 3
+    assert sorted(v.nodes()) == sorted(sg.nodes())
+    assert esort(v.edges()) == esort(sg.edges())
+    assert v.size() == sg.size()
+    assert v.size(label='a') == sg.size(label='a')
+    assert sorted(v.labels(), key=str) == sorted(sg.labels(), key=str)
+    for nid in (1, 2, 3):
+        assert v.node(nid) == sg.node(nid)
+        assert v[nid] == sg[nid]
+        assert v.degree(nid) == sg.degree(nid)
+        assert v.out_degree(nid) == sg.out_degree(nid)
+        assert v.in_degree(nid) == sg.in_degree(nid)
+        assert sorted(v.successors(nid)) == sorted(sg.successors(nid))
+        assert sorted(v.predecessors(nid)) == sorted(sg.predecessors(nid))
+        assert sorted(v.neighbors(nid)) == sorted(sg.neighbors(nid))
+        assert esort(v.iter_in_edges(nid)) == esort(sg.iter_in_edges(nid))
+        for lbl in (Ellipsis, None, 'a', 'b'):
+            assert (esort(v.find_edges(nid, label=lbl)) ==
+                    esort(sg.find_edges(nid, label=lbl)))
+            assert (esort(v.find_edges(end=nid, label=lbl)) ==
+                    esort(sg.find_edges(end=nid, label=lbl)))
+    assert esort(v[::'a']) == esort(sg[::'a'])
+    for lbl in (Ellipsis, None, 'a', 'b', 'c'):
+        for directed in (None, True, False):
+            for data in (None, {'x': 1}):
+                assert (esort(v.find_edges(label=lbl, directed=directed,
+                                           data=data)) ==
+                        esort(sg.find_edges(label=lbl, directed=directed,
+                                            data=data)))
+            assert (v.size(label=lbl, directed=directed) ==
+                    sg.size(label=lbl, directed=directed))
+    assert v.find_edges(4) == []
+    with pytest.raises(KeyError):
+        v.node(4)
+    with pytest.raises(KeyError):
+        v.edge(4, 1, 'a')
+    assert v.edge(1, 2, 'a') == (1, 2, 'a', {}, True)
+    assert v.is_connected()
+    assert v.shortest_path(2, 1) == [2, 3, 1]
+    assert g.shortest_path(2, 1) == [2, 3, 1]
+    with pytest.raises(KeyError):
+        v.shortest_path(1, 4)
+    # views see changes to the parent
+    g.add_edge(2, 1, 'c')
+    assert v.find_edges(2, 1) == [(2, 1, 'c', {}, True)]
+    assert v.shortest_path(2, 1) == [2, 1]
+
+def test_subgraph_view_edge_filter():
+    g = mixed_graph()
+    v = g.subgraph_view(edge_filter=lambda e: e[2] == 'a')
+    assert v.order() == g.order()
+    assert esort(v.edges()) == esort(g.find_edges(label='a'))
+    assert v.size() == g.size(label='a')
+    assert v.out_degree(1) == 1
+    assert sorted(v.successors(1)) == [2]
+    assert sorted(v.neighbors(1)) == [2, 4]
+    assert v.shortest_path(1, 3) == [1, 2, 3]
+    assert v.shortest_path(3, 1) is None
+    assert csort(v.components()) == [[1, 2, 3, 4], [5], [6]]
+    # nested views combine their restrictions
+    v2 = v.subgraph_view([1, 2, 4], edge_filter=lambda e: e[4])
+    assert esort(v2.edges()) == [(1, 2, 'a', {}, True), (4, 1, 'a', {}, True)]
+    # copies are separate graphs
+    c = v2.copy()
+    assert isinstance(c, mg.MiniGraph)
+    assert esort(c.edges()) == esort(v2.edges())
+    check_counters(c)
+    c.add_edge(1, 2, 'a', data={'y': 1})
+    assert g.edge(1, 2, 'a') == (1, 2, 'a', {}, True)
+
+def snapshot(g):
+    return (sorted(g.nodes(), key=repr), esort(g.edges()),
+            [(n, g.degree(n), g.out_degree(n), g.in_degree(n))
+             for n in sorted(g._graph)])
+
+def test_copy():
+    g = mixed_graph()
+    before = snapshot(g)
+    c = g.copy()
+    assert snapshot(c) == before
+    # nothing is copied until it changes
+    assert all(c._graph[nid] is g._graph[nid] for nid in g._graph)
+    c.add_edge(1, 5, 'new')
+    assert c._graph[1] is not g._graph[1]
+    assert c._graph[2] is g._graph[2]
+    assert snapshot(g) == before
+    assert c.find_edges(1, 5) == [(1, 5, 'new', {}, True)]
+    check_counters(g)
+    check_counters(c)
+
+def test_copy_isolation():
+    # each kind of change on either graph leaves the other unchanged
+    changes = [
+        lambda g: g.add_node(1, {'attr': 'changed'}),
+        lambda g: g.add_node(7),
+        lambda g: g.add_edge(1, 2, 'a', data={'x': 'changed'}),
+        lambda g: g.add_edge(1, 3, 'b', data={'x': 'changed'}, directed=False),
+        lambda g: g.add_edge(6, 1, 'c'),
+        lambda g: g.remove_edge(1, 2, 'a'),
+        lambda g: g.remove_edge(1, 3, 'b'),
+        lambda g: g.remove_node(3),
+        lambda g: g.remove_node(6),
+    ]
+    for change in changes:
+        for changed_copy in (True, False):
+            g = mixed_graph()
+            before = snapshot(g)
+            c = g.copy()
+            changed, other = (c, g) if changed_copy else (g, c)
+            change(changed)
+            assert snapshot(other) == before
+            check_counters(g)
+            check_counters(c)
+            assert csort(g.components()) == csort(
+                mg.MiniGraph(g.nodes(), g.edges()).components())
+            assert csort(c.components()) == csort(
+                mg.MiniGraph(c.nodes(), c.edges()).components())
+
+def test_copy_owned_edges():
+    # after copy(), edge data is copied once, then updated in place
+    g = mixed_graph()
+    c = g.copy()
+    c.add_edge(2, 3, 'a', data={'y': 1})
+    d = c.edge(2, 3, 'a')[3]
+    c.add_edge(2, 3, 'a', data={'y': 2})
+    assert c.edge(2, 3, 'a')[3] is d
+    assert g.edge(2, 3, 'a') == (2, 3, 'a', {'x': 1}, True)
+    c.add_edge(1, 3, 'b', data={'y': 1}, directed=False)
+    d = c.edge(3, 1, 'b')[3]
+    c.add_edge(3, 1, 'b', data={'y': 2}, directed=False)
+    assert c.edge(3, 1, 'b')[3] is d == {'y': 2}
+    assert g.edge(3, 1, 'b')[3] == {}
+    # so are edges added after the copy
+    c.add_edge(5, 6, data={'z': 1})
+    d = c.edge(5, 6)[3]
+    c.add_edge(5, 6, data={'z': 2})
+    assert c.edge(5, 6)[3] is d
+    check_counters(c)
+
+def test_copy_of_copy():
+    g = mixed_graph()
+    c1 = g.copy()
+    c1.add_edge(2, 6)
+    c2 = c1.copy()
+    c2.add_edge(2, 6, data={'x': 1})
+    c1.remove_node(2)
+    assert g.find_edges(2, 6) == []
+    assert c2.edge(2, 6) == (2, 6, None, {'x': 1}, True)
+    assert 2 not in c1._graph
+    assert (g.edge(2, 3, 'a') == c2.edge(2, 3, 'a') ==
+            (2, 3, 'a', {'x': 1}, True))
+    for x in (g, c1, c2):
+        check_counters(x)
+
+def test_shared_empty_data():
+    g = mg.MiniGraph([1, (2, {})], [(1, 2), (2, 3, 'a', {}, False)])
+    data = [n[1] for n in g._graph.values()] + [e[3] for e in g.edges()]
+    # every empty data mapping is the same object
+    assert all(d is data[0] for d in data)
+    assert g.nodes()[0] == (1, {})
+    # data is allocated on the first write and merged afterwards
+    g.add_node(1, {'a': 1})
+    g.add_node(1, {'b': 2})
+    assert g.node(1)[1] == {'a': 1, 'b': 2}
+    assert g.node(2)[1] == {}
+    g.add_edge(1, 2, data={'x': 1})
+    g.add_edge(1, 2, data={'y': 2})
+    assert g.edge(1, 2) == (1, 2, None, {'x': 1, 'y': 2}, True)
+    assert g.node(2)[3][None][1] is g.edge(1, 2)
+    # undirected edges are updated in all four link dicts
+    g.add_edge(3, 2, 'a', data={'z': 3}, directed=False)
+    e = g.edge(2, 3, 'a')
+    assert e == (2, 3, 'a', {'z': 3}, False)
+    assert g.edge(3, 2, 'a') is e
+    assert g.node(2)[3]['a'][3] is e
+    assert g.node(3)[3]['a'][2] is e
+    # empty updates change nothing
+    g.add_node(3, {})
+    g.add_edge(1, 2, data={})
+    assert g.node(3)[1] is data[0]
+    assert g.edge(1, 2)[3] == {'x': 1, 'y': 2}
+    check_counters(g)
+
+def test_generators():
+    def build(edges):
+        g = mg.MiniGraph.fast_init(edges=edges)
+        check_counters(g)
+        return g
+
+    g = build(mg.erdos_renyi(50, 0.1, seed=1, undirected=0.5))
+    assert esort(g.edges()) == esort(
+        mg.MiniGraph.fast_init(edges=mg.erdos_renyi(50, 0.1, seed=1,
+                                                    undirected=0.5)).edges())
+    assert 0 < g.size(directed=False) < g.size()
+    assert mg.MiniGraph.fast_init(
+        edges=mg.erdos_renyi(10, 1.0)).size() == 45
+    assert list(mg.erdos_renyi(10, 0.0)) == []
+
+    g = build(mg.barabasi_albert(100, 2, seed=1))
+    assert g.order() == 100
+    assert g.size() == 2 * 98
+    assert all(g.out_degree(n) == 2 for n in range(2, 100))
+
+    g = build(mg.grid(3, 4))
+    assert g.order() == 12
+    assert g.size() == g.size(directed=False) == 3 * 3 + 2 * 4
+    assert g.is_connected()
+
+    g = build(mg.random_dag(30, 0.3, seed=2))
+    assert all(e[0] < e[1] for e in g.edges())
+
+    g = build(mg.labeled_multigraph(20, 500, seed=3, undirected=0.3))
+    assert set(g.labels()) == {'a', 'b', 'c'}
+    assert 0 < g.size(directed=False) < g.size() <= 500
+
+def test_query_cache():
+    g = mixed_graph()
+    assert g.cache_info() is None
+    g.enable_cache(maxsize=2)
+    edges = g.edges()
+    edges.append(None)  # results are copies
+    assert esort(g.edges()) == esort(mixed_graph().edges())
+    assert g.cache_info() == (1, 1, 2, 1)
+    assert g.find_edges(start=1) == g[1::...]
+    assert g.shortest_path(5, 3, labels=['a', 'b']) == [5, 4, 1, 3]
+    assert g.shortest_path(5, 3, labels=['b', 'a']) == [5, 4, 1, 3]
+    info = g.cache_info()
+    assert info.hits == 3 and info.currsize == 2
+    # unhashable arguments are computed without caching
+    assert len(g.find_edges(data={'x': [1]})) == 0
+    # any change invalidates the cached results
+    g.add_edge(5, 3, 'a')
+    assert g.shortest_path(5, 3, labels=['a', 'b']) == [5, 3]
+    assert esort(g.edges()) == esort(mixed_graph().edges() +
+                                     [(5, 3, 'a', {}, True)])
+    g.remove_node(3)
+    assert g.shortest_path(5, 1) == [5, 4, 1]
+    assert g.all_shortest_paths(5, 2) == [[5, 4, 1, 2]]
+    assert g.shortest_path_lengths(5) == {5: 0, 4: 1, 1: 2, 2: 3}
+    assert sorted(g.nodes(), key=str) == [
+        (1, {'attr': 'val'}), (2, {}), (4, {}), (5, {}), (6, {})]
+    g.disable_cache()
+    assert g.cache_info() is None
+    assert g.copy().cache_info() is None
+
+def test_build_many():
+    edge_lists = [list(mg.labeled_multigraph(10, 30, seed=i, undirected=0.5))
+                  for i in range(20)]
+    edge_lists[3] = [(1, 2, 'a', {'x': 1}), (2, 3, 'b', None, False)]
+    edge_lists[4] = []
+    graphs = mg.build_many(edge_lists, processes=2, chunksize=3)
+    assert len(graphs) == 20
+    for g, edges in zip(graphs, edge_lists):
+        h = mg.MiniGraph(edges=edges)
+        assert g.nodes() == h.nodes()
+        assert esort(g.edges()) == esort(h.edges())
+        check_counters(g)
+    frozen = mg.build_many(edge_lists, processes=2, freeze=True)
+    assert [esort(fg.edges()) for fg in frozen] == [esort(g.edges())
+                                                    for g in graphs]
+    it = mg.iter_build_many(iter(edge_lists), processes=1, chunksize=4)
+    assert esort(next(it).edges()) == esort(graphs[0].edges())
+    assert len(list(it)) == 19
+    with pytest.raises(mg.MiniGraphError):
+        mg.build_many([[(1, 2, None, None, True), (1, 2, None, None, False)]],
+                      processes=1)
+
+def test_serialization(tmp_path):
+    import pickle
+    g = mixed_graph()
+    g.add_node(7, {'y': [2]})
+    g.add_edge(7, 1, label=('tuple', 'label'))
+    h = mg.loads(mg.dumps(g))
+    assert snapshot(h) == snapshot(g)
+    check_counters(h)
+    h = pickle.loads(pickle.dumps(g))
+    assert snapshot(h) == snapshot(g)
+    assert h.shortest_path(5, 7) is None
+    assert h[7] == (7, {'y': [2]}) and h[7][1] is not g[7][1]
+    path = tmp_path / 'g.mg'
+    with path.open('wb') as f:
+        mg.dump(g, f)
+    with path.open('rb') as f:
+        h = mg.load(f)
+    assert snapshot(h) == snapshot(g)
+    assert h.edge(1, 2, 'a')[3] is mg._EMPTY
+    assert mg.loads(mg.dumps(mg.MiniGraph())).order() == 0
+    with pytest.raises(mg.MiniGraphError):
+        mg.loads(b'not a graph')
+
+@pytest.mark.parametrize('format', ['tsv', 'csv', 'jsonl'])
+def test_edge_list_io(format):
+    import io
+    g = mg.MiniGraph(
+        [(1, {'name': 'one'}), 6],
+        [(1, 2), (1, 2, 'a'), (2, 3, 'a', {'x': '1'}),
+         (3, 1, 'b', None, False), (3, 3, 'a', {'x': '2'}, False),
+         (4, 1, 'a')]
+    )
+    f = io.StringIO()
+    mg.write_edges(g, f, format=format, data=['x'], header=True)
+    f.seek(0)
+    if format == 'jsonl':
+        edges = mg.read_edges(f, format, start='start', end='end',
+                              label='label', directed='directed', data='data')
+    else:
+        edges = mg.read_edges(f, format, label='label', directed='directed',
+                              data=['x'], header=True, nodetype=int)
+    h = mg.MiniGraph.fast_init(edges=edges)
+    assert esort(h.edges()) == esort(g.edges())
+    f = io.StringIO()
+    mg.write_nodes(g.freeze(), f, format=format, data=['name'])
+    f.seek(0)
+    if format == 'jsonl':
+        nodes = mg.read_nodes(f, format, id='id', data='data')
+    else:
+        nodes = mg.read_nodes(f, format, data={'name': 1}, nodetype=int)
+    assert sorted(nodes) == sorted(g.nodes())
+
+@pytest.mark.parametrize('format', ['tsv', 'csv', 'jsonl'])
+def test_edge_list_default_columns(format):
+    # the default columns read back what the writers write
+    import io
+    g = mg.MiniGraph(
+        [(1, {'name': 'one'}), 6],
+        [(1, 2), (1, 2, 'a'), (3, 1, 'b', None, False), (4, 1, 'a')]
+    )
+    if format == 'jsonl':
+        g.add_edge(2, 3, 'a', {'x': 1})
+    nodetype = None if format == 'jsonl' else int
+    f = io.StringIO()
+    mg.write_edges(g, f, format=format)
+    f.seek(0)
+    h = mg.MiniGraph(edges=mg.read_edges(f, format, nodetype=nodetype))
+    assert esort(h.edges()) == esort(g.edges())
+    f = io.StringIO()
+    mg.write_nodes(g, f, format=format)
+    f.seek(0)
+    nodes = sorted(mg.read_nodes(f, format, nodetype=nodetype))
+    if format == 'jsonl':
+        assert nodes == sorted(g.nodes())
+    else:
+        assert ([nid for nid, _ in nodes] ==
+                sorted(nid for nid, _ in g.nodes()))
+    # short rows are unlabeled, directed edges
+    if format != 'jsonl':
+        sep = '\t' if format == 'tsv' else ','
+        f = io.StringIO(sep.join('12') + '\n' + sep.join('23a') + '\n')
+        assert list(mg.read_edges(f, format)) == [
+            ('1', '2', None, {}, True), ('2', '3', 'a', {}, True)]
+
+def test_read_edges_columns():
+    import io
+    f = io.StringIO('# comment\tignored\n'
+                    'x\tknows\ty\tno\n'
+                    '\n'
+                    'y\tknows\tz\tyes\n')
+    next(f)
+    edges = list(mg.read_edges(f, start=0, end=2, label=1, directed=3))
+    assert edges == [('x', 'y', 'knows', {}, False),
+                     ('y', 'z', 'knows', {}, True)]
+    f = io.StringIO('a,b,label\n1,2,\n')
+    assert list(mg.read_edges(f, 'csv', start='b', end='a', header=True,
+                              label='label')) == [('2', '1', None, {}, True)]
+    with pytest.raises(mg.MiniGraphError):
+        list(mg.read_edges(io.StringIO('a\tb\n'), directed=1))
+    with pytest.raises(mg.MiniGraphError):
+        list(mg.read_edges(io.StringIO('a,b\n'), 'csv', start='c',
+                           header=True))
+    # TSV has no quoting, so tabs and newlines in values are refused
+    g = mg.MiniGraph(edges=[(1, 2, 'a\tb'), ('x\ny', 2)])
+    for edges in ([(1, 2, 'a\tb')], [('x\ny', 2)],
+                  [(1, 2, None, {'d': 'a\r'})]):
+        with pytest.raises(mg.MiniGraphError):
+            mg.write_edges(mg.MiniGraph(edges=edges), io.StringIO(),
+                           data=['d'])
+    f = io.StringIO()
+    mg.write_edges(g, f, 'csv')
+    f.seek(0)
+    assert esort(mg.read_edges(f, 'csv', label=2)) == esort(
+        [('1', '2', 'a\tb', {}, True), ('x\ny', '2', None, {}, True)])
+
+def relabeled(g, seed=1):
+    import random
+    nids = [nid for nid, _ in g.nodes()]
+    new = list(range(100, 100 + len(nids)))
+    random.Random(seed).shuffle(new)
+    m = dict(zip(nids, new))
+    edges = [(m[s], m[e], l, d, dr) for s, e, l, d, dr in g.edges()]
+    random.Random(seed).shuffle(edges)
+    return mg.MiniGraph([(m[nid], d) for nid, d in g.nodes()], edges)
+
+def test_isomorphism():
+    g = mixed_graph()
+    h = relabeled(g)
+    assert g.canonical_hash() == h.canonical_hash()
+    assert g.is_isomorphic(h) and h.is_isomorphic(g)
+    assert g.copy().canonical_hash() == g.canonical_hash()
+    assert mg.MiniGraph().is_isomorphic(mg.MiniGraph())
+    # direction, labels, and node data all matter
+    g1 = mg.MiniGraph(edges=[(1, 2)])
+    assert g1.is_isomorphic(mg.MiniGraph(edges=[(2, 1)]))
+    for edges in ([(1, 2, None, None, False)], [(1, 2, 'a')], [(1, 1)]):
+        other = mg.MiniGraph(edges=edges)
+        assert other.canonical_hash() != g1.canonical_hash()
+        assert not other.is_isomorphic(g1)
+    assert not mg.MiniGraph([(1, {'x': 1})]).is_isomorphic(
+        mg.MiniGraph([(1, {'x': 2})]))
+    # the hash is invalidated by mutation
+    before = h.canonical_hash()
+    h.add_edge(100, 101, 'c')
+    assert h.canonical_hash() != before
+    assert not g.is_isomorphic(h)
+    h.remove_edge(100, 101, 'c')
+    assert h.canonical_hash() == before
+    # regular graphs that WL refinement cannot tell apart: two
+    # triangles and a hexagon
+    triangles = mg.MiniGraph(edges=[(0, 1, None, None, False),
+                                    (1, 2, None, None, False),
+                                    (2, 0, None, None, False),
+                                    (3, 4, None, None, False),
+                                    (4, 5, None, None, False),
+                                    (5, 3, None, None, False)])
+    hexagon = mg.MiniGraph(edges=[(i, (i + 1) % 6, None, None, False)
+                                  for i in range(6)])
+    assert triangles.canonical_hash() == hexagon.canonical_hash()
+    assert not triangles.is_isomorphic(hexagon)
+    assert hexagon.is_isomorphic(relabeled(hexagon, seed=3))
+    g = mg.MiniGraph(edges=mg.grid(6, 7, seed=2, undirected=0.5))
+    assert g.is_isomorphic(relabeled(g, seed=5))
+
+def brute_force_match(g, constraints):
+    from itertools import product
+    variables = sorted(set(v for c in constraints for v in c[:2]))
+    nids = [nid for nid, _ in g.nodes()]
+    matches = []
+    for ns in product(nids, repeat=len(variables)):
+        b = dict(zip(variables, ns))
+        if all(g.find_edges(b[s], b[t], label=l) or
+               any(e[4] is False for e in g.find_edges(b[t], b[s], label=l))
+               for s, t, l in constraints):
+            matches.append(b)
+    return matches
+
+def test_match():
+    g = mg.MiniGraph(edges=mg.labeled_multigraph(30, 90, labels='abc',
+                                                 seed=4, undirected=0.3))
+    bsort = lambda bs: sorted(sorted(b.items()) for b in bs)
+    for pattern in ([('x', 'y', 'a'), ('z', 'y', 'b')],
+                    [('x', 'y', 'a'), ('y', 'z', 'a'), ('z', 'x', 'c')],
+                    [('x', 'y', Ellipsis), ('y', 'x', 'b')],
+                    [('x', 'x', 'a')]):
+        expected = brute_force_match(g, pattern)
+        assert bsort(g.match(pattern)) == bsort(expected)
+    g = mixed_graph()
+    assert bsort(g.match([('x', 'y', 'a'), ('y', 'z')])) == bsort(
+        brute_force_match(g, [('x', 'y', 'a'), ('y', 'z', Ellipsis)]))
+    assert bsort(g.match([('x', 'y', Ellipsis, None, False)])) == bsort([
+        {'x': 3, 'y': 1}, {'x': 1, 'y': 3}, {'x': 3, 'y': 3}])
+    assert list(g.match([('x', 'y', 'a', {'x': 2})])) == [{'x': 3, 'y': 3}]
+    assert list(g.match([('x', 'y', 'a')], nodes={'y': {'attr': 'val'}})) \
+        == [{'x': 4, 'y': 1}]
+    assert list(g.match([('x', 'y')], bindings={'x': 5})) == [{'x': 5, 'y': 4}]
+    assert list(g.match([('x', 'y')], bindings={'x': 99})) == []
+    p = mg.MiniGraph([('v', {'attr': 'val'}), ('w', None)],
+                     [('u', 'v', 'a'), ('v', 'u', 'b', None, False)])
+    assert list(g.match(p)) == []
+    p.remove_edge('u', 'v', 'a')
+    assert bsort(g.match(p)) == bsort([{'u': 3, 'v': 1, 'w': n}
+                                       for n in range(1, 7)])
+    with pytest.raises(mg.MiniGraphError):
+        list(g.match([('x',)]))
+
+def test_topological_sort():
+    g = mg.MiniGraph(edges=mg.random_dag(40, 0.1, seed=3))
+    g.add_edge(0, 39, directed=False)  # undirected edges are ignored
+    order = g.topological_sort()
+    pos = dict((nid, i) for i, nid in enumerate(order))
+    assert sorted(order) == list(range(40))
+    assert all(pos[s] < pos[e] for s, e, _, _, d in g.edges() if d)
+    assert g.find_cycle() is None
+    g.add_edge(order[-1], order[0])
+    g.add_edge(order[-1], order[-2])
+    cycle = g.find_cycle()
+    assert cycle is not None
+    for i, nid in enumerate(cycle):
+        assert cycle[(i + 1) % len(cycle)] in g.successors(nid)
+    with pytest.raises(mg.MiniGraphError):
+        g.topological_sort()
+    assert mg.MiniGraph(edges=[(1, 1)]).find_cycle() == [1]
+
+def test_reachability():
+    g = mg.MiniGraph(edges=mg.random_dag(60, 0.05, seed=7))
+    g.add_edge(0, 59, directed=False)
+    h = g.copy()
+    h.enable_reachability_index()
+
+    def check():
+        for a, _ in g.nodes():
+            assert h.descendants(a) == g.descendants(a)
+            assert h.ancestors(a) == g.ancestors(a)
+            for b, _ in g.nodes():
+                assert h.reachable(a, b) == g.reachable(a, b)
+
+    check()
+    assert h.descendants(0) == set(
+        nid for nid, _ in g.nodes() if nid and g.reachable(0, nid))
+    # indexes are patched on additions and rebuilt after removals
+    for graph in (g, h):
+        graph.add_edge(1, 58)
+        graph.add_node(60)
+        graph.add_edges([(60, 2), (3, 61)])
+    assert h._reach.version == h._version
+    check()
+    for graph in (g, h):
+        graph.remove_edge(1, 58)
+        graph.remove_node(30)
+    check()
+    # with a cycle, queries traverse the graph
+    for graph in (g, h):
+        graph.add_edge(2, 60)
+    assert h.reachable(60, 2) and h.reachable(2, 60)
+    assert 60 in h.descendants(60) and 60 in h.ancestors(60)
+    check()
+    with pytest.raises(mg.MiniGraphError):
+        h.enable_reachability_index()
+    with pytest.raises(KeyError):
+        h.reachable(0, 99)
+
+def test_strongly_connected_components():
+    import sys
+    g = mixed_graph()
+    comps = list(g.strongly_connected_components())
+    assert sorted(map(sorted, comps)) == [[1, 2, 3], [4], [5], [6]]
+    assert comps.index({1, 2, 3}) < comps.index({4}) < comps.index({5})
+    c = g.condensation()
+    members = dict((nid, d['members']) for nid, d in c.nodes())
+    assert sorted(map(sorted, members.values())) == [[1, 2, 3], [4], [5], [6]]
+    assert c.find_cycle() is None
+    pos = dict((nid, i) for i, nid in enumerate(c.topological_sort()))
+    assert all(pos[s] < pos[e] for s, e, _, _, _ in c.edges())
+    assert all(s < e for s, e, _, _, _ in c.edges())
+    key = lambda nid: min(members[nid])
+    assert sorted((key(s), key(e), l) for s, e, l, _, _ in c.edges()) == [
+        (4, 1, 'a'), (5, 4, 'b')]
+    # long chains do not hit the recursion limit
+    n = 5 * sys.getrecursionlimit()
+    g = mg.MiniGraph(edges=[(i, i + 1) for i in range(n)] + [(n, 0)])
+    assert [len(comp) for comp in g.strongly_connected_components()] == [n + 1]
+    g = mg.MiniGraph(edges=mg.labeled_multigraph(40, 60, labels='ab', seed=2,
+                                                 undirected=0.1))
+    for comp in g.strongly_connected_components():
+        a = next(iter(comp))
+        reach = g.shortest_path_lengths(a)
+        assert all(a in g.shortest_path_lengths(b) for b in comp)
+        assert all(b in comp for b in reach if a in g.shortest_path_lengths(b))
+
+def test_data_indexes():
+    g = mg.MiniGraph(
+        [(1, {'pos': 'v'}), (2, {'pos': 'n'}), (3, {'pos': 'v', 'x': [1]}),
+         (4, {'pos': [1]})],
+        [(1, 2, 'a', {'w': 1}), (2, 3, 'b', {'w': 2}),
+         (3, 1, 'a', {'w': 1}, False), (1, 4)])
+    h = g.copy()
+    h.create_node_index('pos')
+    h.create_edge_index('w')
+
+    def check():
+        for pos in ('v', 'n', 'x', [1]):
+            assert sorted(h.find_nodes(pos=pos)) == \
+                sorted(g.find_nodes(pos=pos))
+        assert sorted(h.find_nodes(pos='v', x=[1])) == \
+            sorted(g.find_nodes(pos='v', x=[1]))
+        for w in (1, 2, 3):
+            for label in (Ellipsis, 'a', 'b'):
+                assert esort(h.find_edges(label=label, data={'w': w})) == \
+                    esort(g.find_edges(label=label, data={'w': w}))
+
+    check()
+    assert sorted(h.find_nodes(pos='v')) == [(1, {'pos': 'v'}),
+                                            (3, {'pos': 'v', 'x': [1]})]
+    assert esort(h.find_edges(data={'w': 1})) == [
+        (1, 2, 'a', {'w': 1}, True), (3, 1, 'a', {'w': 1}, False)]
+    for graph in (g, h):
+        graph.add_node(2, {'pos': 'v'})
+        graph.add_node(5, {'pos': 'n'})
+        graph.add_edge(1, 3, 'a', {'w': 2}, False)  # updates (3, 1, 'a')
+        graph.add_edge(5, 1, 'c', {'w': 3})
+    check()
+    assert esort(h.find_edges(data={'w': 2})) == [
+        (2, 3, 'b', {'w': 2}, True), (3, 1, 'a', {'w': 2}, False)]
+    for graph in (g, h):
+        graph.remove_edge(2, 3, 'b')
+        graph.remove_edges([(5, 1, 'c')])
+        graph.remove_node(1)
+    check()
+    assert h.find_edges(data={'w': 1}) == []
+    assert sorted(h.find_nodes(pos='v')) == [(2, {'pos': 'v'}),
+                                            (3, {'pos': 'v', 'x': [1]})]
+    # copies have their own indexes
+    c = h.copy()
+    c.add_node(6, {'pos': 'v'})
+    assert len(c.find_nodes(pos='v')) == 3 and len(h.find_nodes(pos='v')) == 2
+    h.drop_node_index('pos')
+    h.drop_edge_index('w')
+    check()
+
+def test_journal():
+    g = mixed_graph()
+    g.enable_journal()
+    replica = g.copy()
+    g.add_node(7, {'z': 1})
+    g.add_node(1, {'attr': 'new'})
+    g.add_edges([(7, 1, 'c', {'w': 1}), (1, 2, 'a', {'x': 3}), (8, 9)])
+    g.remove_edge(4, 1, 'a')
+    g.remove_edges([(3, 1, 'b'), (8, 9)])
+    g.remove_nodes([5, 9])
+    changes = g.journal(clear=True)
+    assert changes[0] == ('add_node', 7, {'z': 1})
+    assert changes[2] == ('add_edge', 7, 1, 'c', {'w': 1}, True)
+    assert ('remove_edge', 3, 1, 'b') in changes
+    assert g.journal() == []
+    replica.replay(changes)
+    assert snapshot(replica) == snapshot(g)
+    check_counters(replica)
+    with pytest.raises(mg.MiniGraphError):
+        replica.replay([('frobnicate', 1)])
+    g.disable_journal()
+    assert g.journal() is None
+
+def test_transaction():
+    g = mixed_graph()
+    g.create_node_index('attr')
+    g.create_edge_index('x')
+    g.enable_journal()
+    before = snapshot(g)
+    with pytest.raises(mg.MiniGraphError):
+        with g.transaction():
+            g.add_node(1, {'attr': 'changed'})
+            g.add_node(7)
+            g.add_edge(2, 3, 'a', {'x': 5})
+            g.remove_nodes([4, 6])
+            g.remove_edge(3, 1, 'b')
+            with g.transaction():
+                g.add_edge(8, 1)
+            # fails after the first edge was added
+            g.add_edges([(1, 9), (3, 1, 'b', None, False), (1, 3, 'b')])
+    assert snapshot(g) == before
+    check_counters(g)
+    assert g.journal() == []
+    assert g.find_nodes(attr='val') == [(1, {'attr': 'val'})]
+    assert esort(g.find_edges(data={'x': 1})) == [(2, 3, 'a', {'x': 1}, True)]
+    assert g.find_edges(data={'x': 5}) == []
+    # a failed inner transaction only undoes its own changes
+    with g.transaction():
+        g.add_node(7)
+        try:
+            with g.transaction():
+                g.add_edge(7, 1)
+                raise ValueError
+        except ValueError:
+            pass
+    assert g[7] == (7, {}) and g.degree(7) == 0
+    assert g.journal() == [('add_node', 7, None)]
+    # copies roll back without touching the original
+    h = g.copy()
+    with pytest.raises(KeyError):
+        with h.transaction():
+            h.add_edge(1, 2, 'a', {'x': 0})
+            h.remove_node(99)
+    assert snapshot(h) == snapshot(g)
+    assert g.edge(1, 2, 'a')[3] == {}
+
+def test_diff():
+    import random
+    g1 = mg.MiniGraph(edges=mg.labeled_multigraph(30, 80, labels='ab', seed=5,
+                                                  undirected=0.3))
+    g2 = g1.copy()
+    assert mg.diff(g1, g2) == mg.GraphDelta([], [], [], [], [], [])
+    rnd = random.Random(5)
+    g2.remove_nodes(rnd.sample(sorted(nid for nid, _ in g2.nodes()), 3))
+    g2.remove_edges(rnd.sample(esort(g2.edges()), 5))
+    g2.add_node(100, {'new': True})
+    g2.add_node(1, {'changed': 1})
+    g2.add_edges([(100, 1, 'a', {'w': 1}), (2, 100, 'b', None, False)])
+    e = next(e for e in esort(g2.edges()) if e[0] != 100)
+    g2.add_edge(e[0], e[1], e[2], {'w': 2}, e[4])
+    delta = mg.diff(g1, g2)
+    assert delta.added_nodes == [(100, {'new': True})]
+    assert delta.changed_nodes == [(1, {'changed': 1})]
+    assert (e[0], e[1], e[2], {'w': 2}, e[4]) in delta.changed_edges
+    h = g1.copy()
+    mg.apply_patch(h, delta)
+    assert snapshot(h) == snapshot(g2)
+    check_counters(h)
+    assert mg.diff(h, g2) == mg.GraphDelta([], [], [], [], [], [])
+    # patches are applied in the other direction too
+    back = mg.diff(g2, g1)
+    mg.apply_patch(h, back)
+    assert snapshot(h) == snapshot(g1)
+
+def test_diff_edges():
+    g1 = mg.MiniGraph([(1, {'a': 1, 'b': 2})],
+                      [(1, 2, 'x', {'w': 1, 'v': 2}), (2, 3, 'y', None, False),
+                       (3, 4), (4, 5)])
+    g2 = mg.MiniGraph([(1, {'a': 1})],
+                      [(1, 2, 'x', {'w': 1}), (3, 2, 'y', None, False),
+                       (3, 4, None, None, False), (5, 4)])
+    delta = mg.diff(g1, g2)
+    assert delta.changed_nodes == [(1, {'a': 1})]
+    # undirected edges are the same in either direction
+    assert sorted(delta.removed_edges) == [(3, 4, None, True),
+                                           (4, 5, None, True)]
+    assert esort(delta.added_edges) == [(3, 4, None, {}, False),
+                                        (5, 4, None, {}, True)]
+    assert delta.changed_edges == [(1, 2, 'x', {'w': 1}, True)]
+    g1.enable_journal()
+    mg.apply_patch(g1, delta)
+    assert mg.diff(g1, g2) == mg.GraphDelta([], [], [], [], [], [])
+    assert g1[1] == (1, {'a': 1}) and g1.edge(1, 2, 'x')[3] == {'w': 1}
+    replica = mg.MiniGraph([(1, {'a': 1, 'b': 2})],
+                           [(1, 2, 'x', {'w': 1, 'v': 2}),
+                            (2, 3, 'y', None, False), (3, 4), (4, 5)])
+    replica.replay(g1.journal())
+    assert snapshot(replica) == snapshot(g1)
+    # a patch that does not fit leaves the graph unchanged
+    before = snapshot(g2)
+    with pytest.raises(KeyError):
+        mg.apply_patch(g2, mg.GraphDelta([(9, None)], [], [], [], [],
+                                         [(7, 8, None, {}, True)]))
+    assert snapshot(g2) == before